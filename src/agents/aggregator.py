@@ -1,8 +1,9 @@
 import time
-import litellm
 from core.state import NexusState, TraceEntry
-from core.config import AGGREGATOR_MODEL
+from core.config import AGGREGATOR_MODEL, AGGREGATION_SKIP_MAX_CHARS
 from core.metrics import calculate_cost
+from core.llm import stream_completion
+from core.scheduler import track_queue_wait
 
 
 async def aggregator_node(state: NexusState) -> dict:
@@ -11,41 +12,70 @@ async def aggregator_node(state: NexusState) -> dict:
     worker_responses = state.get("worker_responses", [])
     subtasks = state.get("subtasks", [])
 
-    # Format context with subtask labels
-    parts = []
-    for i, w in enumerate(worker_responses):
-        label = subtasks[i] if i < len(subtasks) else f"Agent {i+1}"
-        parts.append(f"[{label}]: {w.get('response', '')}")
+    labelled = [(subtasks[i] if i < len(subtasks) else f"Agent {i+1}", w) for i, w in enumerate(worker_responses)]
+    answered = [(label, w) for label, w in labelled if not w.get("error")]
+    if answered:
+        skipped = _merge_without_llm(answered, len(labelled))
+        if skipped:
+            return skipped
+
+    # Format context with subtask labels; failed or dropped subtasks are left out if any answered
+    parts = [f"[{label}]: {w.get('response', '')}" for label, w in (answered or labelled)]
     combined_context = "\n\n".join(parts)
 
+    queue = track_queue_wait()
     try:
         start = time.time()
-        response = await litellm.acompletion(
+        aggregated_content, response, _, aggregator_model = await stream_completion(
             model=AGGREGATOR_MODEL,
             messages=[
                 {"role": "system", "content": "Merge these agent responses. No redundancy. Preserve all insights."},
                 {"role": "user", "content": f"Query: {query}\n\nAgent responses:\n{combined_context}"},
             ],
+            node="aggregator",
         )
         latency_ms = (time.time() - start) * 1000
-        aggregated_content = response.choices[0].message.content
-        cost = calculate_cost(AGGREGATOR_MODEL, response)
+        cost = calculate_cost(aggregator_model, response)
 
     except Exception as e:
         aggregated_content = f"Error during aggregation: {str(e)}\n\nRaw outputs:\n{combined_context}"
+        aggregator_model = AGGREGATOR_MODEL
         cost = 0.0
         latency_ms = 0.0
 
     trace_entry: TraceEntry = {
         "node": "aggregator",
         "action": "merged",
-        "detail": f"Merged {len(worker_responses)} responses using {AGGREGATOR_MODEL}",
+        "detail": f"Merged {len(parts)} responses using {aggregator_model}",
         "timestamp": time.time(),
+        "queue_wait_ms": round(queue["wait_ms"], 2),
     }
 
     return {
         "aggregated_response": aggregated_content,
         "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + cost,
-        "total_latency": state.get("total_latency", 0.0) + (latency_ms / 1000),
+        "total_cost": cost,
+        "total_latency": latency_ms / 1000,
+    }
+
+
+def _merge_without_llm(answered: list[tuple[str, dict]], total: int) -> dict | None:
+    """The aggregation-free path: a lone answer is used as is, and answers short enough in total
+    (AGGREGATION_SKIP_MAX_CHARS) are joined under their subtask headings. None = needs the LLM."""
+    if len(answered) == 1:
+        content = answered[0][1].get("response", "")
+        detail = f"Only {len(answered)} of {total} subtasks answered; used it without merging"
+    elif sum(len(w.get("response", "")) for _, w in answered) <= AGGREGATION_SKIP_MAX_CHARS:
+        content = "\n\n".join(f"**{label}**\n{w.get('response', '')}" for label, w in answered)
+        detail = f"Joined {len(answered)} short responses without an LLM call"
+    else:
+        return None
+
+    trace_entry: TraceEntry = {
+        "node": "aggregator",
+        "action": "skipped",
+        "detail": detail,
+        "timestamp": time.time(),
+        "latency_ms": 0.0,
     }
+    return {"aggregated_response": content, "trace": [trace_entry]}
@@ -1,10 +1,11 @@
 import json
 import time
 import re
-import litellm
 from core.state import NexusState, TraceEntry
 from core.config import MODEL_CLASSIFIER
 from core.metrics import calculate_cost
+from core.llm import complete
+from core.scheduler import track_queue_wait
 
 
 def _is_greeting_or_smalltalk(query: str) -> bool:
@@ -53,19 +54,21 @@ Return ONLY JSON. No markdown, no explanation.
 
 Query: {query}"""
 
+    queue = track_queue_wait()
     try:
         start = time.time()
-        response = await litellm.acompletion(
+        response, classifier_model = await complete(
             model=MODEL_CLASSIFIER,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"},
+            node="classifier",
         )
         latency_ms = (time.time() - start) * 1000
         content = response.choices[0].message.content
         result = json.loads(content)
 
         # Track cost
-        cost = calculate_cost(MODEL_CLASSIFIER, response)
+        cost = calculate_cost(classifier_model, response)
 
     except Exception as e:
         # Fallback defaults if LLM fails
@@ -99,6 +102,8 @@ Query: {query}"""
         "action": "classified",
         "detail": f"self={can_self_answer} ambiguous={is_ambiguous} critical={result.get('is_critical', False)} subtasks={len(subtasks)}",
         "timestamp": time.time(),
+        "latency_ms": round(latency_ms, 2),
+        "queue_wait_ms": round(queue["wait_ms"], 2),
     }
 
     output = {
@@ -109,8 +114,8 @@ Query: {query}"""
         "subtasks": subtasks,
         "original_query": query,
         "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + cost,
-        "total_latency": state.get("total_latency", 0.0) + (latency_ms / 1000),
+        "total_cost": cost,
+        "total_latency": latency_ms / 1000,
     }
 
     # If can_self_answer, set final_response directly
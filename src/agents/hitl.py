@@ -33,6 +33,4 @@ def hitl_node(state: NexusState) -> dict:
         "enriched_query": enriched,
         "conversation_turns": state.get("conversation_turns", 0) + 1,
         "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0),
-        "total_latency": state.get("total_latency", 0.0),
     }
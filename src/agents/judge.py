@@ -1,24 +1,93 @@
+import re
 import json
 import time
-import litellm
+import random
+import asyncio
 from core.state import NexusState, TraceEntry
-from core.config import JUDGE_MODEL, JUDGE_THRESHOLD, MAX_ESCALATIONS, MODEL_OPUS
-from core.metrics import calculate_cost
+from core.config import (
+    JUDGE_MODEL, JUDGE_THRESHOLD, MAX_ESCALATIONS, MODEL_OPUS, LATENCY_WINDOW,
+    JUDGE_PRESCREEN, JUDGE_SAMPLE_RATE, JUDGE_LENGTH_RATIO, JUDGE_LENGTH_MIN_SAMPLES,
+    SPECULATIVE_ESCALATION, SPECULATIVE_ESCALATION_MIN_REJECT_RATE, SPECULATIVE_ESCALATION_MIN_SAMPLES,
+)
+from core.latency import LatencyTracker
+from core.metrics import (
+    calculate_cost, estimate_prompt_cost, route_rejection_rate, JUDGE_STATS, ROUTE_JUDGE_STATS, ESCALATION_STATS,
+)
+from core.llm import complete, stream_completion, emit_event
+from core.scheduler import track_queue_wait
+from agents.knn_router import learn_prototype
 
-async def judge_node(state: NexusState) -> dict:
-    """Evaluate response quality and approve or trigger escalation."""
-    
-    query = state.get("enriched_query") or state.get("query", "")
-    
-    # Evaluate previously generated content
-    if state.get("aggregated_response"):
-        response_to_evaluate = state.get("aggregated_response")
-    elif state.get("worker_responses"):
-        worker_responses = state.get("worker_responses", [])
-        response_to_evaluate = worker_responses[-1].get("response", "") if worker_responses else "No response."
+
+async def _learn_route(state: NexusState) -> None:
+    """Judge-approved routes become new KNN prototypes (per subtask for multi-part queries)."""
+    selected_models = state.get("selected_models", []) or []
+    subtasks = state.get("subtasks", []) or []
+    if subtasks:
+        examples = list(zip(subtasks, selected_models))
     else:
-        response_to_evaluate = "No response generated."
-        
+        query = state.get("enriched_query") or state.get("query", "")
+        examples = [(query, selected_models[0])] if selected_models else []
+
+    for text, model in examples:
+        try:
+            await learn_prototype(text, model)
+        except Exception as e:
+            print(f"Online prototype learning failed: {e}")
+
+# Lengths (chars) of approved answers per route, the norm for the pre-screen's length check
+ROUTE_LENGTHS = LatencyTracker(LATENCY_WINDOW)
+
+_ERROR_PREFIXES = ("Error:", "Error during aggregation", "Escalation failed", "[timeout]", "[dropped")
+_REFUSAL = re.compile(
+    r"^\W*(?:(?:i'?m|i am) sorry,?\s*(?:but\s*)?)?(?:i can(?:not|'t|’t)|i am unable to|i'?m unable to|i won'?t)"
+    r"\s+(?:help|assist|provide|comply|answer|do that)",
+    re.IGNORECASE,
+)
+_UNSURE = re.compile(r"\b(i'?m not sure|i don'?t know|not enough information|cannot be determined)\b", re.IGNORECASE)
+
+
+def _route_key(state: NexusState) -> str:
+    """Length norms are kept per route: the routed model, or "aggregate" for merged answers."""
+    if state.get("aggregated_response"):
+        return "aggregate"
+    selected = state.get("selected_models", []) or []
+    return selected[0] if selected else "unknown"
+
+
+def prescreen(text: str, route: str, finish_reason: str | None = None) -> tuple[str, str]:
+    """Local, LLM-free first tier of the judge.
+
+    Returns:
+        (verdict, reason) — verdict is "fail" (obvious failure), "pass" (clean) or
+        "borderline" (needs the LLM judge)
+    """
+    stripped = (text or "").strip()
+    if not stripped or stripped == "No response generated.":
+        return "fail", "empty response"
+    if stripped.startswith(_ERROR_PREFIXES):
+        return "fail", f"error output: {stripped[:60]}"
+    if finish_reason == "length" or stripped.count("```") % 2:
+        return "fail", "truncated output"
+    if _REFUSAL.search(stripped[:200]):
+        return "fail", "refusal"
+
+    median = ROUTE_LENGTHS.percentile(route, "chars", 50, JUDGE_LENGTH_MIN_SAMPLES)
+    if median is None:
+        return "borderline", f"no length norm for {route} yet"
+    ratio = len(stripped) / max(median, 1.0)
+    if ratio < 1 / JUDGE_LENGTH_RATIO or ratio > JUDGE_LENGTH_RATIO:
+        return "fail", f"length {len(stripped)} chars vs route median {median:.0f}"
+    if ratio < JUDGE_LENGTH_RATIO ** -0.5 or ratio > JUDGE_LENGTH_RATIO ** 0.5:
+        return "borderline", f"length {len(stripped)} chars vs route median {median:.0f}"
+    if _UNSURE.search(stripped):
+        return "borderline", "uncertain answer"
+    if stripped[-1].isalnum():
+        return "borderline", "ends mid-sentence"
+    return "pass", "clean"
+
+
+async def _llm_judge(query: str, response_to_evaluate: str) -> tuple[dict, float, float]:
+    """The LLM tier. Returns (result, cost, latency_ms); a failed call yields a failing result."""
     prompt = f"""Evaluate the agent's response to the original query.
 Return your evaluation in JSON format containing ONLY these keys:
 - score: float (0 to 10 scale of overall quality)
@@ -30,24 +99,24 @@ Return your evaluation in JSON format containing ONLY these keys:
 Original Query: {query}
 Agent Response: {response_to_evaluate}
 """
-    
     try:
         start = time.time()
-        response = await litellm.acompletion(
+        response, judge_model = await complete(
             model=JUDGE_MODEL,
             messages=[
                 {"role": "system", "content": f"You are a critical evaluation judge. If the score is below {JUDGE_THRESHOLD}, you must provide failure_reason and retry_instruction."},
                 {"role": "user", "content": prompt}
             ],
-            response_format={"type": "json_object"}
+            response_format={"type": "json_object"},
+            node="judge",
         )
         latency_ms = (time.time() - start) * 1000
         content = response.choices[0].message.content
         result = json.loads(content)
-        cost = calculate_cost(JUDGE_MODEL, response)
-            
+        cost = calculate_cost(judge_model, response)
+
     except Exception as e:
-        # Failsafe fallback 
+        # Failsafe fallback
         result = {
             "score": 0.0,
             "failure_reason": f"Evaluation system error: {str(e)}",
@@ -56,70 +125,336 @@ Agent Response: {response_to_evaluate}
         }
         cost = 0.0
         latency_ms = 0.0
-        
+    return result, cost, latency_ms
+
+
+async def evaluate(query: str, text: str, route: str, finish_reason: str | None = None,
+                   speculate=None) -> dict:
+    """Both judge tiers for one answer: prescreen() first, the LLM judge for borderline
+    (and sampled clean) answers. Updates JUDGE_STATS, the route's length norm and its
+    rejection count. `speculate` (a coroutine function) is started as a task right before
+    a borderline answer's LLM judge call, so it runs concurrently with the judge.
+
+    Returns:
+        {"result", "score", "passed", "tier", "reason", "sampled", "cost", "latency_ms", "saved_s",
+        "speculative_task"} where tier is "prescreen", "llm" or "sampled"
+    """
+    verdict, reason = prescreen(text, route, finish_reason) if JUDGE_PRESCREEN else ("borderline", "")
+    sampled = verdict == "pass" and random.random() < JUDGE_SAMPLE_RATE
+    JUDGE_STATS["judged"] += 1
+
+    cost, latency_ms = 0.0, 0.0
+    speculative_task = None
+    if verdict == "fail":
+        tier = "prescreen"
+        result = {
+            "score": 0.0,
+            "failure_reason": f"Pre-screen: {reason}",
+            "retry_instruction": f"The previous answer failed a basic check ({reason}). Give a complete, direct answer.",
+            "escalate_to": MODEL_OPUS,
+        }
+        JUDGE_STATS["prescreen_rejected"] += 1
+    elif verdict == "pass" and not sampled:
+        # Nominal passing score: the answer was approved without an LLM grade
+        tier = "prescreen"
+        result = {"score": JUDGE_THRESHOLD, "failure_reason": ""}
+        JUDGE_STATS["prescreen_approved"] += 1
+    else:
+        tier = "sampled" if sampled else "llm"
+        if speculate is not None and not sampled:
+            speculative_task = asyncio.create_task(speculate())
+        try:
+            result, cost, latency_ms = await _llm_judge(query, text)
+        except asyncio.CancelledError:
+            if speculative_task:
+                speculative_task.cancel()
+            raise
+        JUDGE_STATS["llm_sampled" if sampled else "llm_borderline"] += 1
+        JUDGE_STATS["llm_latency_s"] += latency_ms / 1000
+
+    llm_calls = JUDGE_STATS["llm_borderline"] + JUDGE_STATS["llm_sampled"]
+    saved_s = 0.0
+    if tier == "prescreen" and llm_calls:
+        # Valued at the mean LLM judge round trip seen so far
+        saved_s = JUDGE_STATS["llm_latency_s"] / llm_calls
+        JUDGE_STATS["latency_saved_s"] += saved_s
+
     score = result.get("score", 0.0)
     passed = score >= JUDGE_THRESHOLD
-    
+    if sampled and not passed:
+        JUDGE_STATS["sampled_disagreements"] += 1
+    ROUTE_JUDGE_STATS[route]["judged"] += 1
+    ROUTE_JUDGE_STATS[route]["rejected"] += not passed
+    if passed:
+        ROUTE_LENGTHS.record(route, "chars", len((text or "").strip()))
+
+    return {
+        "result": result,
+        "score": score,
+        "passed": passed,
+        "tier": tier,
+        "reason": reason,
+        "sampled": sampled,
+        "cost": cost,
+        "latency_ms": latency_ms,
+        "saved_s": saved_s,
+        "speculative_task": speculative_task,
+    }
+
+
+async def judge_node(state: NexusState) -> dict:
+    """Evaluate response quality and approve or trigger escalation.
+
+    With JUDGE_PRESCREEN the local prescreen() decides obvious failures and clean answers;
+    only borderline ones (plus a JUDGE_SAMPLE_RATE sample of clean ones) reach the LLM judge.
+    """
+    query = state.get("enriched_query") or state.get("query", "")
+
+    # Evaluate previously generated content
+    finish_reason = None
+    if state.get("aggregated_response"):
+        response_to_evaluate = state.get("aggregated_response")
+    elif state.get("worker_responses"):
+        worker_responses = state.get("worker_responses", [])
+        response_to_evaluate = worker_responses[-1].get("response", "") if worker_responses else "No response."
+        finish_reason = worker_responses[-1].get("finish_reason") if worker_responses else None
+    else:
+        response_to_evaluate = "No response generated."
+
+    route = _route_key(state)
+    speculate = None
+    if _should_speculate(state, route):
+        async def speculate():
+            return await _escalate(query, _SPECULATIVE_INSTRUCTION, MODEL_OPUS)
+
+    queue = track_queue_wait()
+    verdict = await evaluate(query, response_to_evaluate, route, finish_reason, speculate)
+    result, score, passed = verdict["result"], verdict["score"], verdict["passed"]
+    tier, reason, saved_s = verdict["tier"], verdict["reason"], verdict["saved_s"]
+    cost, latency_ms = verdict["cost"], verdict["latency_ms"]
+
+    prefetch, wasted = None, 0.0
+    if verdict["speculative_task"] is not None:
+        prefetch, wasted = await _settle_speculation(verdict["speculative_task"], passed, query)
+        if prefetch:
+            prefetch["overlap_ms"] = round(latency_ms, 2)
+
+    if tier == "prescreen":
+        action = "prescreen_approved" if passed else "prescreen_rejected"
+        detail = f"Pre-screen: {reason}" + (f" (saved ~{saved_s:.2f}s LLM judge)" if saved_s else "")
+    else:
+        action = "approved" if passed else "rejected"
+        detail = f"Score {score:.1f}. " + (f"Passed." if passed else f"Reason: {result.get('failure_reason')}")
+        if reason:
+            detail += f" [{'sampled' if verdict['sampled'] else 'borderline'}: {reason}]"
+    if verdict["speculative_task"] is not None:
+        detail += f" Speculative escalation {'kept' if prefetch else 'cancelled'}"
+        detail += f" (wasted ${wasted:.6f})." if wasted else "."
     trace_entry: TraceEntry = {
         "node": "judge",
-        "action": "approved" if passed else "rejected",
-        "detail": f"Score {score:.1f}. " + (f"Passed." if passed else f"Reason: {result.get('failure_reason')}"),
-        "timestamp": time.time()
+        "action": action,
+        "detail": detail,
+        "timestamp": time.time(),
+        "latency_ms": round(latency_ms, 2),
+        "queue_wait_ms": round(queue["wait_ms"], 2),
     }
-    
+
     output = {
         "judge_score": score,
         "judge_feedback": result.get("failure_reason", ""),
         "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + cost,
-        "total_latency": state.get("total_latency", 0.0) + (latency_ms / 1000),
+        "total_cost": cost + wasted,
+        "total_latency": latency_ms / 1000,
+        "escalation_prefetch": prefetch,
     }
-    
+
     if passed:
+        # Only an LLM grade is trusted enough to teach the router
+        if tier != "prescreen":
+            await _learn_route(state)
         return output
     else:
         # Reject and trigger escalation
-        output["escalation_model"] = result.get("escalate_to", MODEL_OPUS)
+        output["escalation_model"] = prefetch["model"] if prefetch else result.get("escalate_to", MODEL_OPUS)
         output["escalation_instruction"] = result.get("retry_instruction", "")
         return output
 
+
+_SPECULATIVE_INSTRUCTION = "the answer may be incomplete or inaccurate (this retry started before the judge's verdict)"
+
+
+def _should_speculate(state: NexusState, route: str) -> bool:
+    """Start the escalation with the judge when this route's answers are usually rejected anyway."""
+    if not SPECULATIVE_ESCALATION or state.get("escalation_count", 0) >= MAX_ESCALATIONS:
+        return False
+    rate = route_rejection_rate(route, SPECULATIVE_ESCALATION_MIN_SAMPLES)
+    return rate is not None and rate >= SPECULATIVE_ESCALATION_MIN_REJECT_RATE
+
+
+def _escalation_messages(query: str, instruction: str) -> list[dict]:
+    prompt = f"Previous attempt failed: {instruction}. Fix this specifically and address the query below.\n\nQuery: {query}"
+    return [{"role": "user", "content": prompt}]
+
+
+async def _escalate(query: str, instruction: str, model: str) -> dict:
+    """Non-streamed escalation call, for escalations started before the verdict is known."""
+    start = time.time()
+    response, actual_model = await complete(model=model, messages=_escalation_messages(query, instruction),
+                                            node="escalation_worker")
+    return {
+        "model": actual_model,
+        "response": response.choices[0].message.content,
+        "cost_usd": calculate_cost(actual_model, response),
+        "latency_ms": round((time.time() - start) * 1000, 2),
+    }
+
+
+async def _settle_speculation(task: asyncio.Task, passed: bool, query: str) -> tuple[dict | None, float]:
+    """Keep the speculative escalation if the judge rejected, cancel it if the judge approved.
+
+    Returns:
+        (prefetch, wasted_cost) — prefetch is the escalation result for escalation_worker_node
+        (None when cancelled or failed); wasted_cost is what a cancelled escalation cost
+    """
+    ESCALATION_STATS["launched"] += 1
+    if not passed:
+        try:
+            return await task, 0.0
+        except Exception as e:
+            # escalation_worker_node retries the usual way
+            print(f"Speculative escalation failed: {e}")
+            return None, 0.0
+
+    if task.done() and not task.cancelled() and task.exception() is None:
+        wasted = task.result()["cost_usd"]
+    else:
+        task.cancel()
+        wasted = estimate_prompt_cost(MODEL_OPUS, _escalation_messages(query, _SPECULATIVE_INSTRUCTION))
+    ESCALATION_STATS["cancelled"] += 1
+    ESCALATION_STATS["wasted_cost_usd"] += wasted
+    return None, wasted
+
+
+async def judge_subtask(query: str, worker_result: dict) -> dict:
+    """Judge one parallel_worker result as soon as it lands and, if it fails, re-run just
+    that subtask on the escalation model. Used instead of judging the merged answer, so a
+    weak subtask costs one targeted retry rather than a full redo of the query.
+
+    Returns:
+        worker_result updated with judge_score / judge_tier / judge_cost_usd and, when
+        escalated, the escalated answer (model, response, escalated_from, escalation_cost_usd)
+    """
+    subtask = worker_result.get("subtask", "")
+    route = worker_result.get("model", "unknown")
+    start = time.time()
+    verdict = await evaluate(f"{subtask} (part of: {query})", worker_result.get("response", ""),
+                             route, worker_result.get("finish_reason"))
+    judged = {
+        **worker_result,
+        "judge_score": verdict["score"],
+        "judge_tier": verdict["tier"],
+        "judge_ms": round(verdict["latency_ms"], 2),
+        "judge_cost_usd": verdict["cost"],
+        "cost_usd": worker_result.get("cost_usd", 0.0) + verdict["cost"],
+    }
+
+    if verdict["passed"]:
+        if verdict["tier"] != "prescreen" and not worker_result.get("error"):
+            try:
+                await learn_prototype(subtask, route)
+            except Exception as e:
+                print(f"Online prototype learning failed: {e}")
+        judged["latency_ms"] = round(worker_result.get("latency_ms", 0.0) + (time.time() - start) * 1000, 2)
+        return judged
+
+    escalation_model = verdict["result"].get("escalate_to") or MODEL_OPUS
+    instruction = verdict["result"].get("retry_instruction", "")
+    messages = [
+        {"role": "system", "content": f"You are a specialist. Focus ONLY on this subtask: {subtask}"},
+        {"role": "user", "content": f"Previous attempt failed: {instruction}. Fix this specifically.\n\n"
+                                    f"For query: {query}\nHandle this aspect: {subtask}"},
+    ]
+    try:
+        response, actual_model = await complete(model=escalation_model, messages=messages, node="escalation_worker")
+        escalation_cost = calculate_cost(actual_model, response)
+        judged.update({
+            "model": actual_model,
+            "response": response.choices[0].message.content,
+            "error": False,
+            "finish_reason": response.choices[0].finish_reason,
+        })
+    except Exception as e:
+        # Keep the original answer; the aggregator still gets something to merge
+        print(f"Subtask escalation failed: {e}")
+        actual_model = escalation_model
+        escalation_cost = 0.0
+        judged["escalation_failed"] = True
+
+    judged.update({
+        "escalated_from": route,
+        "escalation_cost_usd": escalation_cost,
+        "cost_usd": judged["cost_usd"] + escalation_cost,
+        "latency_ms": round(worker_result.get("latency_ms", 0.0) + (time.time() - start) * 1000, 2),
+    })
+    return judged
+
+
 async def escalation_worker_node(state: NexusState) -> dict:
-    """Invoked when the judge fails a response. Uses designated more capable model."""
+    """Invoked when the judge fails a response. Uses designated more capable model.
+    If judge_node already ran the escalation speculatively, its answer is used as is."""
     
     target_query = state.get("enriched_query") or state.get("query", "")
     escalation_instruction = state.get("escalation_instruction", "")
     escalation_model = state.get("escalation_model", MODEL_OPUS)
+    prefetch = state.get("escalation_prefetch")
     
-    prompt = f"Previous attempt failed: {escalation_instruction}. Fix this specifically and address the query below.\n\nQuery: {target_query}"
-    
+    queue = track_queue_wait()
+    saved_ms = 0.0
     try:
-        start = time.time()
-        response = await litellm.acompletion(
-            model=escalation_model,
-            messages=[{"role": "user", "content": prompt}],
-        )
-        latency_ms = (time.time() - start) * 1000
-        output_content = response.choices[0].message.content
-        actual_model = response.model if hasattr(response, 'model') else escalation_model
-        cost = calculate_cost(actual_model, response)
-
+        if prefetch:
+            output_content, actual_model, cost = prefetch["response"], prefetch["model"], prefetch["cost_usd"]
+            # Only the part that outlasted the judge call is on the critical path
+            saved_ms = min(prefetch["overlap_ms"], prefetch["latency_ms"])
+            latency_ms = prefetch["latency_ms"] - saved_ms
+            ESCALATION_STATS["used"] += 1
+            ESCALATION_STATS["latency_saved_s"] += saved_ms / 1000
+            await emit_event("token", {"node": "escalation_worker", "model": actual_model, "text": output_content})
+        else:
+            start = time.time()
+            output_content, response, _, actual_model = await stream_completion(
+                model=escalation_model,
+                messages=_escalation_messages(target_query, escalation_instruction),
+                node="escalation_worker",
+            )
+            latency_ms = (time.time() - start) * 1000
+            cost = calculate_cost(actual_model, response)
     except Exception as e:
         output_content = f"Escalation failed entirely: {str(e)}"
         actual_model = escalation_model
         cost = 0.0
         latency_ms = 0.0
+    else:
+        # The query needed a different model than KNN picked — remember that
+        routed = state.get("selected_models", []) or []
+        if not state.get("subtasks") and escalation_model not in routed:
+            try:
+                await learn_prototype(target_query, escalation_model)
+            except Exception as e:
+                print(f"Online prototype learning failed: {e}")
         
     trace_entry: TraceEntry = {
         "node": "escalation_worker",
         "action": "escalated_response",
-        "detail": f"Used {actual_model} after judge rejection.",
-        "timestamp": time.time()
+        "detail": f"Used {actual_model} after judge rejection."
+                  + (f" Started alongside the judge, saved {saved_ms:.0f}ms." if prefetch else ""),
+        "timestamp": time.time(),
+        "queue_wait_ms": round(queue["wait_ms"], 2),
     }
     
     return {
         "final_response": output_content,
         "escalation_count": state.get("escalation_count", 0) + 1,
         "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + cost,
-        "total_latency": state.get("total_latency", 0.0) + (latency_ms / 1000),
+        "total_cost": cost,
+        "total_latency": latency_ms / 1000,
     }
@@ -1,66 +1,575 @@
+import os
+import re
+import json
 import time
+import asyncio
+import hashlib
 import numpy as np
 from collections import Counter
-from sklearn.metrics.pairwise import cosine_similarity
-import litellm
 
 from core.state import NexusState, TraceEntry
-from core.config import MODEL_EMBED, KNN_K_VALUE
+from core.config import (
+    KNN_K_VALUE, KNN_INDEX_CACHE_DIR, KNN_ANN_MIN_VECTORS, KNN_ANN_NLIST, KNN_ANN_NPROBE,
+    EMBED_CACHE_MAX_SIZE, EMBED_CACHE_TTL_S, EMBED_CACHE_PATH,
+    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_MAX_SIZE,
+    KNN_ONLINE_LEARNING, KNN_ONLINE_MAX_PER_MODEL, KNN_ONLINE_EVICTION,
+    KNN_ONLINE_SNAPSHOT_EVERY, KNN_ONLINE_SNAPSHOT_INTERVAL_S,
+    FAST_PATH_MIN_SIMILARITY, FAST_PATH_MIN_MARGIN, FAST_PATH_MAX_WORDS, FAST_PATH_EXCLUDED_MODELS,
+)
 from core.prototypes import MODEL_PROTOTYPES
+from core.embed_cache import EmbeddingCache, cache_key
+from core.response_cache import ResponseCache, query_literals
+from core.embeddings import Embedder, get_embedder
 
-# Module-level KNN index — set once at FastAPI startup
+# Module-level KNN index (a KNNScorer) — set once at FastAPI startup
 KNN_INDEX = None
 
+# Embedding backend selected by EMBED_BACKEND (remote litellm or local hashing)
+EMBEDDER = get_embedder()
 
-async def build_knn_index() -> dict:
+# Query embeddings, keyed by normalized text + embedder name
+EMBED_CACHE = EmbeddingCache(EMBED_CACHE_MAX_SIZE, EMBED_CACHE_TTL_S, EMBED_CACHE_PATH or None)
+
+# Worker answers, keyed by query embedding + routed model
+RESPONSE_CACHE = ResponseCache(RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL_S, RESPONSE_CACHE_THRESHOLD)
+
+# Bump when the on-disk layout changes (2: vectors are stored L2-normalized)
+_INDEX_FORMAT = 2
+
+# Online-learning snapshot bookkeeping
+_LEARN_STATE = {"since_snapshot": 0, "last_snapshot": time.time(), "snapshots": 0}
+
+
+class KNNScorer:
+    """Exact KNN over prototype vectors, L2-normalized once at construction.
+
+    Cosine similarity for a batch of queries is a single float32 matrix multiply;
+    top-k per row uses argpartition instead of a full sort.
+
+    Learned examples can be appended at runtime (learn()); they are capped per model
+    and evicted by reservoir sampling or age, while the seed prototypes are never evicted.
+    """
+
+    def __init__(self, vectors, labels: list[str], k: int = KNN_K_VALUE,
+                 fingerprint: str = "", source: str = "", normalized: bool = False):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        # Already-normalized input (e.g. a memory-mapped cache file) is used as-is, without a copy
+        self.vectors = matrix if normalized else _l2_normalize(matrix)
+        self.labels = list(labels)
+        self.k = k
+        self.fingerprint = fingerprint
+        self.source = source
+        # Optional approximate index; exact scan when None
+        self.ann: IVFIndex | None = None
+
+        # Online learning: row ids of learned examples per model (oldest first) and offers seen
+        self.base_size = len(self.labels)
+        self.learned: dict[str, list[int]] = {}
+        self.seen: Counter = Counter()
+        self._buffer: np.ndarray | None = None
+        self._rng = np.random.default_rng()
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def top_k(self, query_vectors, k: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Return (indices, scores) of the k nearest prototypes per query row, best first.
+        Uses the ANN index when one is attached, otherwise an exact scan.
+        """
+        queries = _l2_normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        k = k or self.k
+        if self.ann is not None:
+            return self.ann.search(queries, self.vectors, k)
+        return _top_k_rows(queries @ self.vectors.T, k)
+
+    def add(self, vector, label: str) -> int:
+        """Append one vector without a rebuild (amortized O(1) growth). Returns its row id."""
+        vec = _l2_normalize(np.atleast_2d(np.asarray(vector, dtype=np.float32)))
+        n = len(self.labels)
+        if self._buffer is None or n == self._buffer.shape[0]:
+            # First append copies the (possibly memory-mapped, read-only) matrix into a growable buffer
+            buffer = np.empty((max(16, 2 * n), self.vectors.shape[1]), dtype=np.float32)
+            buffer[:n] = self.vectors
+            self._buffer = buffer
+        self._buffer[n] = vec[0]
+        self.vectors = self._buffer[:n + 1]
+        self.labels.append(label)
+        if self.ann is not None:
+            self.ann.add(vec, np.array([n]))
+        return n
+
+    def replace(self, row: int, vector, label: str) -> None:
+        """Overwrite a learned row in place (rows >= base_size always live in the growable buffer)."""
+        vec = _l2_normalize(np.atleast_2d(np.asarray(vector, dtype=np.float32)))
+        self.vectors[row] = vec[0]
+        self.labels[row] = label
+        if self.ann is not None:
+            self.ann.remove([row])
+            self.ann.add(vec, np.array([row]))
+
+    def learn(self, vector, label: str, max_per_model: int = KNN_ONLINE_MAX_PER_MODEL,
+              eviction: str = KNN_ONLINE_EVICTION) -> str:
+        """Add a labelled example under a per-model cap.
+
+        Returns:
+            "added", "replaced" (evicted an older learned example) or "skipped" (reservoir rejected it)
+        """
+        self.seen[label] += 1
+        slots = self.learned.setdefault(label, [])
+        if len(slots) < max_per_model:
+            slots.append(self.add(vector, label))
+            return "added"
+
+        if eviction == "age":
+            slot = slots.pop(0)
+            slots.append(slot)
+        else:
+            # Reservoir sampling: keep a uniform sample of everything offered for this model
+            j = int(self._rng.integers(0, self.seen[label]))
+            if j >= max_per_model:
+                return "skipped"
+            slot = slots[j]
+        self.replace(slot, vector, label)
+        return "replaced"
+
+    def learned_stats(self) -> dict:
+        return {
+            "base_vectors": self.base_size,
+            "learned_vectors": len(self) - self.base_size,
+            "learned_per_model": {label: len(slots) for label, slots in self.learned.items()},
+            "offered_per_model": dict(self.seen),
+        }
+
+    def route(self, query_vectors) -> list[tuple[str, dict]]:
+        """Majority-vote the top-k neighbours of each query row.
+
+        Returns:
+            one (best_model, knn_scores) per row, knn_scores being {model: best similarity}
+        """
+        idx, scores = self.top_k(query_vectors)
+        routes = []
+        for row_idx, row_scores in zip(idx, scores):
+            valid = row_idx >= 0
+            row_idx, row_scores = row_idx[valid], row_scores[valid]
+            top_models = [self.labels[i] for i in row_idx]
+
+            # Majority vote (ties go to the model seen first, i.e. the closest neighbour)
+            best_model = Counter(top_models).most_common(1)[0][0]
+
+            # Build knn_scores dict for UI bar chart
+            knn_scores = {}
+            for label, score in zip(top_models, row_scores):
+                if label not in knn_scores or score > knn_scores[label]:
+                    knn_scores[label] = float(score)
+            routes.append((best_model, knn_scores))
+        return routes
+
+
+class IVFIndex:
+    """Inverted-file ANN index over a KNNScorer's normalized vectors.
+
+    A spherical k-means coarse quantizer splits the vectors into `nlist` lists;
+    a search only scans the `nprobe` lists whose centroids are closest to the query.
+    Raising nprobe trades speed for recall (nprobe == nlist is an exact scan).
+    """
+
+    def __init__(self, centroids: np.ndarray, lists: list[np.ndarray], nprobe: int):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.lists = lists
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: int, nprobe: int, iters: int = 10, seed: int = 0) -> "IVFIndex":
+        """Train the quantizer on (a sample of) normalized vectors, then assign every vector to a list."""
+        rng = np.random.default_rng(seed)
+        n = vectors.shape[0]
+        nlist = max(1, min(nlist, n))
+
+        # Train on at most 64 points per list — plenty for a coarse quantizer
+        sample = vectors[rng.choice(n, size=min(n, nlist * 64), replace=False)]
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=nlist) == 0
+            # Re-seed empty lists from random sample points
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))]
+            centroids = _l2_normalize(sums)
+
+        assign = np.concatenate([
+            np.argmax(vectors[i:i + 8192] @ centroids.T, axis=1) for i in range(0, n, 8192)
+        ])
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        lists = [order[bounds[c]:bounds[c + 1]].astype(np.int64) for c in range(nlist)]
+        return cls(centroids, lists, nprobe)
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        """Append already-normalized vectors (by row id) to their nearest lists without retraining."""
+        assign = np.argmax(np.atleast_2d(vectors) @ self.centroids.T, axis=1)
+        for c in np.unique(assign):
+            self.lists[c] = np.concatenate([self.lists[c], np.asarray(ids)[assign == c]])
+
+    def remove(self, ids) -> None:
+        drop = np.asarray(list(ids), dtype=np.int64)
+        self.lists = [lst[~np.isin(lst, drop)] for lst in self.lists]
+
+    def search(self, queries: np.ndarray, vectors: np.ndarray, k: int,
+               nprobe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k per normalized query row, best first. Rows are padded with -1 / -inf."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = _top_k_rows(queries @ self.centroids.T, nprobe)[0]
+
+        all_idx = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        all_scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for row, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.lists[c] for c in probe])
+            if candidates.size < k:
+                # Probed lists too sparse — fall back to an exact scan for this row
+                candidates = np.arange(vectors.shape[0])
+            idx, scores = _top_k_rows((vectors[candidates] @ query)[None, :], k)
+            all_idx[row, :idx.shape[1]] = candidates[idx[0]]
+            all_scores[row, :idx.shape[1]] = scores[0]
+        return all_idx, all_scores
+
+    def save(self, path: str) -> None:
+        sizes = np.array([len(lst) for lst in self.lists], dtype=np.int64)
+        ids = np.concatenate(self.lists) if self.lists else np.empty(0, dtype=np.int64)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, sizes=sizes, ids=ids, nprobe=np.int64(self.nprobe))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            bounds = np.concatenate([[0], np.cumsum(data["sizes"])])
+            ids = data["ids"]
+            lists = [ids[bounds[c]:bounds[c + 1]] for c in range(len(data["sizes"]))]
+            return cls(data["centroids"], lists, int(data["nprobe"]))
+
+
+def _top_k_rows(scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Per-row top-k (indices, scores) of a score matrix, best first."""
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(scores.shape[1]), scores.shape).copy()
+    top_scores = np.take_along_axis(scores, idx, axis=1)
+
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def index_fingerprint(embedder: Embedder | None = None) -> str:
+    """Content hash of the prototypes and embedding backend — changes invalidate the cached index."""
+    embedder = embedder or EMBEDDER
+    payload = json.dumps(
+        {"format": _INDEX_FORMAT, "embed_model": embedder.name, "prototypes": MODEL_PROTOTYPES}, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _index_paths(fingerprint: str) -> tuple[str, str]:
+    base = os.path.join(KNN_INDEX_CACHE_DIR, f"knn_{fingerprint}")
+    return base + ".npy", base + ".json"
+
+
+def _ann_path(fingerprint: str) -> str:
+    return os.path.join(KNN_INDEX_CACHE_DIR, f"knn_{fingerprint}.ivf.npz")
+
+
+def attach_ann(index: KNNScorer, use_cache: bool = True) -> None:
+    """Attach an IVF index once the prototype set reaches KNN_ANN_MIN_VECTORS.
+    Loaded from disk when a matching one was saved, otherwise trained and saved.
+    """
+    n = len(index)
+    if n < KNN_ANN_MIN_VECTORS:
+        return
+
+    nlist = KNN_ANN_NLIST or int(4 * np.sqrt(n))
+    path = _ann_path(index.fingerprint)
+    if use_cache and os.path.exists(path):
+        try:
+            ann = IVFIndex.load(path)
+            if ann.nlist == nlist and sum(len(lst) for lst in ann.lists) == n:
+                ann.nprobe = KNN_ANN_NPROBE
+                index.ann = ann
+                return
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index.ann = IVFIndex.build(index.vectors, nlist=nlist, nprobe=KNN_ANN_NPROBE)
+    if use_cache:
+        try:
+            os.makedirs(KNN_INDEX_CACHE_DIR, exist_ok=True)
+            index.ann.save(path)
+        except OSError as e:
+            print(f"ANN index cache write failed: {e}")
+
+
+def _learned_paths(embed_model: str) -> tuple[str, str]:
+    # Learned examples depend on the embedding backend only, so editing prototypes keeps them
+    key = hashlib.sha256(embed_model.encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(KNN_INDEX_CACHE_DIR, f"learned_{key}")
+    return base + ".npy", base + ".json"
+
+
+def save_learned_snapshot(index: KNNScorer, embed_model: str) -> None:
+    """Atomically persist the learned rows (vectors, labels, reservoir counters)."""
+    os.makedirs(KNN_INDEX_CACHE_DIR, exist_ok=True)
+    vectors_path, meta_path = _learned_paths(embed_model)
+    rows = sorted(row for slots in index.learned.values() for row in slots)
+
+    tmp_vectors = f"{vectors_path}.{os.getpid()}.tmp"
+    with open(tmp_vectors, "wb") as f:
+        np.save(f, index.vectors[rows] if rows else np.empty((0, index.vectors.shape[1]), dtype=np.float32))
+    os.replace(tmp_vectors, vectors_path)
+
+    tmp_meta = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta, "w", encoding="utf-8") as f:
+        json.dump({"labels": [index.labels[r] for r in rows], "seen": dict(index.seen)}, f)
+    os.replace(tmp_meta, meta_path)
+
+
+def load_learned_snapshot(index: KNNScorer, embed_model: str) -> int:
+    """Append a previously saved learned snapshot to the index. Returns the number of rows restored."""
+    vectors_path, meta_path = _learned_paths(embed_model)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(vectors_path)
+    except (OSError, ValueError):
+        return 0
+    labels = meta.get("labels", [])
+    if vectors.ndim != 2 or vectors.shape[0] != len(labels) or vectors.shape[1] != index.vectors.shape[1]:
+        return 0
+
+    for vector, label in zip(vectors, labels):
+        index.learned.setdefault(label, []).append(index.add(vector, label))
+    index.seen.update(meta.get("seen", {}))
+    return len(labels)
+
+
+def load_cached_index(fingerprint: str) -> KNNScorer | None:
+    """Memory-map a previously saved index. Returns None if missing or inconsistent."""
+    vectors_path, labels_path = _index_paths(fingerprint)
+    try:
+        with open(labels_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = np.load(vectors_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+    labels = meta.get("labels", [])
+    if meta.get("fingerprint") != fingerprint or vectors.ndim != 2 or vectors.shape[0] != len(labels):
+        return None
+
+    return KNNScorer(vectors, labels, fingerprint=fingerprint, source="cache", normalized=True)
+
+
+def save_index(index: KNNScorer, fingerprint: str, embed_model: str) -> None:
+    """Write vectors + labels atomically so concurrent workers never read a partial file."""
+    os.makedirs(KNN_INDEX_CACHE_DIR, exist_ok=True)
+    vectors_path, labels_path = _index_paths(fingerprint)
+
+    tmp_vectors = f"{vectors_path}.{os.getpid()}.tmp"
+    with open(tmp_vectors, "wb") as f:
+        np.save(f, index.vectors)
+    os.replace(tmp_vectors, vectors_path)
+
+    tmp_labels = f"{labels_path}.{os.getpid()}.tmp"
+    with open(tmp_labels, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "embed_model": embed_model, "labels": index.labels}, f)
+    os.replace(tmp_labels, labels_path)
+
+
+async def build_knn_index(use_cache: bool = True, embedder: Embedder | None = None,
+                          learned: bool = True) -> KNNScorer:
     """Build the KNN index by embedding all prototype queries.
-    Called ONCE at FastAPI startup. Stored in memory.
+    Called ONCE at FastAPI startup. Loaded from the on-disk cache when the
+    prototypes and embedding backend are unchanged; otherwise re-embedded and saved.
+    learned=False leaves out the saved online-learned rows (prototypes only).
     """
+    embedder = embedder or EMBEDDER
+    fingerprint = index_fingerprint(embedder)
+    if use_cache:
+        cached = load_cached_index(fingerprint)
+        if cached is not None:
+            if KNN_ONLINE_LEARNING and learned:
+                load_learned_snapshot(cached, embedder.name)
+            attach_ann(cached, use_cache)
+            return cached
+
     all_vectors = []
     all_labels = []
 
     for model_name, examples in MODEL_PROTOTYPES.items():
         # Embed all examples for this model in one batch
-        response = await litellm.aembedding(model=MODEL_EMBED, input=examples)
-        for i, item in enumerate(response.data):
-            all_vectors.append(item["embedding"])
-            all_labels.append(model_name)
+        all_vectors.append(await embedder.embed(examples))
+        all_labels.extend([model_name] * len(examples))
 
-    return {
-        "all_vectors": np.array(all_vectors),
-        "all_labels": all_labels,
-    }
+    index = KNNScorer(np.concatenate(all_vectors), all_labels, fingerprint=fingerprint, source="embedded")
+
+    if use_cache:
+        try:
+            save_index(index, fingerprint, embedder.name)
+        except OSError as e:
+            print(f"KNN index cache write failed: {e}")
 
+    if KNN_ONLINE_LEARNING and use_cache and learned:
+        load_learned_snapshot(index, embedder.name)
+    attach_ann(index, use_cache)
+    return index
 
-async def semantic_route(query: str, index: dict) -> tuple:
-    """Embed a query and find the best model via top-5 KNN voting.
+
+async def semantic_route(query: str, index: KNNScorer, embedder: Embedder | None = None) -> tuple:
+    """Embed a query and find the best model via top-k KNN voting.
 
     Returns:
         (best_model, knn_scores) where knn_scores is {model: float}
     """
-    # Embed the query
-    response = await litellm.aembedding(model=MODEL_EMBED, input=[query])
-    query_vec = response.data[0]["embedding"]
+    routes = await semantic_route_batch([query], index, embedder)
+    return routes[0]
+
+
+async def semantic_route_batch(queries: list[str], index: KNNScorer,
+                               embedder: Embedder | None = None) -> list[tuple]:
+    """Embed several queries in one request and KNN-vote all of them with one matrix multiply.
 
-    # Cosine similarity vs all prototypes
-    scores = cosine_similarity([query_vec], index["all_vectors"])[0]
+    Returns:
+        one (best_model, knn_scores) per query, in input order
+    """
+    vectors, _ = await embed_texts(queries, embedder)
+    return index.route(vectors)
 
-    # Top-5 nearest neighbors
-    top5_idx = scores.argsort()[-5:][::-1]
-    top5_models = [index["all_labels"][i] for i in top5_idx]
 
-    # Majority vote
-    best_model = Counter(top5_models).most_common(1)[0][0]
+async def embed_texts(texts: list[str], embedder: Embedder | None = None) -> tuple[np.ndarray, int]:
+    """Embed texts, serving repeats from EMBED_CACHE and the rest with a single embedder call.
+
+    Returns:
+        (vectors, embedded) — a (len(texts), dim) float32 array and how many texts hit the backend
+    """
+    embedder = embedder or EMBEDDER
+    keys = [cache_key(text, embedder.name) for text in texts]
+    vectors = [EMBED_CACHE.get(key) for key in keys]
+
+    # Unique cache misses, so duplicates within one batch are embedded once
+    missing = {}
+    for text, key, vector in zip(texts, keys, vectors):
+        if vector is None and key not in missing:
+            missing[key] = text
 
-    # Build knn_scores dict for UI bar chart
-    knn_scores = {}
-    for idx in top5_idx:
-        label = index["all_labels"][idx]
-        score = float(scores[idx])
-        if label not in knn_scores or score > knn_scores[label]:
-            knn_scores[label] = score
+    if missing:
+        embedded = await embedder.embed(list(missing.values()))
+        fresh = {}
+        for key, vector in zip(missing, embedded):
+            fresh[key] = vector
+            EMBED_CACHE.put(key, vector)
+        vectors = [vector if vector is not None else fresh[key] for key, vector in zip(keys, vectors)]
+        if EMBED_CACHE.pending:
+            await asyncio.to_thread(EMBED_CACHE.flush)
 
-    return best_model, knn_scores
+    return np.stack(vectors), len(missing)
+
+
+async def learn_prototype(text: str, model: str) -> str:
+    """Feed a judge-approved (or escalated) query back into KNN_INDEX as a labelled example.
+    The query vector normally comes straight from EMBED_CACHE, so this costs no embedding call.
+    """
+    if not KNN_ONLINE_LEARNING or KNN_INDEX is None or not text or not model:
+        return "disabled"
+    if model not in MODEL_PROTOTYPES:
+        # Only learn labels the router can actually dispatch to (the judge's escalate_to is free text)
+        return "unknown_model"
+
+    vectors, _ = await embed_texts([text])
+    outcome = KNN_INDEX.learn(vectors[0], model)
+
+    # Learned rows can push a small index over the ANN threshold
+    if KNN_INDEX.ann is None and len(KNN_INDEX) >= KNN_ANN_MIN_VECTORS:
+        attach_ann(KNN_INDEX, use_cache=False)
+
+    _LEARN_STATE["since_snapshot"] += outcome != "skipped"
+    due = (
+        _LEARN_STATE["since_snapshot"] >= KNN_ONLINE_SNAPSHOT_EVERY
+        or time.time() - _LEARN_STATE["last_snapshot"] >= KNN_ONLINE_SNAPSHOT_INTERVAL_S
+    )
+    if due and _LEARN_STATE["since_snapshot"] > 0:
+        try:
+            save_learned_snapshot(KNN_INDEX, EMBEDDER.name)
+            _LEARN_STATE["snapshots"] += 1
+        except OSError as e:
+            print(f"Learned prototype snapshot failed: {e}")
+        _LEARN_STATE["since_snapshot"] = 0
+        _LEARN_STATE["last_snapshot"] = time.time()
+    return outcome
+
+
+def online_learning_stats() -> dict:
+    if KNN_INDEX is None:
+        return {"enabled": KNN_ONLINE_LEARNING}
+    return {"enabled": KNN_ONLINE_LEARNING, "snapshots": _LEARN_STATE["snapshots"], **KNN_INDEX.learned_stats()}
+
+
+async def cached_response(query: str, model: str, vector: np.ndarray | None = None,
+                          record: bool = True) -> dict | None:
+    """RESPONSE_CACHE lookup for a routed query (the vector usually comes from EMBED_CACHE)."""
+    if not RESPONSE_CACHE_ENABLED or not query:
+        return None
+    if vector is None:
+        vectors, _ = await embed_texts([query])
+        vector = vectors[0]
+    return RESPONSE_CACHE.get(vector, model, record=record, literals=query_literals(query))
+
+
+async def store_response(query: str, model: str, response: str, cost_usd: float, latency_s: float) -> None:
+    if not RESPONSE_CACHE_ENABLED or not query:
+        return
+    vectors, _ = await embed_texts([query])
+    RESPONSE_CACHE.put(vectors[0], model, {"response": response, "cost_usd": cost_usd, "latency_s": latency_s,
+                                           "literals": query_literals(query)})
+
+
+async def _response_cache_output(state: NexusState, query: str, model: str,
+                                 vector: np.ndarray | None = None) -> dict:
+    """Router output fields for the response cache; a hit routes straight to set_final.
+    Critical queries always go to a worker (and the judge)."""
+    if state.get("is_critical", False):
+        return {"cache_hit": False}
+    cached = await cached_response(query, model, vector)
+    if cached is None:
+        return {"cache_hit": False}
+    return {
+        "cache_hit": True,
+        "worker_responses": [{
+            "model": model,
+            "response": cached["response"],
+            "cost_usd": 0.0,
+            "latency_ms": 0.0,
+            "cached": True,
+            "saved_cost_usd": cached["cost_usd"],
+            "saved_latency_s": cached["latency_s"],
+        }],
+        "trace": [{
+            "node": "response_cache",
+            "action": "cache_hit",
+            "detail": f"model={model} similarity={cached['similarity']:.3f} "
+                      f"saved=${cached['cost_usd']:.6f} / {cached['latency_s']:.2f}s",
+            "timestamp": time.time(),
+        }],
+    }
 
 
 async def knn_router_node(state: NexusState) -> dict:
@@ -74,25 +583,44 @@ async def knn_router_node(state: NexusState) -> dict:
         }
 
     query_to_use = state.get("enriched_query") or state.get("query", "")
-    subtasks = state.get("subtasks", [])
-    embed_cost = 0.0
-
-    if subtasks and len(subtasks) > 0:
-        # Route each subtask separately
-        selected_models = []
-        combined_knn_scores = {}
-        for subtask in subtasks:
-            model, scores = await semantic_route(subtask, KNN_INDEX)
-            selected_models.append(model)
-            combined_knn_scores.update(scores)
-        knn_scores = combined_knn_scores
+    subtasks = state.get("subtasks", []) or []
+
+    prefetch = state.get("knn_prefetch") or {}
+    if not subtasks and prefetch.get("query") == query_to_use:
+        # Already scored before/alongside the classifier — nothing left to embed
+        cache = await _response_cache_output(state, query_to_use, prefetch["model"])
+        return {
+            **cache,
+            "selected_models": [prefetch["model"]],
+            "knn_scores": prefetch["knn_scores"],
+            "subtask_knn_scores": [],
+            "trace": [{
+                "node": "knn_router",
+                "action": "reused",
+                "detail": f"models=[{prefetch['model']}] from pre-classifier scoring",
+                "timestamp": time.time(),
+                "latency_ms": 0.0,
+            }] + cache.get("trace", []),
+        }
+
+    # Embed the query and every subtask in ONE request, then score them together
+    texts = [query_to_use] + list(subtasks)
+    start = time.time()
+    vectors, embedded = await embed_texts(texts)
+    embed_ms = (time.time() - start) * 1000
+    routes = KNN_INDEX.route(vectors)
+
+    best_model, knn_scores = routes[0]
+    if subtasks:
+        # Each subtask keeps its own scores; knn_scores stays the whole-query view
+        selected_models = [model for model, _ in routes[1:]]
+        subtask_knn_scores = [scores for _, scores in routes[1:]]
     else:
-        # Route the full query once
-        best_model, knn_scores = await semantic_route(query_to_use, KNN_INDEX)
         selected_models = [best_model]
+        subtask_knn_scores = []
 
-    # Estimate embedding cost (~$0.00001 per query)
-    embed_cost = 0.00001 * (len(subtasks) if subtasks else 1)
+    # Estimated embedding cost (cache hits and local backends are free)
+    embed_cost = EMBEDDER.cost_per_text * embedded
 
     top_score = max(knn_scores.values()) if knn_scores else 0.0
     route_preview = ", ".join(selected_models[:4])
@@ -102,14 +630,116 @@ async def knn_router_node(state: NexusState) -> dict:
     trace_entry: TraceEntry = {
         "node": "knn_router",
         "action": "routed",
-        "detail": f"models=[{route_preview}] top_score={top_score:.3f}",
+        "detail": f"models=[{route_preview}] top_score={top_score:.3f} embed={embed_ms:.0f}ms texts={len(texts)} cached={len(texts) - embedded}",
         "timestamp": time.time(),
+        "latency_ms": round(embed_ms, 2),
     }
 
+    cache = {"cache_hit": False}
+    if not subtasks:
+        cache = await _response_cache_output(state, query_to_use, best_model, vectors[0])
+
     return {
+        **cache,
         "selected_models": selected_models,
         "knn_scores": knn_scores,
-        "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + embed_cost,
-        "total_latency": state.get("total_latency", 0.0), # Embeddings are near-instant
+        "subtask_knn_scores": subtask_knn_scores,
+        "trace": [trace_entry] + cache.get("trace", []),
+        "total_cost": embed_cost,
+        "total_latency": embed_ms / 1000,
+    }
+
+
+def route_confidence(knn_scores: dict, best_model: str) -> tuple[float, float]:
+    """(top-1 similarity, lead over the best competing model). A unanimous top-k has margin == top-1."""
+    top = knn_scores.get(best_model, 0.0)
+    runner_up = max((v for m, v in knn_scores.items() if m != best_model), default=0.0)
+    return top, top - runner_up
+
+
+_MULTI_PART = re.compile(r"(^|\n)\s*(\d+[.)]|[-*•])\s|;|\b(also|additionally|as well as|and then)\b", re.IGNORECASE)
+
+
+def looks_single_task(query: str) -> bool:
+    """Cheap shape check standing in for the classifier's subtask split."""
+    if len(query.split()) > FAST_PATH_MAX_WORDS or query.count("?") > 1:
+        return False
+    return not _MULTI_PART.search(query)
+
+
+async def prefetch_route(query: str) -> tuple[dict, float, float]:
+    """Embed + KNN-score the raw query ahead of (or alongside) the classifier.
+
+    Returns:
+        (knn_prefetch, embed_ms, embed_cost) — knn_router reuses knn_prefetch when nothing changed
+    """
+    start = time.time()
+    vectors, embedded = await embed_texts([query])
+    embed_ms = (time.time() - start) * 1000
+    best_model, knn_scores = KNN_INDEX.route(vectors)[0]
+    prefetch = {"query": query, "model": best_model, "knn_scores": knn_scores}
+    return prefetch, embed_ms, EMBEDDER.cost_per_text * embedded
+
+
+async def fast_router_node(state: NexusState) -> dict:
+    """LangGraph node (fast_path mode): KNN-score the query before classifying.
+
+    Confident, single-task, non-critical-tier routes go straight to the worker;
+    everything else falls through to the classifier with the route prefetched.
+    """
+    query = state.get("query", "")
+    if KNN_INDEX is None:
+        return {
+            "fast_path": False,
+            "trace": [{"node": "fast_router", "action": "miss",
+                       "detail": "KNN index not built", "timestamp": time.time()}],
+        }
+
+    prefetch, embed_ms, embed_cost = await prefetch_route(query)
+    best_model, knn_scores = prefetch["model"], prefetch["knn_scores"]
+    top, margin = route_confidence(knn_scores, best_model)
+
+    reasons = []
+    if top < FAST_PATH_MIN_SIMILARITY:
+        reasons.append(f"top={top:.3f}<{FAST_PATH_MIN_SIMILARITY}")
+    if margin < FAST_PATH_MIN_MARGIN:
+        reasons.append(f"margin={margin:.3f}<{FAST_PATH_MIN_MARGIN}")
+    if best_model in FAST_PATH_EXCLUDED_MODELS:
+        reasons.append("critical-tier model")
+    if not looks_single_task(query):
+        reasons.append("multi-part shape")
+    hit = not reasons
+
+    trace_entry: TraceEntry = {
+        "node": "fast_router",
+        "action": "hit" if hit else "miss",
+        "detail": f"model={best_model} top={top:.3f} margin={margin:.3f} embed={embed_ms:.0f}ms"
+                  + ("" if hit else f" ({', '.join(reasons)})"),
+        "timestamp": time.time(),
+        "latency_ms": round(embed_ms, 2),
+    }
+
+    cache = {"cache_hit": False}
+    if hit:
+        cache = await _response_cache_output(state, query, best_model)
+
+    output = {
+        **cache,
+        "fast_path": hit,
+        "knn_prefetch": prefetch,
+        "trace": [trace_entry] + cache.get("trace", []),
+        "total_cost": embed_cost,
+        "total_latency": embed_ms / 1000,
     }
+    if hit:
+        # Stand in for the classifier's outputs on the skipped path
+        output.update({
+            "selected_models": [best_model],
+            "knn_scores": knn_scores,
+            "subtasks": [],
+            "original_query": query,
+            "can_self_answer": False,
+            "is_ambiguous": False,
+            "is_critical": False,
+        })
+    return output
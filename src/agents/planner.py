@@ -0,0 +1,71 @@
+import time
+import numpy as np
+
+from core.state import NexusState, TraceEntry
+from core.config import PLANNER_MERGE_THRESHOLD, PLANNER_MAX_SUBTASKS
+import agents.knn_router as knn_mod
+
+
+def plan_subtasks(subtasks: list[str], vectors: np.ndarray,
+                  threshold: float = PLANNER_MERGE_THRESHOLD,
+                  max_subtasks: int = PLANNER_MAX_SUBTASKS) -> tuple[list[str], int, int]:
+    """Merge near-duplicate subtasks and cap the fan-out.
+
+    A subtask within `threshold` cosine of an earlier kept one is merged into it. While more
+    than `max_subtasks` remain, the one most similar to another kept subtask (the least novel)
+    is dropped. Order is preserved.
+
+    Returns:
+        (kept subtasks, merged count, dropped count)
+    """
+    unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    sims = unit @ unit.T
+
+    kept: list[int] = []
+    for i in range(len(subtasks)):
+        if not kept or sims[i, kept].max() < threshold:
+            kept.append(i)
+    merged = len(subtasks) - len(kept)
+
+    dropped = 0
+    while max_subtasks > 0 and len(kept) > max_subtasks:
+        block = sims[np.ix_(kept, kept)]
+        np.fill_diagonal(block, -np.inf)
+        kept.pop(int(np.argmax(block.max(axis=1))))
+        dropped += 1
+
+    return [subtasks[i] for i in kept], merged, dropped
+
+
+async def planner_node(state: NexusState) -> dict:
+    """Dedupe and cap the classifier's subtasks before routing. A plan that collapses to a
+    single subtask clears `subtasks`, so the whole query goes to one worker instead."""
+    subtasks = [s for s in state.get("subtasks", []) or [] if isinstance(s, str) and s.strip()]
+    if len(subtasks) < 2:
+        return {}
+
+    start = time.time()
+    try:
+        vectors, embedded = await knn_mod.embed_texts(subtasks)
+    except Exception as e:
+        return {"trace": [{"node": "planner", "action": "skipped",
+                           "detail": f"Embedding failed, subtasks kept as is: {e}", "timestamp": time.time()}]}
+    planned, merged, dropped = plan_subtasks(subtasks, vectors)
+    latency_ms = (time.time() - start) * 1000
+    if len(planned) < 2:
+        planned = []
+
+    trace_entry: TraceEntry = {
+        "node": "planner",
+        "action": "planned" if merged or dropped else "kept",
+        "detail": f"{len(subtasks)} subtasks -> {len(planned) or 1} calls (merged={merged} dropped={dropped})",
+        "timestamp": time.time(),
+        "latency_ms": round(latency_ms, 2),
+    }
+    return {
+        "subtasks": planned,
+        "trace": [trace_entry],
+        # The subtask embeddings are cached, so knn_router re-scores them for free
+        "total_cost": knn_mod.EMBEDDER.cost_per_text * embedded,
+        "total_latency": latency_ms / 1000,
+    }
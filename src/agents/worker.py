@@ -1,136 +1,386 @@
 import time
 import asyncio
-import litellm
 from core.state import NexusState, TraceEntry
-from core.metrics import calculate_cost
+from core.config import (
+    WORKER_HEDGING, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES,
+    HEDGE_DEFAULT_DELAY_S, HEDGE_MAX_PRICE_RATIO, HEDGE_EQUIVALENTS,
+    PARALLEL_FAN_IN, PARALLEL_DEADLINE_S, PARALLEL_MAX_CONCURRENCY, SUBTASK_JUDGING,
+)
+from core.metrics import calculate_cost, estimate_prompt_cost, model_cost_config, LATENCY, HEDGE_STATS
+from core.llm import complete, stream_completion, hedged_stream_completion, emit_event
+from core.scheduler import track_queue_wait
+from agents.judge import judge_subtask
+
+
+def hedge_backup(model: str, knn_scores: dict) -> str | None:
+    """Backup for a hedged request: the same model on another provider if configured,
+    else the next-best KNN model that costs at most HEDGE_MAX_PRICE_RATIO x as much."""
+    if model in HEDGE_EQUIVALENTS:
+        return HEDGE_EQUIVALENTS[model]
+
+    primary_cost = model_cost_config(model)
+    if not primary_cost:
+        return None
+    primary_price = primary_cost["input"] + primary_cost["output"]
+    for candidate, _ in sorted(knn_scores.items(), key=lambda item: item[1], reverse=True):
+        candidate_cost = model_cost_config(candidate)
+        if candidate == model or not candidate_cost:
+            continue
+        if candidate_cost["input"] + candidate_cost["output"] <= HEDGE_MAX_PRICE_RATIO * primary_price:
+            return candidate
+    return None
+
+
+def hedge_delay_s(model: str) -> float:
+    """Seconds to wait for the first token before hedging: the model's rolling TTFT percentile."""
+    ttft_ms = LATENCY.percentile(model, "ttft", HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+    return ttft_ms / 1000 if ttft_ms is not None else HEDGE_DEFAULT_DELAY_S
+
+
+def _finish_reason(response) -> str | None:
+    """The response's finish_reason ("length" when the answer was cut off at max_tokens)."""
+    try:
+        return response.choices[0].finish_reason
+    except (AttributeError, IndexError):
+        return None
 
 
 async def worker_node(state: NexusState) -> dict:
-    """Single worker: calls the KNN-selected model with timeout and cost tracking."""
+    """Single worker: streams the KNN-selected model's answer with an adaptive timeout and cost tracking.
+    With WORKER_HEDGING a slow first token triggers a backup request (see hedge_backup)."""
     selected_models = state.get("selected_models", [])
     model = selected_models[0] if selected_models else "groq/llama-3.1-8b-instant"
 
     query = state.get("enriched_query") or state.get("query", "")
+    messages = [{"role": "user", "content": query}]
 
+    queue = track_queue_wait()
     start = time.time()
+    ttft_ms = 0.0
+    answered_by, loser, hedge_cost = model, None, 0.0
+    error = False
+    finish_reason = None
     try:
-        response = await asyncio.wait_for(
-            litellm.acompletion(
+        if WORKER_HEDGING:
+            backup = hedge_backup(model, state.get("knn_scores", {}))
+            output_content, response, ttft_ms, answered_by, loser = await hedged_stream_completion(
                 model=model,
-                messages=[{"role": "user", "content": query}],
-            ),
-            timeout=30,
-        )
+                backup=backup,
+                messages=messages,
+                node="worker",
+                hedge_after_s=hedge_delay_s(model),
+            )
+        else:
+            output_content, response, ttft_ms, answered_by = await stream_completion(
+                model=model,
+                messages=messages,
+                node="worker",
+            )
         latency_ms = (time.time() - start) * 1000
-        output_content = response.choices[0].message.content
-        cost_usd = calculate_cost(model, response)
+        cost_usd = calculate_cost(answered_by, response)
+        finish_reason = _finish_reason(response)
+        if loser:
+            # The cancelled request was billed for its prompt at least
+            hedge_cost = estimate_prompt_cost(loser, messages)
+            cost_usd += hedge_cost
 
     except asyncio.TimeoutError:
-        latency_ms = 30000.0
+        latency_ms = (time.time() - start) * 1000
         output_content = "[timeout]"
         cost_usd = 0.0
+        error = True
 
     except Exception as e:
         latency_ms = (time.time() - start) * 1000
         output_content = f"Error: {str(e)}"
         cost_usd = 0.0
+        error = True
+
+    if WORKER_HEDGING:
+        stats = HEDGE_STATS[model]
+        stats["requests"] += 1
+        if loser:
+            stats["hedged"] += 1
+            stats["backup_wins"] += answered_by != model
+            stats["extra_cost_usd"] += hedge_cost
 
     worker_result = {
-        "model": model,
+        "model": answered_by,
         "response": output_content,
         "cost_usd": cost_usd,
         "latency_ms": round(latency_ms, 2),
+        "ttft_ms": round(ttft_ms, 2),
+        "error": error,
+        "finish_reason": finish_reason,
     }
 
+    detail = f"model={answered_by} ttft={ttft_ms:.0f}ms latency={latency_ms:.0f}ms cost=${cost_usd:.6f}"
+    if queue["wait_ms"] >= 1:
+        detail += f" queued={queue['wait_ms']:.0f}ms"
+    if loser:
+        detail += f" hedged: {answered_by} beat {loser} (+${hedge_cost:.6f})"
+    elif answered_by != model:
+        detail += f" (fallback from {model})"
     trace_entry: TraceEntry = {
         "node": "worker",
-        "action": "completed",
-        "detail": f"model={model} latency={latency_ms:.0f}ms cost=${cost_usd:.6f}",
+        "action": "hedged" if loser else "completed",
+        "detail": detail,
         "timestamp": time.time(),
+        "latency_ms": round(latency_ms, 2),
+        "queue_wait_ms": round(queue["wait_ms"], 2),
     }
 
     return {
         "worker_responses": [worker_result],
         "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + cost_usd,
-        "total_latency": state.get("total_latency", 0.0) + (latency_ms / 1000),
+        "total_cost": cost_usd,
+        "total_latency": latency_ms / 1000,
     }
 
 
 async def parallel_worker_node(state: NexusState) -> dict:
-    """Fan-out: one coroutine per subtask using the KNN-selected model for each."""
+    """Fan-out: one coroutine per subtask using the KNN-selected model for each.
+
+    With PARALLEL_FAN_IN="streaming" results are consumed as they complete, each announced
+    with a `subtask` event, and stragglers past PARALLEL_DEADLINE_S are dropped.
+    worker_responses stay in subtask order either way. At most PARALLEL_MAX_CONCURRENCY
+    subtask calls run at once.
+
+    For critical queries (with SUBTASK_JUDGING) each result is judged as soon as it lands,
+    while the other subtasks are still running, and a failed subtask is re-run on the
+    escalation model right away (see judge_subtask). No subtask is dropped in that case.
+    """
     query = state.get("enriched_query") or state.get("query", "")
     subtasks = state.get("subtasks", [])
     selected_models = state.get("selected_models", [])
+    judge_subtasks = SUBTASK_JUDGING and state.get("is_critical", False)
+
+    if not selected_models:
+        # Routing gave no model (e.g. no KNN index): fail every subtask rather than raise
+        worker_responses = [{
+            "model": "",
+            "subtask": subtask,
+            "response": "Error: no model selected for this subtask",
+            "cost_usd": 0.0,
+            "latency_ms": 0.0,
+            "error": True,
+        } for subtask in subtasks]
+        return {
+            "worker_responses": worker_responses,
+            "total_cost": 0.0,
+            "total_latency": 0.0,
+            "subtasks_judged": False,
+            "trace": [{
+                "node": "parallel_workers",
+                "action": "fan_out",
+                "detail": f"0 of {len(subtasks)} agents dispatched: routing selected no model",
+                "timestamp": time.time(),
+                "latency_ms": 0.0,
+            }],
+        }
+
+    in_flight = asyncio.Semaphore(max(1, PARALLEL_MAX_CONCURRENCY))
 
-    async def run_subtask(subtask: str, model: str) -> dict:
+    async def run_subtask(subtask: str, model: str, messages: list[dict]) -> dict:
+        queue = track_queue_wait()
         start = time.time()
+        error = False
+        finish_reason = None
         try:
-            response = await asyncio.wait_for(
-                litellm.acompletion(
+            async with in_flight:
+                response, model = await complete(
                     model=model,
-                    messages=[
-                        {"role": "system", "content": f"You are a specialist. Focus ONLY on this subtask: {subtask}"},
-                        {"role": "user", "content": f"For query: {query}\nHandle this aspect: {subtask}"},
-                    ],
-                ),
-                timeout=30,
-            )
+                    messages=messages,
+                    node="parallel_worker",
+                )
             latency_ms = (time.time() - start) * 1000
             content = response.choices[0].message.content
             cost_usd = calculate_cost(model, response)
+            finish_reason = _finish_reason(response)
         except asyncio.TimeoutError:
-            latency_ms = 30000.0
+            latency_ms = (time.time() - start) * 1000
             content = "[timeout]"
             cost_usd = 0.0
+            error = True
         except Exception as e:
             latency_ms = (time.time() - start) * 1000
             content = f"Error: {str(e)}"
             cost_usd = 0.0
+            error = True
 
-        return {
+        result = {
             "model": model,
+            "subtask": subtask,
             "response": content,
             "cost_usd": cost_usd,
             "latency_ms": round(latency_ms, 2),
+            "queue_wait_ms": round(queue["wait_ms"], 2),
+            "error": error,
+            "finish_reason": finish_reason,
         }
+        if judge_subtasks:
+            result = await judge_subtask(query, result)
+        return result
 
-    # Build coroutines — match each subtask to its selected model
-    coroutines = []
+    # Match each subtask to its selected model
+    jobs = []
     for i, subtask in enumerate(subtasks):
         model = selected_models[i] if i < len(selected_models) else selected_models[-1]
-        coroutines.append(run_subtask(subtask, model))
+        messages = [
+            {"role": "system", "content": f"You are a specialist. Focus ONLY on this subtask: {subtask}"},
+            {"role": "user", "content": f"For query: {query}\nHandle this aspect: {subtask}"},
+        ]
+        jobs.append((subtask, model, messages))
 
-    # Fan-out with asyncio.gather
-    results = await asyncio.gather(*coroutines, return_exceptions=True)
+    start = time.time()
+    tasks = [asyncio.create_task(run_subtask(*job)) for job in jobs]
+    if PARALLEL_FAN_IN == "streaming":
+        results = await _fan_in_as_completed(tasks, jobs, start, None if judge_subtasks else PARALLEL_DEADLINE_S)
+    else:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    fan_in_s = time.time() - start
 
     worker_responses = []
     total_cost = 0.0
-    total_latency = 0.0
-
     for i, result in enumerate(results):
-        if isinstance(result, Exception):
-            worker_responses.append({
-                "model": selected_models[i] if i < len(selected_models) else "unknown",
+        if isinstance(result, BaseException):
+            result = {
+                "model": jobs[i][1],
+                "subtask": jobs[i][0],
                 "response": f"Error: {str(result)}",
                 "cost_usd": 0.0,
                 "latency_ms": 0.0,
-            })
-        else:
-            worker_responses.append(result)
-            total_cost += result.get("cost_usd", 0.0)
-            total_latency = max(total_latency, result.get("latency_ms", 0.0) / 1000)
+                "error": True,
+            }
+        worker_responses.append(result)
+        total_cost += result.get("cost_usd", 0.0)
 
-    trace_entry: TraceEntry = {
+    dropped = sum(1 for r in worker_responses if r.get("dropped"))
+    failed = sum(1 for r in worker_responses if r.get("error") and not r.get("dropped"))
+    detail = f"{len(subtasks)} agents dispatched ({PARALLEL_FAN_IN})"
+    if failed:
+        detail += f", {failed} failed"
+    if dropped:
+        detail += f", {dropped} dropped past {PARALLEL_DEADLINE_S:g}s deadline"
+    max_queue_wait_ms = max((r.get("queue_wait_ms", 0.0) for r in worker_responses), default=0.0)
+    trace: list[TraceEntry] = [{
         "node": "parallel_workers",
         "action": "fan_out",
-        "detail": f"{len(subtasks)} agents dispatched",
+        "detail": detail,
         "timestamp": time.time(),
-    }
+        "latency_ms": round(fan_in_s * 1000, 2),
+        "queue_wait_ms": round(max_queue_wait_ms, 2),
+    }]
 
-    return {
+    output = {
         "worker_responses": worker_responses,
-        "trace": [trace_entry],
-        "total_cost": state.get("total_cost", 0.0) + total_cost,
-        "total_latency": state.get("total_latency", 0.0) + total_latency,
+        "total_cost": total_cost,
+        "total_latency": fan_in_s,
+        "subtasks_judged": judge_subtasks,
     }
+    if judge_subtasks:
+        output.update(_subtask_judgement(state, worker_responses, trace))
+    output["trace"] = trace
+    return output
+
+
+def _subtask_judgement(state: NexusState, worker_responses: list[dict], trace: list[TraceEntry]) -> dict:
+    """State updates for per-subtask judging: the lowest subtask score stands in for the
+    judge score, and any escalated subtask counts as the query's escalation."""
+    judged = [r for r in worker_responses if "judge_tier" in r]
+    escalated = [r for r in judged if r.get("escalated_from")]
+    llm_judged = sum(1 for r in judged if r["judge_tier"] != "prescreen")
+
+    detail = f"{len(judged)}/{len(worker_responses)} subtasks judged ({llm_judged} by LLM)"
+    if escalated:
+        detail += ", escalated: " + ", ".join(
+            f"#{worker_responses.index(r) + 1} {r['escalated_from']} -> {r['model']}" for r in escalated
+        )
+    escalation_cost = sum(r.get("escalation_cost_usd", 0.0) for r in escalated)
+    if escalation_cost:
+        detail += f" (+${escalation_cost:.6f})"
+    trace.append({
+        "node": "judge",
+        "action": "subtasks_judged" if llm_judged else "prescreen_subtasks_judged",
+        "detail": detail,
+        "timestamp": time.time(),
+        "latency_ms": max((r.get("judge_ms", 0.0) for r in judged), default=0.0),
+    })
+
+    update = {"judge_score": min((r["judge_score"] for r in judged), default=0.0)}
+    if escalated:
+        update["escalation_count"] = state.get("escalation_count", 0) + 1
+    return update
+
+
+async def _fan_in_as_completed(tasks: list[asyncio.Task], jobs: list[tuple], start: float,
+                               deadline_s: float | None) -> list[dict]:
+    """Collect subtask results in completion order, emitting a `subtask` event as each lands.
+    Once one has succeeded, whatever is still running at `deadline_s` is cancelled and
+    returned as a dropped result carrying its estimated prompt cost (None: wait for all)."""
+    results: list[dict | None] = [None] * len(tasks)
+    index = {task: i for i, task in enumerate(tasks)}
+    pending = set(tasks)
+    succeeded = landed = 0
+    try:
+        while pending:
+            wait_s = None
+            if succeeded and deadline_s:
+                wait_s = max(0.0, deadline_s - (time.time() - start))
+            done, pending = await asyncio.wait(pending, timeout=wait_s, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                i = index[task]
+                try:
+                    result = task.result()
+                except BaseException as e:
+                    # Same shape as a failed subtask in gather mode (return_exceptions=True)
+                    result = {
+                        "model": jobs[i][1],
+                        "subtask": jobs[i][0],
+                        "response": f"Error: {str(e)}",
+                        "cost_usd": 0.0,
+                        "latency_ms": 0.0,
+                        "error": True,
+                    }
+                results[i] = result
+                landed += 1
+                succeeded += not result["error"]
+                await emit_event("subtask", {
+                    "node": "parallel_worker",
+                    "index": i,
+                    "subtask": result["subtask"],
+                    "model": result["model"],
+                    "status": "failed" if result["error"] else "escalated" if result.get("escalated_from") else "completed",
+                    "latency_ms": result["latency_ms"],
+                    "completed": landed,
+                    "total": len(tasks),
+                })
+    finally:
+        for task in pending:
+            task.cancel()
+
+    for task in pending:
+        i = index[task]
+        subtask, model, messages = jobs[i]
+        results[i] = {
+            "model": model,
+            "subtask": subtask,
+            "response": "[dropped: past fan-in deadline]",
+            "cost_usd": estimate_prompt_cost(model, messages),
+            "latency_ms": round((time.time() - start) * 1000, 2),
+            "error": True,
+            "dropped": True,
+        }
+        await emit_event("subtask", {
+            "node": "parallel_worker",
+            "index": i,
+            "subtask": subtask,
+            "model": model,
+            "status": "dropped",
+            "latency_ms": results[i]["latency_ms"],
+            "completed": len(tasks),
+            "total": len(tasks),
+        })
+    return results
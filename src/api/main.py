@@ -1,18 +1,25 @@
 import json
+import time
+import asyncio
 from fastapi import FastAPI
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from langgraph.types import Command
+from langgraph.types import Command, Overwrite
 
 from core.graph import nexus_graph
-from core.config import MODEL_COSTS, GPT5_BASELINE_COST
+from core.config import (
+    MODEL_COSTS, GPT5_BASELINE_COST, NODE_TIMEOUTS, TIMEOUT_PERCENTILE, TIMEOUT_FACTOR, CHECKPOINT_SWEEP_INTERVAL_S,
+)
+from core.metrics import speculation_stats, hedge_stats, judge_stats, escalation_stats, latency_report, LATENCY
+from core.circuit_breaker import circuit_stats
+from core.scheduler import SCHEDULER
+from core.http_pool import warm_up, close_pools, http_pool_stats
 from core.prototypes import MODEL_PROTOTYPES
 import agents.knn_router as knn_mod
 
 app = FastAPI(title="NEXUS")
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
-active_sessions = {}
 
 
 class ChatRequest(BaseModel):
@@ -27,10 +34,28 @@ class ResumeRequest(BaseModel):
 
 @app.on_event("startup")
 async def startup():
-    """Build the KNN index at startup by embedding all prototypes."""
+    """Pre-connect the provider HTTP pools and load the KNN index (from the on-disk cache,
+    or by embedding all prototypes) at startup."""
     from agents.knn_router import build_knn_index
+    start = time.time()
+    warming = asyncio.create_task(warm_up())
+    nexus_graph.checkpointer.start_sweeper(CHECKPOINT_SWEEP_INTERVAL_S)
     knn_mod.KNN_INDEX = await build_knn_index()
-    print(f"KNN index built: {knn_mod.KNN_INDEX['all_vectors'].shape[0]} vectors loaded")
+    elapsed_ms = (time.time() - start) * 1000
+    print(
+        f"KNN index ready: {len(knn_mod.KNN_INDEX)} vectors "
+        f"({knn_mod.KNN_INDEX.source}, {elapsed_ms:.0f}ms)"
+    )
+    warmed = await warming
+    if warmed:
+        print(f"HTTP pools warmed: {warmed} keep-alive connections ({(time.time() - start) * 1000:.0f}ms)")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await nexus_graph.checkpointer.stop_sweeper()
+    await asyncio.to_thread(knn_mod.EMBED_CACHE.flush)
+    await close_pools()
 
 
 async def state_to_sse(generator):
@@ -39,6 +64,11 @@ async def state_to_sse(generator):
         async for event in generator:
             kind = event.get("event")
 
+            # Incremental worker / aggregator / escalation output, and parallel subtasks as they land
+            if kind == "on_custom_event" and event.get("name") in ("token", "subtask"):
+                yield f"data: {json.dumps({'type': event['name'], **event.get('data', {})})}\n\n"
+                continue
+
             if kind == "on_chain_end" and not event.get("name") == "LangGraph":
                 data = event.get("data", {})
                 if "output" in data and isinstance(data["output"], dict):
@@ -54,31 +84,37 @@ async def state_to_sse(generator):
                         yield f"data: {json.dumps({'type': 'interrupt', 'question': output['clarifying_question']})}\n\n"
                         break
 
-                    # Check for final exit
-                    if "final_response" in output and output.get("final_response"):
-                        total_cost = output.get("total_cost", 0.0)
-                        total_latency = output.get("total_latency", 0.0)
-                        cost_saved = GPT5_BASELINE_COST - total_cost
-                        routed_models = output.get("selected_models", [])
-                        worker_responses = output.get("worker_responses", []) or []
-                        used_models = [w.get("model", "unknown") for w in worker_responses if isinstance(w, dict)]
-                        if output.get("escalation_count", 0) > 0 and output.get("escalation_model"):
-                            used_models.append(output["escalation_model"])
-                        payload = {
-                            "type": "final",
-                            "response": output["final_response"],
-                            "total_cost": round(total_cost, 6),
-                            "total_latency": round(total_latency, 2),
-                            "cost_saved": round(cost_saved, 6),
-                            "baseline_model": "gpt-5",
-                            "baseline_cost": round(GPT5_BASELINE_COST, 6),
-                            "routed_models": routed_models,
-                            "used_models": used_models,
-                        }
-                        yield f"data: {json.dumps(payload)}\n\n"
+            # Graph exit: node outputs only carry their own cost/latency increments, the
+            # accumulated totals are in the final state
+            if kind == "on_chain_end" and event.get("name") == "LangGraph":
+                output = event.get("data", {}).get("output")
+                if isinstance(output, dict) and output.get("final_response"):
+                    total_cost = output.get("total_cost", 0.0)
+                    total_latency = output.get("total_latency", 0.0)
+                    cost_saved = GPT5_BASELINE_COST - total_cost
+                    routed_models = output.get("selected_models", [])
+                    worker_responses = output.get("worker_responses", []) or []
+                    used_models = [w.get("model", "unknown") for w in worker_responses if isinstance(w, dict)]
+                    if output.get("escalation_count", 0) > 0 and output.get("escalation_model"):
+                        used_models.append(output["escalation_model"])
+                    payload = {
+                        "type": "final",
+                        "response": output["final_response"],
+                        "total_cost": round(total_cost, 6),
+                        "total_latency": round(total_latency, 2),
+                        "cost_saved": round(cost_saved, 6),
+                        "baseline_model": "gpt-5",
+                        "baseline_cost": round(GPT5_BASELINE_COST, 6),
+                        "routed_models": routed_models,
+                        "used_models": used_models,
+                    }
+                    yield f"data: {json.dumps(payload)}\n\n"
 
     except Exception as e:
         yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+    finally:
+        # Commit this request's buffered checkpoints so any worker process can resume the session
+        await asyncio.to_thread(nexus_graph.checkpointer.flush)
 
     yield "data: [DONE]\n\n"
 
@@ -86,16 +122,19 @@ async def state_to_sse(generator):
 @app.post("/chat")
 async def chat_endpoint(req: ChatRequest):
     config = {"configurable": {"thread_id": req.session_id}}
-    active_sessions[req.session_id] = config
 
+    # The UI reuses one session_id per chat: start each query from empty accumulators
+    # instead of adding to the previous query's
     initial_state = {
         "query": req.query,
-        "trace": [],
-        "worker_responses": [],
+        "trace": Overwrite([]),
+        "worker_responses": Overwrite([]),
         "knn_scores": {},
         "selected_models": [],
-        "total_cost": 0.0,
-        "total_latency": 0.0,
+        "aggregated_response": "",
+        "final_response": "",
+        "total_cost": Overwrite(0.0),
+        "total_latency": Overwrite(0.0),
         "escalation_count": 0,
     }
     stream_generator = nexus_graph.astream_events(initial_state, config=config, version="v2")
@@ -104,8 +143,11 @@ async def chat_endpoint(req: ChatRequest):
 
 @app.post("/resume")
 async def resume_endpoint(req: ResumeRequest):
-    config = active_sessions.get(req.session_id)
-    if not config:
+    # Sessions live in the checkpointer (shared by all workers with CHECKPOINT_BACKEND=sqlite)
+    config = {"configurable": {"thread_id": req.session_id}}
+    if await nexus_graph.checkpointer.aget_tuple(config) is None:
+        if await nexus_graph.checkpointer.aevicted(req.session_id):
+            return {"error": "Session expired"}
         return {"error": "Session not found"}
 
     stream_generator = nexus_graph.astream_events(Command(resume=req.answer), config=config, version="v2")
@@ -115,7 +157,7 @@ async def resume_endpoint(req: ResumeRequest):
 @app.get("/trace/{session_id}")
 async def get_trace(session_id: str):
     config = {"configurable": {"thread_id": session_id}}
-    state = nexus_graph.get_state(config)
+    state = await nexus_graph.aget_state(config)
     if state and hasattr(state, "values"):
         return {"trace": state.values.get("trace", [])}
     return {"trace": []}
@@ -131,10 +173,33 @@ async def get_models():
     }
 
 
+@app.get("/latency")
+async def get_latency():
+    """Rolling per-model latency histograms and the adaptive timeout each node currently uses."""
+    return {
+        "timeout_rule": {"percentile": TIMEOUT_PERCENTILE, "factor": TIMEOUT_FACTOR},
+        "node_budgets_s": NODE_TIMEOUTS,
+        "models": latency_report(),
+    }
+
+
 @app.get("/health")
 async def health_check():
     return {
         "status": "ok",
         "models": 7,
         "knn_index_loaded": knn_mod.KNN_INDEX is not None,
+        "knn_index_source": knn_mod.KNN_INDEX.source if knn_mod.KNN_INDEX is not None else None,
+        "embed_cache": knn_mod.EMBED_CACHE.stats(),
+        "response_cache": knn_mod.RESPONSE_CACHE.stats(),
+        "knn_online": knn_mod.online_learning_stats(),
+        "speculation": speculation_stats(),
+        "hedging": hedge_stats(),
+        "judge": judge_stats(),
+        "escalation": escalation_stats(),
+        "checkpoints": await nexus_graph.checkpointer.astats(),
+        "circuits": circuit_stats(),
+        "scheduler": SCHEDULER.stats(),
+        "http_pools": http_pool_stats(),
+        "model_latency": LATENCY.snapshot(),
     }
@@ -0,0 +1,819 @@
+import os
+import time
+import zlib
+import random
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict, defaultdict
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from core.config import (
+    CHECKPOINT_TTL_S, CHECKPOINT_MAX_PER_THREAD, CHECKPOINT_MAX_MB, CHECKPOINT_BACKEND,
+    CHECKPOINT_SQLITE_PATH, CHECKPOINT_BATCH_ROWS, CHECKPOINT_COMPRESS_MIN_BYTES, CHECKPOINT_PAYLOAD_MIN_BYTES,
+)
+
+CHECKPOINT_BACKENDS = ("memory", "sqlite")
+
+
+def _size(typed: tuple[str, bytes]) -> int:
+    return len(typed[1])
+
+
+def _next_version(self, current: str | int | None, channel=None) -> str:
+    """InMemorySaver's channel version (zero-padded counter, random suffix so branches forked
+    from one checkpoint never share a blob key) in 17 characters instead of 49. Every
+    checkpoint stores one per channel, plus one per channel each node has seen."""
+    if current is None:
+        counter = 0
+    elif isinstance(current, int):
+        counter = current
+    else:
+        counter = int(current.split(".")[0], 16)
+    return f"{counter + 1:08x}.{random.getrandbits(32):08x}"
+
+
+class _Sweeper:
+    """Periodic sweep() on the event loop, for savers with a TTL."""
+
+    _sweeper: asyncio.Task | None = None
+
+    def sweep(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def evicted(self, thread_id: str) -> bool:
+        """True if the thread was dropped by TTL or LRU eviction within the last ttl_s
+        (so /resume can tell an expired session from one that never existed)."""
+        raise NotImplementedError
+
+    # Async entry points for the API; savers that block on I/O run these in a worker thread
+    async def asweep(self) -> int:
+        return self.sweep()
+
+    async def astats(self) -> dict:
+        return self.stats()
+
+    async def aevicted(self, thread_id: str) -> bool:
+        return self.evicted(thread_id)
+
+    def start_sweeper(self, interval_s: float) -> None:
+        """Run sweep() every `interval_s` seconds on the current event loop."""
+        async def run() -> None:
+            while True:
+                await asyncio.sleep(interval_s)
+                await self.asweep()
+
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(run())
+
+    async def stop_sweeper(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+
+_REF = "\x00payload:"
+
+
+class _Payloads:
+    """Large values stored once per thread and referenced by content id.
+
+    LangGraph serializes a channel's whole value every time it changes, so the trace is
+    written again at every step and a response body once per channel and write that carries
+    it. Before serialization, strings and list items (trace entries, worker responses) of at
+    least `payload_min_bytes` serialized bytes are swapped for a reference to a per-thread
+    payload keyed by their hash; a payload already stored is not written again. Each blob and
+    write records the ids it references, and trimming a thread drops the payloads none of its
+    remaining blobs and writes still reference (0 disables).
+    """
+
+    payload_min_bytes = 0
+
+    def _ref(self, obj, out: dict):
+        typed = self.serde.dumps_typed(obj)
+        if len(typed[1]) < self.payload_min_bytes and not (isinstance(obj, str) and obj.startswith(_REF)):
+            return obj
+        payload_id = hashlib.blake2b(typed[0].encode() + typed[1], digest_size=12).hexdigest()
+        out[payload_id] = typed
+        return _REF + payload_id
+
+    def _pack(self, obj, out: dict):
+        """`obj` with its large parts replaced by references; new payloads are added to `out`."""
+        if not self.payload_min_bytes:
+            return obj
+        if isinstance(obj, list):
+            return [self._pack_item(item, out) for item in obj]
+        return self._ref(obj, out) if isinstance(obj, str) else obj
+
+    def _pack_item(self, item, out: dict):
+        if isinstance(item, dict):
+            # The body is its own payload, so final_response and the item share it
+            item = {k: self._ref(v, out) if isinstance(v, str) else v for k, v in item.items()}
+        return self._ref(item, out) if isinstance(item, (str, dict)) else item
+
+    def _unpack(self, obj, load):
+        """Inverse of _pack; `load(payload_id)` returns the stored (type, bytes)."""
+        if isinstance(obj, list):
+            return [self._unpack_item(item, load) for item in obj]
+        return self._deref(obj, load)
+
+    def _unpack_item(self, item, load):
+        item = self._deref(item, load)
+        if isinstance(item, dict):
+            return {k: self._deref(v, load) for k, v in item.items()}
+        return item
+
+    def _deref(self, obj, load):
+        if isinstance(obj, str) and obj.startswith(_REF):
+            return self.serde.loads_typed(load(obj[len(_REF):]))
+        return obj
+
+    def _unpack_tuple(self, tup: CheckpointTuple | None, load) -> CheckpointTuple | None:
+        if tup is None:
+            return None
+        values = {k: self._unpack(v, load) for k, v in tup.checkpoint["channel_values"].items()}
+        writes = [(task_id, channel, self._unpack(v, load)) for task_id, channel, v in tup.pending_writes or []]
+        return tup._replace(checkpoint={**tup.checkpoint, "channel_values": values}, pending_writes=writes)
+
+
+class BoundedMemorySaver(_Sweeper, _Payloads, InMemorySaver):
+    """InMemorySaver that forgets: per-thread TTL, a cap on checkpoints per thread and a
+    global byte budget with LRU eviction of whole threads.
+
+    Sizes are the serialized bytes of checkpoints, channel blobs, pending writes and payloads,
+    tracked incrementally per thread. Trimming a thread drops its oldest checkpoints, their writes
+    and every blob version no remaining checkpoint refers to; the newest checkpoint (the one
+    a HITL resume continues from) is always kept. Expired threads are removed by sweep(),
+    run periodically by start_sweeper(), or lazily when they are next read.
+    """
+
+    def __init__(self, *, ttl_s: float, max_checkpoints_per_thread: int, max_bytes: int,
+                 payload_min_bytes: int = 0, serde=None):
+        super().__init__(serde=serde)
+        self.ttl_s = ttl_s
+        self.max_checkpoints_per_thread = max(1, max_checkpoints_per_thread)
+        self.max_bytes = max_bytes
+        self.payload_min_bytes = payload_min_bytes
+        self.payloads: dict[tuple[str, str], tuple[str, bytes]] = {}
+        self._thread_payloads: dict[str, set] = defaultdict(set)
+        self._refs: dict[tuple, set] = {}  # blob or write key -> payload ids it references
+        self._threads: OrderedDict[str, float] = OrderedDict()  # thread_id -> last access, LRU first
+        self._bytes: dict[str, int] = defaultdict(int)
+        self._history: dict[tuple[str, str], OrderedDict[str, dict]] = defaultdict(OrderedDict)
+        self._thread_blobs: dict[str, set] = defaultdict(set)
+        self._thread_writes: dict[str, set] = defaultdict(set)
+        self._evicted: OrderedDict[str, float] = OrderedDict()  # thread_id -> eviction time, oldest first
+        self.total_bytes = 0
+        self.ttl_evictions = 0
+        self.lru_evictions = 0
+        self.trimmed_checkpoints = 0
+
+    get_next_version = _next_version
+
+    # ---- accounting ----
+
+    def _grow(self, thread_id: str, delta: int) -> None:
+        self._bytes[thread_id] += delta
+        self.total_bytes += delta
+
+    def _touch(self, thread_id: str) -> None:
+        self._threads[thread_id] = time.time()
+        self._threads.move_to_end(thread_id)
+
+    def _expired(self, thread_id: str) -> bool:
+        last = self._threads.get(thread_id)
+        return last is not None and time.time() - last > self.ttl_s
+
+    def _writes_size(self, key: tuple) -> int:
+        return sum(_size(write[2]) for write in self.writes.get(key, {}).values())
+
+    def _store_payloads(self, thread_id: str, payloads: dict) -> None:
+        known = self._thread_payloads[thread_id]
+        for payload_id, typed in payloads.items():
+            if payload_id not in known:
+                known.add(payload_id)
+                self.payloads[(thread_id, payload_id)] = typed
+                self._grow(thread_id, _size(typed))
+
+    def _loader(self, thread_id: str):
+        return lambda payload_id: self.payloads[(thread_id, payload_id)]
+
+    # ---- BaseCheckpointSaver ----
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        if self._expired(thread_id):
+            self._evict(thread_id)
+            self.ttl_evictions += 1
+        result = super().get_tuple(config)
+        if thread_id in self._threads:
+            self._touch(thread_id)
+        else:
+            # The base lookup leaves an empty defaultdict entry behind for unknown threads
+            self.storage.pop(thread_id, None)
+        return self._unpack_tuple(result, self._loader(thread_id))
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        for tup in super().list(config, filter=filter, before=before, limit=limit):
+            yield self._unpack_tuple(tup, self._loader(tup.config["configurable"]["thread_id"]))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        keys = [(thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items()]
+        replaced = sum(_size(self.blobs[key]) for key in keys if key in self.blobs)
+
+        values = checkpoint["channel_values"]
+        packed = {}
+        for key in keys:
+            if key[2] in values:
+                payloads = {}
+                packed[key[2]] = self._pack(values[key[2]], payloads)
+                self._store_payloads(thread_id, payloads)
+                self._refs[key] = set(payloads)
+        result = super().put(config, {**checkpoint, "channel_values": {**values, **packed}}, metadata, new_versions)
+
+        saved = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+        added = _size(saved[0]) + _size(saved[1]) + sum(_size(self.blobs[key]) for key in keys) - replaced
+        self._thread_blobs[thread_id].update(keys)
+        self._history[(thread_id, checkpoint_ns)][checkpoint["id"]] = dict(checkpoint["channel_versions"])
+        self._grow(thread_id, added)
+        self._touch(thread_id)
+        self._trim(thread_id, checkpoint_ns)
+        self._enforce_budget(keep=thread_id)
+        return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        before = self._writes_size(key)
+        payloads = {}
+        writes = [(channel, self._pack(value, payloads)) for channel, value in writes]
+        self._store_payloads(thread_id, payloads)
+        self._refs.setdefault(key, set()).update(payloads)
+        super().put_writes(config, writes, task_id, task_path)
+        self._thread_writes[thread_id].add(key)
+        self._grow(thread_id, self._writes_size(key) - before)
+        self._touch(thread_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        # Targeted version of InMemorySaver.delete_thread, which scans every write and blob
+        self.storage.pop(thread_id, None)
+        for key in self._thread_writes.pop(thread_id, ()):
+            self.writes.pop(key, None)
+            self._refs.pop(key, None)
+        for key in self._thread_blobs.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+            self._refs.pop(key, None)
+        for payload_id in self._thread_payloads.pop(thread_id, ()):
+            self.payloads.pop((thread_id, payload_id), None)
+        for key in [k for k in self._history if k[0] == thread_id]:
+            del self._history[key]
+        self._threads.pop(thread_id, None)
+        self.total_bytes -= self._bytes.pop(thread_id, 0)
+
+    # ---- bounds ----
+
+    def _trim(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Drop the thread's oldest checkpoints beyond the per-thread cap, with their
+        writes, the blob versions only they referenced and the payloads nothing kept refers to."""
+        history = self._history[(thread_id, checkpoint_ns)]
+        if len(history) <= self.max_checkpoints_per_thread:
+            return
+        freed = 0
+        while len(history) > self.max_checkpoints_per_thread:
+            checkpoint_id, _ = history.popitem(last=False)
+            saved = self.storage[thread_id][checkpoint_ns].pop(checkpoint_id, None)
+            if saved:
+                freed += _size(saved[0]) + _size(saved[1])
+            write_key = (thread_id, checkpoint_ns, checkpoint_id)
+            freed += self._writes_size(write_key)
+            self.writes.pop(write_key, None)
+            self._refs.pop(write_key, None)
+            self._thread_writes[thread_id].discard(write_key)
+            self.trimmed_checkpoints += 1
+
+        live = {(thread_id, checkpoint_ns, channel, version)
+                for versions in history.values() for channel, version in versions.items()}
+        blobs = self._thread_blobs[thread_id]
+        for key in [k for k in blobs if k[1] == checkpoint_ns and k not in live]:
+            blobs.discard(key)
+            self._refs.pop(key, None)
+            blob = self.blobs.pop(key, None)
+            if blob:
+                freed += _size(blob)
+
+        referenced = set()
+        for key in blobs | self._thread_writes[thread_id]:
+            referenced |= self._refs.get(key, set())
+        known = self._thread_payloads[thread_id]
+        for payload_id in known - referenced:
+            known.discard(payload_id)
+            freed += _size(self.payloads.pop((thread_id, payload_id)))
+        self._grow(thread_id, -freed)
+
+    def _enforce_budget(self, keep: str) -> None:
+        """Evict least recently used threads (never `keep`, the one being written) until the
+        total fits in max_bytes."""
+        while self.total_bytes > self.max_bytes:
+            victim = next((t for t in self._threads if t != keep), None)
+            if victim is None:
+                return
+            self._evict(victim)
+            self.lru_evictions += 1
+
+    def _evict(self, thread_id: str) -> None:
+        """delete_thread, remembering the id for ttl_s so evicted() can report it."""
+        self.delete_thread(thread_id)
+        self._evicted[thread_id] = time.time()
+        self._evicted.move_to_end(thread_id)
+        self._forget_evicted()
+
+    def _forget_evicted(self) -> None:
+        cutoff = time.time() - self.ttl_s
+        while self._evicted and next(iter(self._evicted.values())) < cutoff:
+            self._evicted.popitem(last=False)
+
+    def evicted(self, thread_id: str) -> bool:
+        self._forget_evicted()
+        return thread_id in self._evicted
+
+    def sweep(self) -> int:
+        """Delete every thread idle for longer than ttl_s. Returns how many were removed."""
+        cutoff = time.time() - self.ttl_s
+        expired = []
+        for thread_id, last in self._threads.items():
+            if last >= cutoff:
+                break  # LRU order: everything after this was used more recently
+            expired.append(thread_id)
+        for thread_id in expired:
+            self._evict(thread_id)
+        self.ttl_evictions += len(expired)
+        return len(expired)
+
+    def flush(self) -> None:
+        """Nothing is buffered in memory (the SQLite saver commits here)."""
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "threads": len(self._threads),
+            "checkpoints": sum(len(history) for history in self._history.values()),
+            "payloads": len(self.payloads),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "utilization": round(self.total_bytes / self.max_bytes, 4) if self.max_bytes else 0.0,
+            "ttl_s": self.ttl_s,
+            "max_checkpoints_per_thread": self.max_checkpoints_per_thread,
+            "ttl_evictions": self.ttl_evictions,
+            "lru_evictions": self.lru_evictions,
+            "trimmed_checkpoints": self.trimmed_checkpoints,
+        }
+
+
+class CompactSerializer(JsonPlusSerializer):
+    """The default msgpack serializer, plus zlib for values of at least `min_bytes`
+    (response bodies, traces). Compressed values carry a "+z" suffix on their type tag."""
+
+    def __init__(self, min_bytes: int, level: int = 1):
+        super().__init__()
+        self.min_bytes = min_bytes
+        self.level = level
+
+    def dumps_typed(self, obj) -> tuple[str, bytes]:
+        type_, data = super().dumps_typed(obj)
+        if len(data) >= self.min_bytes:
+            packed = zlib.compress(data, self.level)
+            if len(packed) < len(data):
+                return f"{type_}+z", packed
+        return type_, data
+
+    def loads_typed(self, data: tuple[str, bytes]):
+        type_, payload = data
+        if type_.endswith("+z"):
+            return super().loads_typed((type_[:-2], zlib.decompress(payload)))
+        return super().loads_typed(data)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, parent_id TEXT,
+    type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT, checkpoint_ns TEXT, channel TEXT, version TEXT, type TEXT, value BLOB, refs TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, task_id TEXT, idx INTEGER,
+    channel TEXT, type TEXT, value BLOB, task_path TEXT, refs TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS payloads (
+    thread_id TEXT, id TEXT, type TEXT, value BLOB,
+    PRIMARY KEY (thread_id, id)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    thread_id TEXT PRIMARY KEY, created REAL, updated REAL
+);
+CREATE TABLE IF NOT EXISTS evicted (
+    thread_id TEXT PRIMARY KEY, evicted REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated);
+"""
+
+
+class SQLiteSaver(_Sweeper, _Payloads, BaseCheckpointSaver[str]):
+    """Checkpoints in a local SQLite file in WAL mode, shared by every process on the host.
+
+    Each process opens its own connection; WAL lets them read while one writes. Rows are
+    buffered and committed in one transaction when CHECKPOINT_BATCH_ROWS accumulate, when a
+    task writes an interrupt or error (so another worker can resume it), before any read and
+    on flush(), which the API calls at the end of each request. The `sessions` table records
+    each thread's last write and drives TTL expiry; each thread keeps its newest
+    `max_checkpoints_per_thread` checkpoints. Blobs and writes list the payloads (see _Payloads)
+    they reference in `refs`, so trimming can drop the ones nothing kept refers to.
+    """
+
+    def __init__(self, path: str, *, ttl_s: float, max_checkpoints_per_thread: int,
+                 batch_rows: int, compress_min_bytes: int, payload_min_bytes: int = 0):
+        super().__init__(serde=CompactSerializer(compress_min_bytes))
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_checkpoints_per_thread = max(1, max_checkpoints_per_thread)
+        self.batch_rows = batch_rows
+        self.payload_min_bytes = payload_min_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        for table in ("blobs", "writes"):
+            # Files created before `refs` existed; their rows stay NULL and pin the thread's payloads
+            if "refs" not in {column[1] for column in self._db.execute(f"PRAGMA table_info({table})")}:
+                self._db.execute(f"ALTER TABLE {table} ADD COLUMN refs TEXT")
+        self._db.commit()
+        self._lock = threading.RLock()
+        self._checkpoints: list[tuple] = []
+        self._blobs: list[tuple] = []
+        self._writes: list[tuple] = []  # (replace, row)
+        self._payloads: dict[tuple[str, str], tuple[str, bytes]] = {}
+        self._touched: set[tuple[str, str]] = set()
+        self.commits = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.ttl_evictions = 0
+        self.trimmed_checkpoints = 0
+
+    get_next_version = _next_version
+
+    # ---- writes (buffered) ----
+
+    def _dumps(self, obj) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        self.bytes_written += len(data)
+        return type_, data
+
+    def _dumps_packed(self, thread_id: str, obj) -> tuple[str, bytes, str]:
+        """(type, bytes, refs): refs are the space-separated payload ids the value references."""
+        payloads = {}
+        packed = self._pack(obj, payloads)
+        for payload_id, (type_, data) in payloads.items():
+            if (thread_id, payload_id) not in self._payloads:
+                self._payloads[(thread_id, payload_id)] = (type_, data)
+                self.bytes_written += len(data)
+        return *self._dumps(packed), " ".join(payloads)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        c = checkpoint.copy()
+        values = c.pop("channel_values")
+        with self._lock:
+            for channel, version in new_versions.items():
+                typed = self._dumps_packed(thread_id, values[channel]) if channel in values else ("empty", b"", "")
+                self._blobs.append((thread_id, checkpoint_ns, channel, str(version), *typed))
+            self._checkpoints.append((
+                thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                *self._dumps(c), *self._dumps(get_checkpoint_metadata(config, metadata)),
+            ))
+            self._touched.add((thread_id, checkpoint_ns))
+            if self._pending() >= self.batch_rows:
+                self.flush()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        urgent = False
+        with self._lock:
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                # Regular writes are kept on retry (first wins), special ones overwritten
+                type_, data, refs = self._dumps_packed(thread_id, value)
+                self._writes.append((idx < 0, (thread_id, checkpoint_ns, checkpoint_id, task_id, idx,
+                                                channel, type_, data, task_path, refs)))
+                urgent |= channel in WRITES_IDX_MAP
+            self._touched.add((thread_id, checkpoint_ns))
+            if urgent or self._pending() >= self.batch_rows:
+                self.flush()
+
+    def _pending(self) -> int:
+        return len(self._checkpoints) + len(self._blobs) + len(self._writes) + len(self._payloads)
+
+    def flush(self) -> None:
+        """Commit everything buffered in one transaction and apply the per-thread cap."""
+        with self._lock:
+            if not self._pending():
+                return
+            rows = self._pending()
+            now = time.time()
+            with self._db:
+                self._db.executemany("INSERT OR IGNORE INTO payloads VALUES (?, ?, ?, ?)",
+                                     [(*key, *typed) for key, typed in self._payloads.items()])
+                self._db.executemany("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?, ?)", self._blobs)
+                self._db.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     self._checkpoints)
+                self._db.executemany("INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     [row for replace, row in self._writes if replace])
+                self._db.executemany("INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     [row for replace, row in self._writes if not replace])
+                self._db.executemany(
+                    "INSERT INTO sessions VALUES (?, ?, ?) ON CONFLICT (thread_id) DO UPDATE SET updated = excluded.updated",
+                    [(thread_id, now, now) for thread_id in {t for t, _ in self._touched}],
+                )
+                for thread_id, checkpoint_ns in self._touched:
+                    self._trim(thread_id, checkpoint_ns)
+            self._checkpoints, self._blobs, self._writes, self._payloads = [], [], [], {}
+            self._touched = set()
+            self.commits += 1
+            self.rows_written += rows
+
+    def _trim(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Delete checkpoints beyond the per-thread cap, their writes, blob versions older
+        than the oldest kept checkpoint's (versions only grow along a thread) and payloads no
+        remaining blob or write of the thread references."""
+        cur = self._db.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+            "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT ?)",
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.max_checkpoints_per_thread),
+        )
+        if not cur.rowcount:
+            return
+        self.trimmed_checkpoints += cur.rowcount
+        self._db.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN "
+            "(SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+            (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+        )
+        oldest = self._db.execute(
+            "SELECT type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id LIMIT 1",
+            (thread_id, checkpoint_ns),
+        ).fetchone()
+        versions = self.serde.loads_typed(oldest)["channel_versions"]
+        self._db.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version < ?",
+            [(thread_id, checkpoint_ns, channel, str(version)) for channel, version in versions.items()],
+        )
+        rows = self._db.execute(
+            "SELECT refs FROM blobs WHERE thread_id = ? UNION ALL SELECT refs FROM writes WHERE thread_id = ?",
+            (thread_id, thread_id),
+        ).fetchall()
+        if any(refs is None for refs, in rows):
+            return
+        referenced = {payload_id for refs, in rows for payload_id in refs.split()}
+        self._db.executemany(
+            "DELETE FROM payloads WHERE thread_id = ? AND id = ?",
+            [(thread_id, payload_id) for payload_id, in self._db.execute(
+                "SELECT id FROM payloads WHERE thread_id = ?", (thread_id,)).fetchall() if payload_id not in referenced],
+        )
+
+    # ---- reads ----
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_id, type_, data, metadata_type, metadata = row
+        checkpoint = self.serde.loads_typed((type_, data))
+        versions = checkpoint["channel_versions"]
+        values = {}
+        if versions:
+            placeholders = ", ".join("(?, ?)" for _ in versions)
+            params = [v for channel, version in versions.items() for v in (channel, str(version))]
+            for channel, blob_type, value in self._db.execute(
+                f"SELECT channel, type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+                f"AND (channel, version) IN (VALUES {placeholders})",
+                (thread_id, checkpoint_ns, *params),
+            ):
+                if blob_type != "empty":
+                    values[channel] = self.serde.loads_typed((blob_type, value))
+        writes = self._db.execute(
+            "SELECT task_id, channel, type, value, task_path, idx FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        writes.sort(key=lambda w: writes_sort_key(w[4], w[0], w[5]))
+        tup = CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": values},
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((t, v))) for task_id, channel, t, v, _, _ in writes],
+        )
+        return self._unpack_tuple(tup, self._loader(thread_id))
+
+    def _loader(self, thread_id: str):
+        loaded = {}
+
+        def load(payload_id: str) -> tuple[str, bytes]:
+            if payload_id not in loaded:
+                loaded[payload_id] = self._db.execute(
+                    "SELECT type, value FROM payloads WHERE thread_id = ? AND id = ?", (thread_id, payload_id)
+                ).fetchone()
+            return loaded[payload_id]
+
+        return load
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            self.flush()
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._db.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._db.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._tuple(thread_id, checkpoint_ns, row) if row else None
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata FROM checkpoints"
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            self.flush()
+            rows = self._db.execute(query, params).fetchall()
+            results = []
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                if filter:
+                    metadata = self.serde.loads_typed((row[4], row[5]))
+                    if not all(metadata.get(key) == value for key, value in filter.items()):
+                        continue
+                results.append(self._tuple(thread_id, checkpoint_ns, row))
+        yield from results
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self.flush()
+            with self._db:
+                for table in ("checkpoints", "blobs", "writes", "payloads", "sessions"):
+                    self._db.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    # sqlite3 blocks (up to the 30s busy timeout while another process writes), so the async
+    # API runs each call in a worker thread; the RLock serializes them against each other
+    async def aget_tuple(self, config):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    # ---- upkeep ----
+
+    # Sweeping commits and deletes under the lock the request path also takes, and stats runs
+    # COUNT(*) queries, so neither runs on the event loop
+    async def asweep(self) -> int:
+        return await asyncio.to_thread(self.sweep)
+
+    async def astats(self) -> dict:
+        return await asyncio.to_thread(self.stats)
+
+    async def aevicted(self, thread_id: str) -> bool:
+        return await asyncio.to_thread(self.evicted, thread_id)
+
+    def sweep(self) -> int:
+        """Delete every thread (in any process) idle for longer than ttl_s, leaving a row in
+        `evicted` for another ttl_s."""
+        with self._lock:
+            self.flush()
+            now = time.time()
+            expired = [row[0] for row in self._db.execute(
+                "SELECT thread_id FROM sessions WHERE updated < ?", (now - self.ttl_s,)
+            )]
+            for thread_id in expired:
+                self.delete_thread(thread_id)
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO evicted VALUES (?, ?)", [(t, now) for t in expired])
+                self._db.execute("DELETE FROM evicted WHERE evicted < ?", (now - self.ttl_s,))
+            self.ttl_evictions += len(expired)
+        return len(expired)
+
+    def evicted(self, thread_id: str) -> bool:
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM evicted WHERE thread_id = ? AND evicted >= ?",
+                                   (thread_id, time.time() - self.ttl_s)).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self.flush()
+            self._db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            threads, = self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()
+            checkpoints, = self._db.execute("SELECT COUNT(*) FROM checkpoints").fetchone()
+            payloads, = self._db.execute("SELECT COUNT(*) FROM payloads").fetchone()
+        file_bytes = sum(os.path.getsize(f) for f in (self.path, self.path + "-wal") if os.path.exists(f))
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "threads": threads,
+            "checkpoints": checkpoints,
+            "payloads": payloads,
+            "file_bytes": file_bytes,
+            "pending_rows": self._pending(),
+            "commits": self.commits,
+            "rows_written": self.rows_written,
+            "rows_per_commit": round(self.rows_written / self.commits, 2) if self.commits else 0.0,
+            "serialized_bytes_written": self.bytes_written,
+            "ttl_s": self.ttl_s,
+            "max_checkpoints_per_thread": self.max_checkpoints_per_thread,
+            "ttl_evictions": self.ttl_evictions,
+            "trimmed_checkpoints": self.trimmed_checkpoints,
+        }
+
+
+def new_checkpointer(backend: str = CHECKPOINT_BACKEND, path: str = CHECKPOINT_SQLITE_PATH):
+    """The graph checkpointer for CHECKPOINT_BACKEND: a BoundedMemorySaver ("memory") or a
+    SQLiteSaver on `path` ("sqlite"), both bounded by the CHECKPOINT_* settings."""
+    if backend == "sqlite":
+        return SQLiteSaver(
+            path,
+            ttl_s=CHECKPOINT_TTL_S,
+            max_checkpoints_per_thread=CHECKPOINT_MAX_PER_THREAD,
+            batch_rows=CHECKPOINT_BATCH_ROWS,
+            compress_min_bytes=CHECKPOINT_COMPRESS_MIN_BYTES,
+            payload_min_bytes=CHECKPOINT_PAYLOAD_MIN_BYTES,
+        )
+    if backend != "memory":
+        raise ValueError(f"Unknown checkpoint backend '{backend}'. Choose one of: {', '.join(CHECKPOINT_BACKENDS)}")
+    return BoundedMemorySaver(
+        ttl_s=CHECKPOINT_TTL_S,
+        max_checkpoints_per_thread=CHECKPOINT_MAX_PER_THREAD,
+        max_bytes=int(CHECKPOINT_MAX_MB * 1024 * 1024),
+        payload_min_bytes=CHECKPOINT_PAYLOAD_MIN_BYTES,
+    )
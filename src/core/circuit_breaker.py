@@ -0,0 +1,125 @@
+import time
+from collections import deque
+
+from core.config import (
+    CIRCUIT_WINDOW_S, CIRCUIT_MIN_CALLS, CIRCUIT_FAILURE_RATE, CIRCUIT_OPEN_S, CIRCUIT_HALF_OPEN_PROBES,
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when every model in a fallback chain is behind an open circuit."""
+
+
+def provider_of(model: str) -> str:
+    """LiteLLM provider prefix ("groq/llama-3.1-8b-instant" -> "groq"); bare names are OpenAI."""
+    return model.split("/", 1)[0] if "/" in model else "openai"
+
+
+class CircuitBreaker:
+    """Error/timeout-rate circuit breaker for one provider.
+
+    closed    -> calls flow; trips to open when at least `min_calls` outcomes in the
+                 last `window_s` seconds have a failure rate >= `failure_rate`
+    open      -> calls are refused until `open_s` has passed
+    half_open -> up to `probes` trial calls; a success closes, a failure re-opens
+    """
+
+    def __init__(self, provider: str, window_s: float = CIRCUIT_WINDOW_S, min_calls: int = CIRCUIT_MIN_CALLS,
+                 failure_rate: float = CIRCUIT_FAILURE_RATE, open_s: float = CIRCUIT_OPEN_S,
+                 probes: int = CIRCUIT_HALF_OPEN_PROBES):
+        self.provider = provider
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_s = open_s
+        self.probes = probes
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._probes_in_flight = 0
+        self.successes = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        """True if a call may go to this provider now (claims a probe slot when half-open)."""
+        if self.state == OPEN:
+            if time.time() - self.opened_at < self.open_s:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self._probes_in_flight = 0
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.probes:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def record_success(self) -> None:
+        self.successes += 1
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self._outcomes.clear()
+        self._add_outcome(True)
+
+    def record_failure(self, timeout: bool = False) -> None:
+        if timeout:
+            self.timeouts += 1
+        else:
+            self.errors += 1
+
+        if self.state == HALF_OPEN:
+            self._trip()
+            return
+        self._add_outcome(False)
+        failures = sum(1 for _, ok in self._outcomes if not ok)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._trip()
+
+    def release(self) -> None:
+        """Give back a half-open probe slot for a call that ended without an outcome (cancelled)."""
+        if self.state == HALF_OPEN and self._probes_in_flight > 0:
+            self._probes_in_flight -= 1
+
+    def _add_outcome(self, ok: bool) -> None:
+        now = time.time()
+        self._outcomes.append((now, ok))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_s:
+            self._outcomes.popleft()
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.trips += 1
+        self._outcomes.clear()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "successes": self.successes,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "trips": self.trips,
+        }
+
+
+BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    provider = provider_of(model)
+    if provider not in BREAKERS:
+        BREAKERS[provider] = CircuitBreaker(provider)
+    return BREAKERS[provider]
+
+
+def circuit_stats() -> dict:
+    return {provider: breaker.stats() for provider, breaker in BREAKERS.items()}
@@ -19,11 +19,163 @@ JUDGE_MODEL = MODEL_GEMINI_FLASH
 AGGREGATOR_MODEL = MODEL_GEMINI_FLASH
 MODEL_EMBED = "text-embedding-3-small"
 
+# Embedding backend for KNN routing: "litellm" (MODEL_EMBED over the network)
+# or "hashing" (local CPU n-gram hashing, fully offline)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "litellm")
+EMBED_HASH_DIM = int(os.getenv("EMBED_HASH_DIM", "1024"))
+
 # Thresholds
 JUDGE_THRESHOLD = 7.0
 MAX_ESCALATIONS = 1
 KNN_K_VALUE = 5  # top-5 KNN vote
 
+# Tiered judge: a local pre-screen rejects obvious failures (empty, timeout/error text,
+# truncated output, refusals, length more than JUDGE_LENGTH_RATIO x off the route's median)
+# without an LLM call, and approves clean answers outright. Borderline answers, and a
+# JUDGE_SAMPLE_RATE share of clean ones (quality monitoring), still go to the LLM judge.
+# A route needs JUDGE_LENGTH_MIN_SAMPLES approved answers before its length norm is used;
+# until then its answers count as borderline.
+JUDGE_PRESCREEN = os.getenv("JUDGE_PRESCREEN", "true").lower() == "true"
+JUDGE_SAMPLE_RATE = float(os.getenv("JUDGE_SAMPLE_RATE", "0.1"))
+JUDGE_LENGTH_RATIO = float(os.getenv("JUDGE_LENGTH_RATIO", "8.0"))
+JUDGE_LENGTH_MIN_SAMPLES = int(os.getenv("JUDGE_LENGTH_MIN_SAMPLES", "20"))
+
+# Critical multi-part queries are judged per subtask as each parallel_worker result lands;
+# only failed subtasks are re-run on the escalation model, before aggregation, and the
+# merged answer skips the judge. Off: the aggregate is judged and fully redone on failure.
+SUBTASK_JUDGING = os.getenv("SUBTASK_JUDGING", "true").lower() == "true"
+
+# Speculative escalation: on routes whose judge rejection rate is at least
+# SPECULATIVE_ESCALATION_MIN_REJECT_RATE (over SPECULATIVE_ESCALATION_MIN_SAMPLES verdicts),
+# the Opus retry starts together with the LLM judge and is cancelled if the judge approves.
+SPECULATIVE_ESCALATION = os.getenv("SPECULATIVE_ESCALATION", "false").lower() == "true"
+SPECULATIVE_ESCALATION_MIN_REJECT_RATE = float(os.getenv("SPECULATIVE_ESCALATION_MIN_REJECT_RATE", "0.3"))
+SPECULATIVE_ESCALATION_MIN_SAMPLES = int(os.getenv("SPECULATIVE_ESCALATION_MIN_SAMPLES", "10"))
+
+# Embedded prototypes are persisted here, keyed by a hash of MODEL_PROTOTYPES + embedding backend,
+# so restarts and extra uvicorn workers skip re-embedding.
+KNN_INDEX_CACHE_DIR = os.getenv("KNN_INDEX_CACHE_DIR", os.path.join(".cache", "knn_index"))
+
+# Approximate nearest neighbours (IVF) for large prototype sets; below the
+# threshold the router does an exact scan. NLIST=0 picks 4*sqrt(n) lists.
+# Raise NPROBE for recall, lower it for speed.
+KNN_ANN_MIN_VECTORS = int(os.getenv("KNN_ANN_MIN_VECTORS", "5000"))
+KNN_ANN_NLIST = int(os.getenv("KNN_ANN_NLIST", "0"))
+KNN_ANN_NPROBE = int(os.getenv("KNN_ANN_NPROBE", "8"))
+
+# Online prototype learning: judge-approved / escalated queries become labelled
+# KNN examples, capped per model ("reservoir" or "age" eviction) and snapshotted
+# to KNN_INDEX_CACHE_DIR every N additions or T seconds.
+KNN_ONLINE_LEARNING = os.getenv("KNN_ONLINE_LEARNING", "true").lower() == "true"
+KNN_ONLINE_MAX_PER_MODEL = int(os.getenv("KNN_ONLINE_MAX_PER_MODEL", "2000"))
+KNN_ONLINE_EVICTION = os.getenv("KNN_ONLINE_EVICTION", "reservoir")
+KNN_ONLINE_SNAPSHOT_EVERY = int(os.getenv("KNN_ONLINE_SNAPSHOT_EVERY", "25"))
+KNN_ONLINE_SNAPSHOT_INTERVAL_S = float(os.getenv("KNN_ONLINE_SNAPSHOT_INTERVAL_S", "300"))
+
+# Query-embedding cache in front of semantic_route (LRU + TTL), keyed by text + embedding backend.
+# Set EMBED_CACHE_PATH to a SQLite file to keep entries across restarts.
+EMBED_CACHE_MAX_SIZE = int(os.getenv("EMBED_CACHE_MAX_SIZE", "10000"))
+EMBED_CACHE_TTL_S = float(os.getenv("EMBED_CACHE_TTL_S", "86400"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")
+
+# Semantic response cache: a non-critical, single-task query whose embedding is within
+# RESPONSE_CACHE_THRESHOLD cosine of an earlier query routed to the same model (and has the
+# same numbers and named entities) reuses that answer and skips the worker. Entries expire
+# after RESPONSE_CACHE_TTL_S. Off by default: the cache is shared by every session.
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_TTL_S = float(os.getenv("RESPONSE_CACHE_TTL_S", "3600"))
+RESPONSE_CACHE_MAX_SIZE = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", "5000"))
+
+# Graph variant built by create_graph(): "sequential" (classifier -> knn_router),
+# "fast_path" (KNN-score first; confident single-task queries skip the classifier),
+# "concurrent" (classifier and query embedding + KNN scoring run in parallel) or
+# "speculative" (concurrent, plus the worker starts on the KNN route before the classifier
+# returns; cancelled if the query turns out self-answerable, ambiguous or multi-part)
+GRAPH_MODE = os.getenv("GRAPH_MODE", "sequential")
+
+# Fast path gates: top-1 similarity, its lead over the runner-up model, and query shape.
+# Routes to the critical-tier models always go through the classifier (is_critical -> judge).
+FAST_PATH_MIN_SIMILARITY = float(os.getenv("FAST_PATH_MIN_SIMILARITY", "0.75"))
+FAST_PATH_MIN_MARGIN = float(os.getenv("FAST_PATH_MIN_MARGIN", "0.05"))
+FAST_PATH_MAX_WORDS = int(os.getenv("FAST_PATH_MAX_WORDS", "40"))
+FAST_PATH_EXCLUDED_MODELS = [MODEL_GPT4O, MODEL_OPUS]
+
+# Hedged worker requests: if the primary model has produced no token after its
+# HEDGE_PERCENTILE time-to-first-token (HEDGE_DEFAULT_DELAY_S until HEDGE_MIN_SAMPLES
+# calls have been seen), a backup request races it and the slower one is cancelled.
+# The backup is the same model on another provider (HEDGE_EQUIVALENTS) or else the
+# next-best KNN model whose price is at most HEDGE_MAX_PRICE_RATIO x the primary's.
+WORKER_HEDGING = os.getenv("WORKER_HEDGING", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY_S = float(os.getenv("HEDGE_DEFAULT_DELAY_S", "2.0"))
+HEDGE_MAX_PRICE_RATIO = float(os.getenv("HEDGE_MAX_PRICE_RATIO", "2.0"))
+HEDGE_EQUIVALENTS = {
+    MODEL_LLAMA_GROQ: MODEL_CLASSIFIER,           # Llama 3.1 8B: Groq <-> Cerebras
+    MODEL_GPT_OSS: "groq/openai/gpt-oss-120b",    # gpt-oss-120b: Cerebras -> Groq
+}
+WORKER_TIMEOUT_S = float(os.getenv("WORKER_TIMEOUT_S", "30"))
+
+# Subtask planner (between classifier and router): subtasks are embedded in one batch,
+# near-duplicates (cosine >= PLANNER_MERGE_THRESHOLD) are merged into the first phrasing,
+# and beyond PLANNER_MAX_SUBTASKS the most redundant ones are dropped. At most
+# PARALLEL_MAX_CONCURRENCY subtask calls of one query are in flight at a time.
+PLANNER_MERGE_THRESHOLD = float(os.getenv("PLANNER_MERGE_THRESHOLD", "0.90"))
+PLANNER_MAX_SUBTASKS = int(os.getenv("PLANNER_MAX_SUBTASKS", "4"))
+PARALLEL_MAX_CONCURRENCY = int(os.getenv("PARALLEL_MAX_CONCURRENCY", "4"))
+
+# Parallel fan-in: "gather" waits for every subtask; "streaming" takes results as they
+# complete (one `subtask` SSE event each) and, once one subtask has succeeded, drops any
+# still running PARALLEL_DEADLINE_S after fan-out (0 = never drop). The aggregator LLM call
+# is skipped when only one subtask answered, or when the answers together are at most
+# AGGREGATION_SKIP_MAX_CHARS long (they are then joined under their subtask headings).
+PARALLEL_FAN_IN = os.getenv("PARALLEL_FAN_IN", "gather")
+PARALLEL_DEADLINE_S = float(os.getenv("PARALLEL_DEADLINE_S", "15"))
+AGGREGATION_SKIP_MAX_CHARS = int(os.getenv("AGGREGATION_SKIP_MAX_CHARS", "600"))
+
+# Per-provider circuit breaker shared by every LLM call (core/llm.py): a provider
+# whose error/timeout rate over the last CIRCUIT_WINDOW_S seconds reaches
+# CIRCUIT_FAILURE_RATE (with at least CIRCUIT_MIN_CALLS calls) is skipped for
+# CIRCUIT_OPEN_S seconds, then probed with CIRCUIT_HALF_OPEN_PROBES trial calls.
+CIRCUIT_WINDOW_S = float(os.getenv("CIRCUIT_WINDOW_S", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_OPEN_S = float(os.getenv("CIRCUIT_OPEN_S", "30"))
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", "1"))
+
+# Models tried in order when a call fails or its provider's circuit is open.
+# Each chain stays on other providers where possible.
+FALLBACK_CHAINS = {
+    MODEL_CLASSIFIER: [MODEL_LLAMA_GROQ],
+    MODEL_LLAMA_GROQ: [MODEL_CLASSIFIER, MODEL_GEMINI_FLASH],
+    MODEL_KIMI_K2: [MODEL_GPT_OSS, MODEL_GEMINI_FLASH],
+    MODEL_GPT_OSS: ["groq/openai/gpt-oss-120b", MODEL_GEMINI_FLASH],
+    MODEL_QWEN_235B: [MODEL_KIMI_K2, MODEL_GEMINI_FLASH],
+    MODEL_GPT4O: [MODEL_GEMINI_FLASH, MODEL_QWEN_235B],
+    MODEL_GEMINI_FLASH: [MODEL_GPT_OSS, MODEL_LLAMA_GROQ],
+    MODEL_OPUS: [MODEL_GPT4O],
+}
+
+# Rolling window of per-model latency samples used for hedge delays and timeouts
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "500"))
+
+# Adaptive timeouts: every LLM call attempt gets TIMEOUT_FACTOR x its model's rolling
+# TIMEOUT_PERCENTILE total latency, clamped to the calling node's [min_s, max_s] budget.
+# Models with fewer than TIMEOUT_MIN_SAMPLES samples (or ADAPTIVE_TIMEOUTS=false) use default_s.
+ADAPTIVE_TIMEOUTS = os.getenv("ADAPTIVE_TIMEOUTS", "true").lower() == "true"
+TIMEOUT_PERCENTILE = float(os.getenv("TIMEOUT_PERCENTILE", "99"))
+TIMEOUT_FACTOR = float(os.getenv("TIMEOUT_FACTOR", "2.0"))
+TIMEOUT_MIN_SAMPLES = int(os.getenv("TIMEOUT_MIN_SAMPLES", "20"))
+NODE_TIMEOUTS = {
+    "classifier": {"default_s": 10.0, "min_s": 2.0, "max_s": 20.0},
+    "worker": {"default_s": WORKER_TIMEOUT_S, "min_s": 3.0, "max_s": 120.0},
+    "parallel_worker": {"default_s": WORKER_TIMEOUT_S, "min_s": 3.0, "max_s": 120.0},
+    "aggregator": {"default_s": 30.0, "min_s": 5.0, "max_s": 60.0},
+    "judge": {"default_s": 20.0, "min_s": 3.0, "max_s": 45.0},
+    "escalation_worker": {"default_s": 60.0, "min_s": 10.0, "max_s": 180.0},
+}
+
 # GPT-5 baseline cost per query (for savings calculation).
 # Override via env when you have your own measured baseline for your workload.
 GPT5_BASELINE_COST = float(os.getenv("GPT5_BASELINE_COST", "0.012"))
@@ -38,4 +190,64 @@ MODEL_COSTS = {
     MODEL_GPT4O: {"input": 2.50, "output": 10.00},
     MODEL_GEMINI_FLASH: {"input": 0.075, "output": 0.30},
     MODEL_OPUS: {"input": 15.00, "output": 75.00},
+    "groq/openai/gpt-oss-120b": {"input": 0.15, "output": 0.75},
+}
+
+# Client-side rate limits for the LLM scheduler (core/scheduler.py), per LiteLLM provider
+# prefix and per model: max in-flight requests, requests/min and tokens/min (0 = no limit).
+# Set these to your account tier; calls queue FIFO instead of tripping 429s.
+PROVIDER_LIMITS = {
+    "groq": {"concurrency": 16, "rpm": 300, "tpm": 250_000},
+    "cerebras": {"concurrency": 16, "rpm": 300, "tpm": 300_000},
+    "openai": {"concurrency": 32, "rpm": 500, "tpm": 300_000},
+    "gemini": {"concurrency": 16, "rpm": 1000, "tpm": 1_000_000},
+    "openrouter": {"concurrency": 16, "rpm": 200, "tpm": 0},
+}
+MODEL_LIMITS = {
+    MODEL_GPT4O: {"concurrency": 8, "rpm": 0, "tpm": 0},
+    MODEL_OPUS: {"concurrency": 4, "rpm": 50, "tpm": 0},
+}
+# Output tokens reserved against TPM before a call's real usage is known
+SCHEDULER_EST_OUTPUT_TOKENS = int(os.getenv("SCHEDULER_EST_OUTPUT_TOKENS", "512"))
+
+# Long-lived pooled HTTP clients, one per provider (core/http_pool.py), shared by every
+# LLM and embedding call instead of litellm's per-call client handling. Keep
+# max_connections at or above the provider's scheduler concurrency. At API startup each
+# pool opens HTTP_POOL_WARM_CONNECTIONS keep-alive connections so the first request skips
+# the TCP/TLS handshake. Providers listed with api_key_env go through the OpenAI SDK.
+HTTP_POOL_ENABLED = os.getenv("HTTP_POOL_ENABLED", "true").lower() == "true"
+HTTP_POOL_WARM_CONNECTIONS = int(os.getenv("HTTP_POOL_WARM_CONNECTIONS", "2"))
+HTTP_POOL_KEEPALIVE_EXPIRY_S = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY_S", "120"))
+HTTP_POOL_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_POOL_CONNECT_TIMEOUT_S", "5"))
+HTTP_POOLS = {
+    "groq": {"base_url": "https://api.groq.com/openai/v1", "max_connections": 32, "max_keepalive": 16},
+    "cerebras": {"base_url": "https://api.cerebras.ai/v1", "max_connections": 32, "max_keepalive": 16,
+                 "api_key_env": "CEREBRAS_API_KEY"},
+    "openai": {"base_url": "https://api.openai.com/v1", "max_connections": 64, "max_keepalive": 32,
+               "api_key_env": "OPENAI_API_KEY"},
+    "gemini": {"base_url": "https://generativelanguage.googleapis.com", "max_connections": 32, "max_keepalive": 16},
+    "openrouter": {"base_url": "https://openrouter.ai/api/v1", "max_connections": 32, "max_keepalive": 16},
 }
+
+# Graph checkpoints (core/checkpointer.py). A session's checkpoints are dropped once it has
+# been idle for CHECKPOINT_TTL_S (swept every CHECKPOINT_SWEEP_INTERVAL_S); each thread keeps
+# only its newest CHECKPOINT_MAX_PER_THREAD checkpoints; past CHECKPOINT_MAX_MB in total the
+# least recently used sessions are evicted.
+CHECKPOINT_TTL_S = float(os.getenv("CHECKPOINT_TTL_S", "3600"))
+CHECKPOINT_MAX_PER_THREAD = int(os.getenv("CHECKPOINT_MAX_PER_THREAD", "16"))
+CHECKPOINT_MAX_MB = float(os.getenv("CHECKPOINT_MAX_MB", "256"))
+CHECKPOINT_SWEEP_INTERVAL_S = float(os.getenv("CHECKPOINT_SWEEP_INTERVAL_S", "60"))
+
+# CHECKPOINT_BACKEND=sqlite keeps checkpoints in a local SQLite file (WAL mode) shared by all
+# uvicorn workers on the host, so any worker can resume any HITL session. Rows are buffered
+# and committed in batches (at most CHECKPOINT_BATCH_ROWS, and at every interrupt, read and
+# end of request); serialized values of CHECKPOINT_COMPRESS_MIN_BYTES or more are zlib-compressed.
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "memory")
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", os.path.join(".cache", "checkpoints.sqlite"))
+CHECKPOINT_BATCH_ROWS = int(os.getenv("CHECKPOINT_BATCH_ROWS", "256"))
+CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHECKPOINT_COMPRESS_MIN_BYTES", "1024"))
+
+# Checkpointers store strings and list items (trace entries, worker responses) of at least
+# CHECKPOINT_PAYLOAD_MIN_BYTES serialized bytes once per thread and reference them by hash,
+# instead of re-serializing them with every checkpoint. 0 disables.
+CHECKPOINT_PAYLOAD_MIN_BYTES = int(os.getenv("CHECKPOINT_PAYLOAD_MIN_BYTES", "128"))
@@ -0,0 +1,123 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and case so trivially different retries share an entry."""
+    return " ".join(text.split()).lower()
+
+
+def cache_key(text: str, model: str) -> str:
+    return hashlib.sha1(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Bounded LRU + TTL cache of query embeddings.
+
+    The in-process tier is an OrderedDict in LRU order. If `path` is set, entries
+    are also written to a SQLite file and looked up there on a memory miss, so
+    the cache survives restarts and is shared by workers on the same host. Those
+    writes are buffered and committed together by flush(), which embed_texts runs
+    in a worker thread; until then the memory tier serves them.
+    """
+
+    def __init__(self, max_size: int, ttl_s: float, path: str | None = None):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.path = path
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        self._pending: dict[str, tuple[float, bytes]] = {}
+        self._lock = threading.Lock()  # the connection is shared with flush() in worker threads
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, created REAL, vector BLOB)"
+            )
+            self._db.commit()
+
+    def get(self, key: str) -> np.ndarray | None:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            created, vector = entry
+            if now - created <= self.ttl_s:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            del self._entries[key]
+            self.expirations += 1
+
+        if self._db is not None:
+            with self._lock:
+                row = self._db.execute("SELECT created, vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[0] <= self.ttl_s:
+                vector = np.frombuffer(row[1], dtype=np.float32)
+                self._remember(key, row[0], vector)
+                self.hits += 1
+                self.persistent_hits += 1
+                return vector
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        created = time.time()
+        vector = np.asarray(vector, dtype=np.float32)
+        self._remember(key, created, vector)
+        if self._db is not None:
+            with self._lock:
+                self._pending[key] = (created, vector.tobytes())
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> None:
+        """Commit buffered entries to the SQLite tier in one transaction."""
+        with self._lock:
+            if self._db is None or not self._pending:
+                return
+            rows = [(key, created, vector) for key, (created, vector) in self._pending.items()]
+            self._pending = {}
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, created, vector) VALUES (?, ?, ?)", rows
+                )
+
+    def _remember(self, key: str, created: float, vector: np.ndarray) -> None:
+        self._entries[key] = (created, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "persistent": self._db is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent_hits": self.persistent_hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,85 @@
+import re
+import zlib
+
+import numpy as np
+import litellm
+
+from core.config import MODEL_EMBED, EMBED_BACKEND, EMBED_HASH_DIM
+from core.http_pool import client_kwargs
+
+
+class Embedder:
+    """Embedding backend used by the KNN router. `name` keys the index and embedding caches."""
+
+    name: str = ""
+    cost_per_text: float = 0.0
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        """Return a (len(texts), dim) float32 array."""
+        raise NotImplementedError
+
+
+class LiteLLMEmbedder(Embedder):
+    """Remote embeddings through litellm.aembedding (default: OpenAI text-embedding-3-small)."""
+
+    def __init__(self, model: str = MODEL_EMBED):
+        self.name = model
+        self.cost_per_text = 0.00001  # ~$0.00001 per short query
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        response = await litellm.aembedding(model=self.name, input=texts, **client_kwargs(self.name))
+        return np.asarray([item["embedding"] for item in response.data], dtype=np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """Local CPU embeddings: word + character n-gram features hashed into a signed fixed-size vector.
+
+    No network, no model download, deterministic across processes — sub-millisecond per query.
+    """
+
+    def __init__(self, dim: int = EMBED_HASH_DIM, char_ngrams: tuple[int, int] = (3, 5)):
+        self.dim = dim
+        self.char_ngrams = char_ngrams
+        self.name = f"hashing-ngram-{dim}"
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        return self.embed_sync(texts)
+
+    def embed_sync(self, texts: list[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: dict[int, float] = {}
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                slot = h % self.dim
+                sign = 1.0 if (h >> 31) & 1 else -1.0
+                counts[slot] = counts.get(slot, 0.0) + sign
+            for slot, value in counts.items():
+                # Sublinear term frequency so repeated n-grams don't dominate
+                matrix[row, slot] = np.sign(value) * np.log1p(abs(value))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def _features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", text.lower())
+        features = [f"w:{w}" for w in words]
+        features += [f"b:{a}_{b}" for a, b in zip(words, words[1:])]
+        lo, hi = self.char_ngrams
+        for w in words:
+            padded = f" {w} "
+            for n in range(lo, hi + 1):
+                features += [f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1)]
+        return features
+
+
+EMBED_BACKENDS = {
+    "litellm": LiteLLMEmbedder,
+    "hashing": HashingEmbedder,
+}
+
+
+def get_embedder(backend: str = EMBED_BACKEND) -> Embedder:
+    """Instantiate the embedding backend selected in config (EMBED_BACKEND)."""
+    if backend not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of: {', '.join(EMBED_BACKENDS)}")
+    return EMBED_BACKENDS[backend]()
@@ -1,53 +1,208 @@
+import time
+import asyncio
 from langgraph.graph import StateGraph, END
-from langgraph.checkpoint.memory import MemorySaver
 
 from core.state import NexusState
 from agents.classifier import classifier_node
-from agents.knn_router import knn_router_node
+import agents.knn_router as knn_mod
+from agents.knn_router import knn_router_node, fast_router_node, prefetch_route, cached_response, store_response
 from agents.worker import worker_node, parallel_worker_node
 from agents.hitl import hitl_node
+from agents.planner import planner_node
 from agents.aggregator import aggregator_node
 from agents.judge import judge_node, escalation_worker_node
-from core.config import MAX_ESCALATIONS
-
-def set_final(state: NexusState):
-    """Set the final response before graph exit and ensure metrics are preserved."""
-    agg = state.get("aggregated_response")
-    res = ""
-    if agg:
-        res = agg
+from core.config import MAX_ESCALATIONS, GRAPH_MODE
+from core.metrics import SPECULATION_STATS, estimate_prompt_cost
+from core.checkpointer import new_checkpointer
+
+GRAPH_MODES = ("sequential", "fast_path", "concurrent", "speculative")
+
+async def set_final(state: NexusState):
+    """Set the final response before graph exit.
+
+    Only final_response is written: costs, latency and worker_responses accumulate through
+    their reducers, so returning them again would count (or append) them twice.
+    """
+    workers = state.get("worker_responses", [])
+    if state.get("escalation_count", 0) and state.get("final_response"):
+        # escalation_worker already replaced the rejected answer
+        res = state["final_response"]
+    elif state.get("aggregated_response"):
+        res = state["aggregated_response"]
+    elif workers:
+        # If we reached here without aggregation, it's a single worker response
+        res = workers[-1].get("response", "")
+        await _cache_worker_answer(state, workers[-1])
     else:
-        workers = state.get("worker_responses", [])
-        if workers:
-            # If we reached here without aggregation, it's a single worker response or escalation
-            res = workers[-1].get("response", "")
-        else:
-            final = state.get("final_response")
-            if final:
-                res = final
-            else:
-                res = "No response generated."
-            
-    return {
-        "final_response": res,
-        "total_cost": state.get("total_cost", 0.0),
-        "total_latency": state.get("total_latency", 0.0),
-        "selected_models": state.get("selected_models", []),
-        "worker_responses": state.get("worker_responses", []),
-        "escalation_count": state.get("escalation_count", 0),
-        "escalation_model": state.get("escalation_model"),
+        res = state.get("final_response") or "No response generated."
+    return {"final_response": res}
+
+async def _cache_worker_answer(state: NexusState, worker: dict) -> None:
+    """Remember a fresh single-worker answer for near-duplicate queries (never critical ones)."""
+    if (state.get("cache_hit") or state.get("is_critical") or state.get("subtasks")
+            or state.get("escalation_count", 0) or worker.get("error") or worker.get("cached")):
+        return
+    query = state.get("enriched_query") or state.get("query", "")
+    try:
+        await store_response(query, worker["model"], worker.get("response", ""),
+                             worker.get("cost_usd", 0.0), worker.get("latency_ms", 0.0) / 1000)
+    except Exception as e:
+        print(f"Response cache store failed: {e}")
+
+async def concurrent_classifier_node(state: NexusState):
+    """Run the classifier and the query embedding + KNN scoring at the same time.
+    knn_router reuses the prefetched route unless subtasks or HITL change the text.
+    """
+    query = state.get("query", "")
+
+    if knn_mod.KNN_INDEX is None:
+        return await classifier_node(state)
+
+    classified, (prefetch, embed_ms, embed_cost) = await asyncio.gather(
+        classifier_node(state), prefetch_route(query)
+    )
+
+    # Both ran concurrently: the critical path is the slower of the two
+    classified["total_latency"] = max(classified["total_latency"], embed_ms / 1000)
+    classified["total_cost"] += embed_cost
+    classified["knn_prefetch"] = prefetch
+    classified["trace"] = classified["trace"] + [{
+        "node": "knn_router",
+        "action": "prefetched",
+        "detail": f"model={prefetch['model']} embed={embed_ms:.0f}ms (concurrent with classifier)",
+        "timestamp": time.time(),
+        "latency_ms": round(embed_ms, 2),
+    }]
+    return classified
+
+async def speculative_classifier_node(state: NexusState):
+    """Concurrent classify + route, plus the worker launched on the KNN pick as soon as routing lands.
+
+    If the classifier then flags the query as self-answerable, ambiguous or multi-part the
+    speculative worker is cancelled; otherwise its answer is used and knn_router/worker are skipped.
+    """
+    query = state.get("query", "")
+
+    if knn_mod.KNN_INDEX is None:
+        return await classifier_node(state)
+
+    async def route_then_work():
+        prefetch, embed_ms, embed_cost = await prefetch_route(query)
+        if await cached_response(query, prefetch["model"], record=False):
+            # A cached answer beats speculating; knn_router serves it unless the query is critical
+            return prefetch, embed_ms, embed_cost, None
+        speculative_state = {**state, "selected_models": [prefetch["model"]]}
+        worker_task = asyncio.create_task(worker_node(speculative_state))
+        return prefetch, embed_ms, embed_cost, worker_task
+
+    classified, (prefetch, embed_ms, embed_cost, worker_task) = await asyncio.gather(
+        classifier_node(state), route_then_work()
+    )
+    model = prefetch["model"]
+    classifier_s = classified["total_latency"]
+
+    classified["knn_prefetch"] = prefetch
+    classified["total_cost"] += embed_cost
+    prefetch_trace = {
+        "node": "knn_router",
+        "action": "prefetched",
+        "detail": f"model={model} embed={embed_ms:.0f}ms (concurrent with classifier)",
+        "timestamp": time.time(),
+        "latency_ms": round(embed_ms, 2),
     }
 
+    if worker_task is None:
+        classified["speculative_hit"] = False
+        classified["total_latency"] = max(classifier_s, embed_ms / 1000)
+        classified["trace"] = classified["trace"] + [prefetch_trace]
+        return classified
+
+    SPECULATION_STATS["launched"] += 1
+
+    if classified["can_self_answer"] or classified["is_ambiguous"] or classified["subtasks"]:
+        if worker_task.done() and not worker_task.cancelled() and worker_task.exception() is None:
+            wasted = worker_task.result()["total_cost"]
+        else:
+            worker_task.cancel()
+            wasted = estimate_prompt_cost(model, [{"role": "user", "content": query}])
+        SPECULATION_STATS["cancelled"] += 1
+        SPECULATION_STATS["wasted_cost_usd"] += wasted
+
+        if classified["can_self_answer"]:
+            reason = "self-answer"
+        elif classified["is_ambiguous"]:
+            reason = "ambiguous"
+        else:
+            reason = "subtasks"
+        classified["speculative_hit"] = False
+        classified["total_cost"] += wasted
+        classified["total_latency"] = max(classifier_s, embed_ms / 1000)
+        classified["trace"] = classified["trace"] + [prefetch_trace, {
+            "node": "speculation",
+            "action": "cancelled",
+            "detail": f"model={model} reason={reason} wasted=${wasted:.6f}",
+            "timestamp": time.time(),
+        }]
+        return classified
+
+    worked = await worker_task
+    worker_s = worked["total_latency"]
+    critical_path_s = max(classifier_s, embed_ms / 1000 + worker_s)
+    saved_s = (classifier_s + embed_ms / 1000 + worker_s) - critical_path_s
+    SPECULATION_STATS["hits"] += 1
+    SPECULATION_STATS["latency_saved_s"] += saved_s
+
+    classified.update({
+        "speculative_hit": True,
+        "cache_hit": False,
+        "selected_models": [model],
+        "knn_scores": prefetch["knn_scores"],
+        "subtask_knn_scores": [],
+        "worker_responses": worked["worker_responses"],
+        "total_cost": classified["total_cost"] + worked["total_cost"],
+        "total_latency": critical_path_s,
+    })
+    classified["trace"] = classified["trace"] + [prefetch_trace] + worked["trace"] + [{
+        "node": "speculation",
+        "action": "hit",
+        "detail": f"model={model} saved={saved_s * 1000:.0f}ms",
+        "timestamp": time.time(),
+        "latency_ms": round(saved_s * 1000, 2),
+    }]
+    return classified
+
 def route_from_classifier(state: NexusState):
     """Determine path after classification."""
     if state.get("can_self_answer", False):
         return END
     if state.get("is_ambiguous", False):
         return "hitl"
+    return route_to_router(state)
+
+def route_to_router(state: NexusState):
+    """Multi-part queries are planned (deduped, capped) before routing."""
+    if len(state.get("subtasks", []) or []) > 1:
+        return "planner"
     return "knn_router"
 
+def route_from_fast_router(state: NexusState):
+    """Confident single-task routes skip the classifier entirely."""
+    if state.get("cache_hit", False):
+        return "set_final"
+    if state.get("fast_path", False):
+        return "worker"
+    return "classifier"
+
+def route_from_speculative_classifier(state: NexusState):
+    """Like route_from_classifier, but a kept speculative answer continues as if from the worker."""
+    if state.get("speculative_hit", False):
+        return route_from_worker(state)
+    return route_from_classifier(state)
+
 def route_from_knn(state: NexusState):
     """Determine path after routing."""
+    if state.get("cache_hit", False):
+        return "set_final"
     subtasks = state.get("subtasks", [])
     if len(subtasks) > 0:
         return "parallel_worker"
@@ -60,8 +215,9 @@ def route_from_worker(state: NexusState):
     return "set_final"
 
 def route_from_aggregator(state: NexusState):
-    """Determine path after aggregating multiple workers."""
-    if state.get("is_critical", False):
+    """Determine path after aggregating multiple workers.
+    Subtasks already judged (and escalated) in parallel_worker skip the aggregate judge."""
+    if state.get("is_critical", False) and not state.get("subtasks_judged", False):
         return "judge"
     return "set_final"
 
@@ -74,13 +230,32 @@ def route_from_judge(state: NexusState):
         return "escalation_worker"
     return "set_final"
 
-def create_graph():
-    """LangGraph pipeline definition."""
+def create_graph(mode: str = GRAPH_MODE, checkpointer=None):
+    """LangGraph pipeline definition.
+
+    mode="sequential": classifier -> knn_router (via planner when there are several subtasks).
+    mode="fast_path": fast_router (embed + KNN) first; confident routes go straight
+    to the worker, the rest continue to the classifier with the route prefetched.
+    mode="concurrent": classifier and embed + KNN run together in one node.
+    mode="speculative": as concurrent, plus the worker starts on the KNN pick before
+    the classifier returns and is cancelled if the classifier disagrees.
+
+    `checkpointer` defaults to a BoundedMemorySaver (see core/checkpointer.py).
+    """
+    if mode not in GRAPH_MODES:
+        raise ValueError(f"Unknown graph mode '{mode}'. Choose one of: {', '.join(GRAPH_MODES)}")
+
     workflow = StateGraph(NexusState)
     
     # Add Nodes
-    workflow.add_node("classifier", classifier_node)
+    if mode == "concurrent":
+        workflow.add_node("classifier", concurrent_classifier_node)
+    elif mode == "speculative":
+        workflow.add_node("classifier", speculative_classifier_node)
+    else:
+        workflow.add_node("classifier", classifier_node)
     workflow.add_node("hitl", hitl_node)
+    workflow.add_node("planner", planner_node)
     workflow.add_node("knn_router", knn_router_node)
     workflow.add_node("worker", worker_node)
     workflow.add_node("parallel_worker", parallel_worker_node)
@@ -90,21 +265,43 @@ def create_graph():
     workflow.add_node("set_final", set_final)
     
     # Define Edges / Routing
-    workflow.set_entry_point("classifier")
+    if mode == "fast_path":
+        workflow.add_node("fast_router", fast_router_node)
+        workflow.set_entry_point("fast_router")
+        workflow.add_conditional_edges(
+            "fast_router",
+            route_from_fast_router,
+            {"worker": "worker", "classifier": "classifier", "set_final": "set_final"}
+        )
+    else:
+        workflow.set_entry_point("classifier")
+    
+    if mode == "speculative":
+        workflow.add_conditional_edges(
+            "classifier",
+            route_from_speculative_classifier,
+            {END: END, "hitl": "hitl", "planner": "planner", "knn_router": "knn_router",
+             "judge": "judge", "set_final": "set_final"}
+        )
+    else:
+        workflow.add_conditional_edges(
+            "classifier",
+            route_from_classifier,
+            {END: END, "hitl": "hitl", "planner": "planner", "knn_router": "knn_router"}
+        )
     
+    # After HITL clarifies -> we plan (if multi-part) and route it
     workflow.add_conditional_edges(
-        "classifier",
-        route_from_classifier,
-        {END: END, "hitl": "hitl", "knn_router": "knn_router"}
+        "hitl",
+        route_to_router,
+        {"planner": "planner", "knn_router": "knn_router"}
     )
-    
-    # After HITL clarifies -> we route it
-    workflow.add_edge("hitl", "knn_router")
+    workflow.add_edge("planner", "knn_router")
     
     workflow.add_conditional_edges(
         "knn_router",
         route_from_knn,
-        {"parallel_worker": "parallel_worker", "worker": "worker"}
+        {"parallel_worker": "parallel_worker", "worker": "worker", "set_final": "set_final"}
     )
     
     workflow.add_conditional_edges(
@@ -132,7 +329,7 @@ def create_graph():
     workflow.add_edge("set_final", END)
     
     # Setup persistence memory for HITL interrupts and state continuity
-    memory = MemorySaver()
+    memory = checkpointer if checkpointer is not None else new_checkpointer()
     
     return workflow.compile(checkpointer=memory)
 
@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+
+import httpx
+from openai import AsyncOpenAI
+from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+from core.config import (
+    HTTP_POOL_ENABLED, HTTP_POOLS, HTTP_POOL_WARM_CONNECTIONS, HTTP_POOL_KEEPALIVE_EXPIRY_S,
+    HTTP_POOL_CONNECT_TIMEOUT_S, LATENCY_WINDOW,
+)
+from core.circuit_breaker import provider_of
+from core.latency import LatencyTracker
+
+# TCP connect / TLS handshake times (ms) of new pool connections, keyed by provider
+CONNECT_LATENCY = LatencyTracker(LATENCY_WINDOW)
+
+# litellm's default request timeout; only the connect phase is tightened
+_TIMEOUT = httpx.Timeout(600.0, connect=HTTP_POOL_CONNECT_TIMEOUT_S)
+
+
+class _MeteredTransport(httpx.AsyncHTTPTransport):
+    """AsyncHTTPTransport that counts requests and times the handshakes of new connections
+    through httpcore's trace hook (connection reuse fires no connect events)."""
+
+    def __init__(self, provider: str, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+        self.requests = 0
+        self.connects = 0
+        self.errors = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        started: dict[str, float] = {}
+        inner_trace = request.extensions.get("trace")
+
+        async def trace(event: str, info: dict) -> None:
+            name, _, phase = event.rpartition(".")
+            if name in ("connection.connect_tcp", "connection.start_tls"):
+                kind = "tcp" if name.endswith("tcp") else "tls"
+                if phase == "started":
+                    started[kind] = time.perf_counter()
+                elif phase == "complete" and kind in started:
+                    self.connects += kind == "tcp"
+                    CONNECT_LATENCY.record(self.provider, kind, (time.perf_counter() - started[kind]) * 1000)
+            if inner_trace is not None:
+                await inner_trace(event, info)
+
+        request.extensions["trace"] = trace
+        try:
+            return await super().handle_async_request(request)
+        except Exception:
+            self.errors += 1
+            raise
+
+    def pool_stats(self) -> dict:
+        connections = self._pool.connections
+        idle = sum(1 for c in connections if c.is_idle())
+        queued = sum(1 for r in self._pool._requests if r.is_queued())
+        return {"open": len(connections), "active": len(connections) - idle, "idle": idle, "queued": queued}
+
+
+class _ProviderPool:
+    def __init__(self, provider: str, config: dict):
+        self.provider = provider
+        self.config = config
+        self.max_connections = config["max_connections"]
+        self.transport = _MeteredTransport(
+            provider,
+            limits=httpx.Limits(
+                max_connections=config["max_connections"],
+                max_keepalive_connections=config["max_keepalive"],
+                keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY_S,
+            ),
+        )
+        self.http = httpx.AsyncClient(transport=self.transport, timeout=_TIMEOUT)
+        self._litellm_client = None
+
+    def litellm_client(self):
+        """The client object litellm expects for this provider: an AsyncOpenAI for the
+        OpenAI-SDK providers, an AsyncHTTPHandler for the rest. Both wrap self.http."""
+        if self._litellm_client is None:
+            key_env = self.config.get("api_key_env")
+            if key_env:
+                api_key = os.getenv(key_env)
+                if not api_key:
+                    return None  # let litellm raise its usual missing-key error
+                self._litellm_client = AsyncOpenAI(api_key=api_key, base_url=self.config["base_url"],
+                                                   http_client=self.http)
+            else:
+                handler = AsyncHTTPHandler(timeout=_TIMEOUT)
+                handler.client = self.http
+                self._litellm_client = handler
+        return self._litellm_client
+
+    async def warm(self, connections: int) -> int:
+        """Open up to `connections` keep-alive connections with concurrent HEAD requests.
+        Any HTTP status counts; only the handshake matters. Returns the number that succeeded."""
+        async def ping() -> bool:
+            try:
+                await self.http.head(self.config["base_url"])
+                return True
+            except httpx.HTTPError:
+                return False
+
+        results = await asyncio.gather(*(ping() for _ in range(min(connections, self.max_connections))))
+        return sum(results)
+
+    def stats(self) -> dict:
+        pool = self.transport.pool_stats()
+        return {
+            **pool,
+            "max_connections": self.max_connections,
+            "utilization": round(pool["active"] / self.max_connections, 3),
+            "requests": self.transport.requests,
+            "new_connections": self.transport.connects,
+            "reuse_rate": round(1 - self.transport.connects / self.transport.requests, 3) if self.transport.requests else 0.0,
+            "errors": self.transport.errors,
+        }
+
+
+_POOLS: dict[str, _ProviderPool] = {}
+_POOLS_LOOP = None
+
+
+def _pools() -> dict[str, _ProviderPool]:
+    # Connections belong to one event loop (benchmarks call asyncio.run repeatedly)
+    global _POOLS, _POOLS_LOOP
+    loop = asyncio.get_running_loop()
+    if loop is not _POOLS_LOOP:
+        _POOLS_LOOP = loop
+        _POOLS = {provider: _ProviderPool(provider, config) for provider, config in HTTP_POOLS.items()}
+    return _POOLS
+
+
+def client_kwargs(model: str) -> dict:
+    """{"client": <pooled client>} to splat into litellm.acompletion / aembedding, or {} when
+    pooling is off or the provider has no pool (litellm then manages its own client)."""
+    if not HTTP_POOL_ENABLED:
+        return {}
+    pool = _pools().get(provider_of(model))
+    client = pool.litellm_client() if pool else None
+    return {"client": client} if client is not None else {}
+
+
+async def warm_up(connections: int = HTTP_POOL_WARM_CONNECTIONS) -> dict:
+    """Pre-connect every provider pool. Returns {provider: connections opened}."""
+    if not HTTP_POOL_ENABLED or connections <= 0:
+        return {}
+    pools = _pools()
+    opened = await asyncio.gather(*(pool.warm(connections) for pool in pools.values()))
+    return dict(zip(pools, opened))
+
+
+async def close_pools() -> None:
+    global _POOLS, _POOLS_LOOP
+    pools, _POOLS, _POOLS_LOOP = _POOLS, {}, None
+    await asyncio.gather(*(pool.http.aclose() for pool in pools.values()), return_exceptions=True)
+
+
+def http_pool_stats() -> dict:
+    """{provider: pool utilization, request/connection counts and connect p50/p95} for /health."""
+    connect = CONNECT_LATENCY.snapshot()
+    return {
+        provider: {**pool.stats(), "connect_ms": connect.get(provider, {})}
+        for provider, pool in _POOLS.items()
+    }
@@ -0,0 +1,52 @@
+from collections import defaultdict, deque
+
+import numpy as np
+
+# Upper bucket edges (ms) for latency histograms; the last bucket is open-ended
+HISTOGRAM_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class LatencyTracker:
+    """Rolling per-model latency samples (ms), one window per (model, kind).
+
+    `kind` is "ttft" (time to first token) or "total". Percentiles are only
+    reported once a window holds `min_samples` entries, so a cold model falls
+    back to the caller's default instead of a noisy estimate.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self._samples: dict[tuple[str, str], deque] = defaultdict(lambda: deque(maxlen=self.window))
+
+    def clear(self) -> None:
+        self._samples.clear()
+
+    def record(self, model: str, kind: str, ms: float) -> None:
+        self._samples[(model, kind)].append(float(ms))
+
+    def percentile(self, model: str, kind: str, pct: float, min_samples: int = 1) -> float | None:
+        samples = self._samples.get((model, kind))
+        if not samples or len(samples) < min_samples:
+            return None
+        return float(np.percentile(np.fromiter(samples, dtype=np.float64), pct))
+
+    def histogram(self, model: str, kind: str) -> dict:
+        """{"le_ms": bucket upper edges (None = +inf), "counts": samples per bucket}."""
+        samples = self._samples.get((model, kind), ())
+        edges = [0.0, *HISTOGRAM_BUCKETS_MS, np.inf]
+        counts, _ = np.histogram(np.fromiter(samples, dtype=np.float64), bins=edges)
+        return {"le_ms": [*HISTOGRAM_BUCKETS_MS, None], "counts": counts.tolist()}
+
+    def snapshot(self) -> dict:
+        """{model: {kind: {count, p50_ms, p95_ms, p99_ms}}} for /health."""
+        out: dict = {}
+        for (model, kind), samples in self._samples.items():
+            values = np.fromiter(samples, dtype=np.float64)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            out.setdefault(model, {})[kind] = {
+                "count": len(values),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+            }
+        return out
@@ -0,0 +1,338 @@
+import time
+import asyncio
+
+import litellm
+from langchain_core.callbacks.manager import adispatch_custom_event
+
+from core.config import FALLBACK_CHAINS
+from core.metrics import LATENCY, call_timeout
+from core.circuit_breaker import CircuitOpenError, get_breaker
+from core.scheduler import SCHEDULER, estimate_tokens
+from core.http_pool import client_kwargs
+
+
+async def emit_event(name: str, data: dict) -> None:
+    """Send a custom event to astream_events consumers (the /chat SSE stream).
+    A no-op when called outside a running graph.
+    """
+    try:
+        await adispatch_custom_event(name, data)
+    except RuntimeError:
+        pass
+
+
+def model_chain(model: str) -> list[str]:
+    """`model` followed by its FALLBACK_CHAINS entries, without duplicates."""
+    return list(dict.fromkeys([model, *FALLBACK_CHAINS.get(model, [])]))
+
+
+def _is_timeout(exc: BaseException) -> bool:
+    return isinstance(exc, (TimeoutError, litellm.Timeout))
+
+
+def _record_timeout(model: str, exc: BaseException, start: float | None) -> None:
+    """A timed-out attempt still tells us the model takes at least this long: keep it as a
+    latency sample so adaptive timeouts widen instead of cutting off every slow call."""
+    if start is not None and _is_timeout(exc):
+        LATENCY.record(model, "total", (time.time() - start) * 1000)
+
+
+def _record_failure(model: str, exc: BaseException) -> bool:
+    """Feed a failed call to its provider's breaker. Returns False for request errors
+    (bad request, context window) that another model would reject too."""
+    breaker = get_breaker(model)
+    if isinstance(exc, litellm.BadRequestError):
+        breaker.release()
+        return False
+    if isinstance(exc, litellm.RateLimitError):
+        SCHEDULER.throttled(model)
+    breaker.record_failure(timeout=_is_timeout(exc))
+    return True
+
+
+async def complete(model: str, messages: list[dict], timeout: float | None = None,
+                   node: str | None = None, **kwargs) -> tuple[object, str]:
+    """litellm.acompletion behind the circuit breakers, walking the model's fallback chain.
+
+    Models whose provider circuit is open are skipped without a network call; a
+    failed or timed-out call moves on to the next model. `timeout` applies per attempt,
+    excluding the wait for a scheduler slot; when omitted each attempt gets the adaptive
+    call_timeout() of its model for graph node `node`.
+
+    Returns:
+        (response, model) — the model that actually answered
+    """
+    last_error = None
+    tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+    for candidate in model_chain(model):
+        breaker = get_breaker(candidate)
+        if not breaker.allow():
+            continue
+        ticket = None
+        used_tokens = None
+        start = None
+        try:
+            ticket = await SCHEDULER.acquire(candidate, tokens)
+            start = time.time()
+            async with asyncio.timeout(timeout if timeout is not None else call_timeout(candidate, node)):
+                response = await litellm.acompletion(model=candidate, messages=messages,
+                                                    **client_kwargs(candidate), **kwargs)
+            used_tokens = _usage_tokens(response)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            _record_timeout(candidate, e, start)
+            if not _record_failure(candidate, e):
+                raise
+            last_error = e
+            continue
+        finally:
+            if ticket:
+                SCHEDULER.release(ticket, used_tokens)
+        breaker.record_success()
+        LATENCY.record(candidate, "total", (time.time() - start) * 1000)
+        return response, candidate
+
+    raise last_error or CircuitOpenError(f"All providers unavailable for {model}")
+
+
+def _usage_tokens(response) -> int | None:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
+async def _open_stream(model: str, messages: list[dict], **kwargs) -> tuple[object, list]:
+    """Start a streamed completion and read up to (and including) the first content chunk."""
+    stream = await litellm.acompletion(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **client_kwargs(model),
+        **kwargs,
+    )
+    chunks = []
+    try:
+        async for chunk in stream:
+            chunks.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+    except BaseException:
+        # Cancelled as a hedge loser or failed: close the response instead of leaving it open
+        await stream.aclose()
+        raise
+    return stream, chunks
+
+
+async def _drain_stream(stream, chunks: list, model: str, node: str) -> str:
+    """Forward the buffered chunks and the rest of the stream as `token` events."""
+    parts = []
+
+    async def forward(chunk) -> None:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            parts.append(delta)
+            await emit_event("token", {"node": node, "model": model, "text": delta})
+
+    for chunk in list(chunks):
+        await forward(chunk)
+    async for chunk in stream:
+        chunks.append(chunk)
+        await forward(chunk)
+    return "".join(parts)
+
+
+async def _open_stream_slot(model: str, messages: list[dict], tokens: int, **kwargs) -> tuple[object, list, dict]:
+    """_open_stream() after queueing for a scheduler slot; the caller releases the ticket."""
+    ticket = await SCHEDULER.acquire(model, tokens)
+    try:
+        stream, chunks = await _open_stream(model, messages, **kwargs)
+    except BaseException:
+        SCHEDULER.release(ticket)
+        raise
+    return stream, chunks, ticket
+
+
+async def _stream_chain(models: list[str], messages: list[dict], node: str,
+                        timeout: float | None, **kwargs) -> tuple[str, object, float, str]:
+    last_error = None
+    tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+    for candidate in models:
+        breaker = get_breaker(candidate)
+        if not breaker.allow():
+            continue
+        ticket = None
+        response = None
+        opened = False
+        start = None
+        try:
+            ticket = await SCHEDULER.acquire(candidate, tokens)
+            start = time.time()
+            async with asyncio.timeout(timeout if timeout is not None else call_timeout(candidate, node)):
+                stream, chunks = await _open_stream(candidate, messages, **kwargs)
+                opened = True
+                ttft_ms = (time.time() - start) * 1000
+                content = await _drain_stream(stream, chunks, candidate, node)
+            response = litellm.stream_chunk_builder(chunks, messages=messages)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            _record_timeout(candidate, e, start)
+            retryable = _record_failure(candidate, e)
+            # Tokens were already forwarded once the stream opened, so only fail over before that
+            if opened or not retryable:
+                raise
+            last_error = e
+            continue
+        finally:
+            if ticket:
+                SCHEDULER.release(ticket, _usage_tokens(response))
+
+        breaker.record_success()
+        LATENCY.record(candidate, "ttft", ttft_ms)
+        LATENCY.record(candidate, "total", (time.time() - start) * 1000)
+        return content, response, ttft_ms, candidate
+
+    raise last_error or CircuitOpenError(f"All providers unavailable for {models[0]}")
+
+
+async def stream_completion(model: str, messages: list[dict], node: str,
+                            timeout: float | None = None, **kwargs) -> tuple[str, object, float, str]:
+    """Stream a chat completion, forwarding every delta as a `token` event tagged with `node`.
+    Goes through the circuit breakers and fallback chain like complete(); failover only
+    happens before the first token. `timeout` (per attempt) defaults to call_timeout(model, node).
+
+    Returns:
+        (content, response, ttft_ms, model) — `response` is rebuilt from the chunks (with usage)
+        so calculate_cost() works exactly as for a non-streamed call; `model` answered
+    """
+    return await _stream_chain(model_chain(model), messages, node, timeout, **kwargs)
+
+
+async def hedged_stream_completion(model: str, backup: str | None, messages: list[dict], node: str,
+                                   hedge_after_s: float, timeout: float | None = None,
+                                   **kwargs) -> tuple[str, object, float, str, str | None]:
+    """stream_completion() with a hedge: if `model` has not produced a first token within
+    `hedge_after_s`, the same request is sent to `backup`. Whichever streams first wins
+    and the other request is cancelled. Only the winner's tokens are forwarded.
+
+    A primary that fails outright launches the backup at once; if both fail, the
+    rest of the primary's fallback chain is tried without hedging. `timeout` covers the
+    whole race and defaults to the larger call_timeout() of the two models.
+
+    Returns:
+        (content, response, ttft_ms, winner, loser) — `loser` is the cancelled model,
+        or None when no hedge was sent
+    """
+    chain = model_chain(model)
+    primary = next((m for m in chain if get_breaker(m).allow()), None)
+    if primary is None:
+        raise CircuitOpenError(f"All providers unavailable for {model}")
+    if backup == primary:
+        backup = None
+
+    race_timeout = timeout
+    if race_timeout is None:
+        limits = [call_timeout(m, node) for m in (primary, backup) if m]
+        race_timeout = max((t for t in limits if t is not None), default=None)
+
+    tokens = estimate_tokens(messages, kwargs.get("max_tokens"))
+    start = time.time()
+    tasks = {asyncio.create_task(_open_stream_slot(primary, messages, tokens, **kwargs)): (primary, start)}
+    pending, winner, error, response = set(tasks), None, None, None
+    try:
+        async with asyncio.timeout(race_timeout):
+            while winner is None:
+                can_hedge = backup is not None and len(tasks) == 1
+                if pending:
+                    wait_s = max(0.0, hedge_after_s - (time.time() - start)) if can_hedge else None
+                    done, pending = await asyncio.wait(pending, timeout=wait_s, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    done = set()
+                fatal = None
+                for task in done:
+                    if task.exception() is None:
+                        winner = winner or task
+                        continue
+                    # Every failed task frees its breaker slot, even when a sibling in the same batch won
+                    error = task.exception()
+                    if not _record_failure(tasks[task][0], error):
+                        fatal = error
+                if winner is None and fatal is not None:
+                    raise fatal
+
+                if winner is None and (not done or not pending) and can_hedge:
+                    if get_breaker(backup).allow():
+                        backup_task = asyncio.create_task(_open_stream_slot(backup, messages, tokens, **kwargs))
+                        tasks[backup_task] = (backup, time.time())
+                        pending.add(backup_task)
+                    backup = None
+                if winner is None and not pending and backup is None:
+                    break
+
+            if winner is not None:
+                now = time.time()
+                ttft_ms = (now - start) * 1000
+                winner_model, winner_started = tasks[winner]
+                loser = None
+                closing = []
+                # No awaits in this loop, so a task not done here cannot fail unrecorded; any
+                # that failed earlier went through _record_failure above
+                for task, (task_model, task_started) in tasks.items():
+                    if task is winner:
+                        continue
+                    if not task.done():
+                        task.cancel()
+                        get_breaker(task_model).release()
+                        loser = task_model
+                        # Censored sample: its first token would have come later than this
+                        LATENCY.record(task_model, "ttft", (now - task_started) * 1000)
+                    elif task.exception() is None:
+                        # Opened in the same instant as the winner: drop it and free its slot
+                        get_breaker(task_model).release()
+                        SCHEDULER.release(task.result()[2])
+                        closing.append(task.result()[0])
+                        loser = task_model
+                for loser_stream in closing:
+                    await loser_stream.aclose()
+
+                stream, chunks, ticket = winner.result()
+                try:
+                    content = await _drain_stream(stream, chunks, winner_model, node)
+                    response = litellm.stream_chunk_builder(chunks, messages=messages)
+                finally:
+                    SCHEDULER.release(ticket, _usage_tokens(response))
+    except asyncio.CancelledError:
+        for task, (task_model, _) in tasks.items():
+            if task is winner or not task.done():
+                get_breaker(task_model).release()
+        raise
+    except Exception as e:
+        # Timeouts and mid-stream errors count against whoever was still running
+        if winner is not None:
+            _record_timeout(tasks[winner][0], e, tasks[winner][1])
+            _record_failure(tasks[winner][0], e)
+        else:
+            for task, (task_model, task_started) in tasks.items():
+                if not task.done():
+                    _record_timeout(task_model, e, task_started)
+                    _record_failure(task_model, e)
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if winner is None:
+        tried = {m for m, _ in tasks.values()}
+        remaining = [m for m in chain if m not in tried]
+        if not remaining:
+            raise error
+        content, response, ttft_ms, answered_by = await _stream_chain(remaining, messages, node, timeout, **kwargs)
+        return content, response, ttft_ms, answered_by, None
+
+    get_breaker(winner_model).record_success()
+    LATENCY.record(winner_model, "ttft", (now - winner_started) * 1000)
+    LATENCY.record(winner_model, "total", (time.time() - winner_started) * 1000)
+    return content, response, ttft_ms, winner_model, loser
@@ -1,5 +1,50 @@
+from collections import defaultdict
+
 import litellm
-from core.config import MODEL_COSTS
+from core.config import (
+    MODEL_COSTS, LATENCY_WINDOW, ADAPTIVE_TIMEOUTS, TIMEOUT_PERCENTILE, TIMEOUT_FACTOR,
+    TIMEOUT_MIN_SAMPLES, NODE_TIMEOUTS,
+)
+from core.latency import LatencyTracker
+
+# Per-model time-to-first-token / total latency, fed by every LLM call
+LATENCY = LatencyTracker(LATENCY_WINDOW)
+
+# Hedged worker requests per primary model (WORKER_HEDGING), reported on /health
+HEDGE_STATS = defaultdict(lambda: {"requests": 0, "hedged": 0, "backup_wins": 0, "extra_cost_usd": 0.0})
+
+# Tiered judge (JUDGE_PRESCREEN): which tier decided, and the LLM judge time avoided
+JUDGE_STATS = {
+    "judged": 0,
+    "prescreen_rejected": 0,
+    "prescreen_approved": 0,
+    "llm_borderline": 0,
+    "llm_sampled": 0,
+    "sampled_disagreements": 0,
+    "llm_latency_s": 0.0,
+    "latency_saved_s": 0.0,
+}
+
+# Judge verdicts per route (routed model, or "aggregate"): the historical rejection rate
+ROUTE_JUDGE_STATS = defaultdict(lambda: {"judged": 0, "rejected": 0})
+
+# Speculative escalation (SPECULATIVE_ESCALATION): Opus started alongside the LLM judge
+ESCALATION_STATS = {
+    "launched": 0,
+    "used": 0,
+    "cancelled": 0,
+    "wasted_cost_usd": 0.0,
+    "latency_saved_s": 0.0,
+}
+
+# Speculative worker execution (GRAPH_MODE=speculative), reported on /health
+SPECULATION_STATS = {
+    "launched": 0,
+    "hits": 0,
+    "cancelled": 0,
+    "wasted_cost_usd": 0.0,
+    "latency_saved_s": 0.0,
+}
 
 def calculate_cost(model: str, response: any) -> float:
     """Calculates cost using LiteLLM with a fallback to manual calculation if litellm returns 0."""
@@ -18,16 +63,114 @@ def calculate_cost(model: str, response: any) -> float:
     prompt_tokens = getattr(usage, "prompt_tokens", 0)
     completion_tokens = getattr(usage, "completion_tokens", 0)
     
-    # Clean model string to match config (sometimes provider/ is prefixed)
-    cost_config = None
-    for m, costs in MODEL_COSTS.items():
-        if model == m or model.endswith(m) or m.endswith(model):
-            cost_config = costs
-            break
-            
+    cost_config = model_cost_config(model)
     if cost_config:
         input_cost = (prompt_tokens / 1_000_000) * cost_config["input"]
         output_cost = (completion_tokens / 1_000_000) * cost_config["output"]
         return input_cost + output_cost
         
     return 0.0
+
+
+def model_cost_config(model: str) -> dict | None:
+    # Clean model string to match config (sometimes provider/ is prefixed)
+    for m, costs in MODEL_COSTS.items():
+        if model == m or model.endswith(m) or m.endswith(model):
+            return costs
+    return None
+
+
+def estimate_prompt_cost(model: str, messages: list[dict]) -> float:
+    """Input-token cost of a request, for calls cancelled before a usage block came back."""
+    try:
+        prompt_tokens = litellm.token_counter(model=model, messages=messages)
+    except Exception:
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+    cost_config = model_cost_config(model)
+    if not cost_config:
+        return 0.0
+    return (prompt_tokens / 1_000_000) * cost_config["input"]
+
+
+def speculation_stats() -> dict:
+    launched = SPECULATION_STATS["launched"]
+    return {
+        **SPECULATION_STATS,
+        "wasted_cost_usd": round(SPECULATION_STATS["wasted_cost_usd"], 6),
+        "latency_saved_s": round(SPECULATION_STATS["latency_saved_s"], 3),
+        "hit_rate": round(SPECULATION_STATS["hits"] / launched, 4) if launched else 0.0,
+    }
+
+
+def judge_stats() -> dict:
+    judged = JUDGE_STATS["judged"]
+    llm_calls = JUDGE_STATS["llm_borderline"] + JUDGE_STATS["llm_sampled"]
+    return {
+        **JUDGE_STATS,
+        "llm_latency_s": round(JUDGE_STATS["llm_latency_s"], 3),
+        "latency_saved_s": round(JUDGE_STATS["latency_saved_s"], 3),
+        "llm_calls": llm_calls,
+        "llm_invocation_rate": round(llm_calls / judged, 4) if judged else 0.0,
+    }
+
+
+def route_rejection_rate(route: str, min_samples: int) -> float | None:
+    """Share of judged answers on `route` that were rejected, or None below `min_samples`."""
+    stats = ROUTE_JUDGE_STATS.get(route)
+    if not stats or stats["judged"] < min_samples:
+        return None
+    return stats["rejected"] / stats["judged"]
+
+
+def escalation_stats() -> dict:
+    launched = ESCALATION_STATS["launched"]
+    return {
+        **ESCALATION_STATS,
+        "wasted_cost_usd": round(ESCALATION_STATS["wasted_cost_usd"], 6),
+        "latency_saved_s": round(ESCALATION_STATS["latency_saved_s"], 3),
+        "use_rate": round(ESCALATION_STATS["used"] / launched, 4) if launched else 0.0,
+        "routes": {
+            route: {**stats, "rejection_rate": round(stats["rejected"] / stats["judged"], 4) if stats["judged"] else 0.0}
+            for route, stats in ROUTE_JUDGE_STATS.items()
+        },
+    }
+
+
+def hedge_stats() -> dict:
+    out = {}
+    for model, stats in HEDGE_STATS.items():
+        requests, hedged = stats["requests"], stats["hedged"]
+        out[model] = {
+            **stats,
+            "extra_cost_usd": round(stats["extra_cost_usd"], 6),
+            "hedge_rate": round(hedged / requests, 4) if requests else 0.0,
+            "backup_win_rate": round(stats["backup_wins"] / hedged, 4) if hedged else 0.0,
+        }
+    return out
+
+
+def call_timeout(model: str, node: str | None) -> float | None:
+    """Timeout (s) for one call attempt of `model` from graph node `node`: TIMEOUT_FACTOR x the
+    model's rolling TIMEOUT_PERCENTILE total latency, clamped to the node's NODE_TIMEOUTS budget.
+    None (no timeout) for nodes without a budget."""
+    budget = NODE_TIMEOUTS.get(node)
+    if budget is None:
+        return None
+    if not ADAPTIVE_TIMEOUTS:
+        return budget["default_s"]
+    latency_ms = LATENCY.percentile(model, "total", TIMEOUT_PERCENTILE, TIMEOUT_MIN_SAMPLES)
+    if latency_ms is None:
+        return budget["default_s"]
+    return min(budget["max_s"], max(budget["min_s"], TIMEOUT_FACTOR * latency_ms / 1000))
+
+
+def latency_report() -> dict:
+    """Per-model latency histograms and percentiles plus the timeout each node would use now."""
+    snapshot = LATENCY.snapshot()
+    return {
+        model: {
+            **{kind: {**stats, "histogram": LATENCY.histogram(model, kind)} for kind, stats in kinds.items()},
+            "timeouts_s": {node: round(call_timeout(model, node), 2) for node in NODE_TIMEOUTS},
+        }
+        for model, kinds in snapshot.items()
+    }
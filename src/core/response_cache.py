@@ -0,0 +1,142 @@
+import re
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+_NUMBER = re.compile(r"\d+(?:[.,:/]\d+)*")
+_WORD = re.compile(r"[^\W\d_][\w'-]*")
+
+
+def query_literals(text: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """Numbers (in order) and likely named entities in `text`: capitalized words that do not open
+    a sentence, and words with a capital after the first letter (AWS, iPhone). Queries that differ
+    only in these ("population of France" / "of Spain", "10 items" / "100 items") can embed within
+    the threshold, so a hit requires them to match exactly."""
+    names = set()
+    for sentence in re.split(r"[.!?\n]+", text):
+        for i, word in enumerate(_WORD.findall(sentence)):
+            if any(c.isupper() for c in word[1:]) or (i and word[0].isupper() and word != "I"):
+                names.add(word)
+    return tuple(_NUMBER.findall(text)), tuple(sorted(names))
+
+
+class ResponseCache:
+    """Semantic cache of worker answers, keyed on (query embedding, routed model).
+
+    Vectors live in one preallocated (max_size, dim) matrix so a lookup is a single
+    matrix-vector product; slots are recycled in LRU order once the cache is full.
+    A lookup hits when an unexpired entry for the same model has cosine similarity
+    >= `threshold` with the query and, if given, the same `literals` (see query_literals).
+    """
+
+    def __init__(self, max_size: int, ttl_s: float, threshold: float):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self.threshold = threshold
+        self.clear()
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters."""
+        self._vectors: np.ndarray | None = None
+        self._model_ids = np.full(self.max_size, -1, dtype=np.int32)
+        self._created = np.zeros(self.max_size, dtype=np.float64)
+        self._payloads: list[dict | None] = [None] * self.max_size
+        self._lru: OrderedDict[int, None] = OrderedDict()
+        self._models: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_cost_usd = 0.0
+        self.saved_latency_s = 0.0
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _free(self, slots: np.ndarray) -> None:
+        for slot in slots.tolist():
+            self._model_ids[slot] = -1
+            self._payloads[slot] = None
+            self._lru.pop(slot, None)
+
+    def get(self, vector: np.ndarray, model: str, record: bool = True, literals: tuple | None = None) -> dict | None:
+        """Cached payload plus its `similarity`, or None on a miss.
+        record=False peeks without touching stats or LRU order."""
+        model_id = self._models.get(model)
+        query = self._normalize(vector)
+        if self._vectors is None or model_id is None or query.shape[0] != self._vectors.shape[1]:
+            self.misses += record
+            return None
+
+        same_model = self._model_ids == model_id
+        expired = same_model & (time.time() - self._created > self.ttl_s)
+        if expired.any():
+            self._free(np.flatnonzero(expired))
+            self.expirations += int(expired.sum())
+            same_model &= ~expired
+
+        candidates = np.flatnonzero(same_model)
+        if candidates.size == 0:
+            self.misses += record
+            return None
+        sims = self._vectors[candidates] @ query
+        above = np.flatnonzero(sims >= self.threshold)
+        # Most similar first; skip entries about other numbers or names
+        best = next((int(i) for i in above[np.argsort(-sims[above])]
+                     if literals is None or self._payloads[int(candidates[i])].get("literals") == literals), None)
+        if best is None:
+            self.misses += record
+            return None
+
+        slot = int(candidates[best])
+        payload = self._payloads[slot]
+        if not record:
+            return {**payload, "similarity": float(sims[best])}
+        self._lru.move_to_end(slot)
+        self.hits += 1
+        self.saved_cost_usd += payload.get("cost_usd", 0.0)
+        self.saved_latency_s += payload.get("latency_s", 0.0)
+        return {**payload, "similarity": float(sims[best])}
+
+    def put(self, vector: np.ndarray, model: str, payload: dict) -> None:
+        """Store `payload` (response text, cost_usd, latency_s, literals) for this query/model."""
+        vector = self._normalize(vector)
+        if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+            # First entry, or the embedding backend changed dimension: start over
+            self._vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            self._model_ids[:] = -1
+            self._payloads = [None] * self.max_size
+            self._lru.clear()
+
+        free = np.flatnonzero(self._model_ids == -1)
+        if free.size:
+            slot = int(free[0])
+        else:
+            slot, _ = self._lru.popitem(last=False)
+            self.evictions += 1
+
+        self._vectors[slot] = vector
+        self._model_ids[slot] = self._models.setdefault(model, len(self._models))
+        self._created[slot] = time.time()
+        self._payloads[slot] = payload
+        self._lru[slot] = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._lru),
+            "max_size": self.max_size,
+            "ttl_s": self.ttl_s,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "saved_cost_usd": round(self.saved_cost_usd, 6),
+            "saved_latency_s": round(self.saved_latency_s, 3),
+        }
@@ -0,0 +1,185 @@
+import time
+import asyncio
+from contextvars import ContextVar
+
+from core.config import PROVIDER_LIMITS, MODEL_LIMITS, SCHEDULER_EST_OUTPUT_TOKENS
+from core.circuit_breaker import provider_of
+
+# Queue wait accumulated by the current graph node (see track_queue_wait)
+_QUEUE_WAIT: ContextVar[dict | None] = ContextVar("queue_wait", default=None)
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to a one-minute burst.
+
+    Waiters are served strictly in arrival order: the head of the queue holds
+    the lock while it sleeps for its deficit, so a large request is not starved
+    by a stream of small ones.
+    """
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, n: float) -> None:
+        n = min(n, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                await asyncio.sleep((n - self.tokens) / self.rate)
+
+    def settle(self, delta: float) -> None:
+        """Charge (or refund, if negative) the gap between reserved and actual usage."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+    def drain(self) -> None:
+        """The provider answered 429: make everyone wait for a refill."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Limiter:
+    def __init__(self, name: str, limits: dict):
+        self.name = name
+        concurrency, rpm, tpm = limits.get("concurrency", 0), limits.get("rpm", 0), limits.get("tpm", 0)
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.queued = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    async def acquire(self, tokens: int) -> None:
+        if self.semaphore:
+            await self.semaphore.acquire()
+        try:
+            if self.rpm:
+                await self.rpm.acquire(1)
+            if self.tpm:
+                await self.tpm.acquire(tokens)
+        except BaseException:
+            if self.semaphore:
+                self.semaphore.release()
+            raise
+
+    def release(self) -> None:
+        if self.semaphore:
+            self.semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "avg_wait_ms": round(self.total_wait_ms / self.requests, 2) if self.requests else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+        }
+
+
+class Scheduler:
+    """Admission control for LLM calls: per-model and per-provider concurrency
+    semaphores plus RPM/TPM token buckets. A call holds its ticket from
+    acquire() until release(), i.e. for the whole (streamed) response.
+    """
+
+    def __init__(self, provider_limits: dict, model_limits: dict):
+        self.provider_limits = provider_limits
+        self.model_limits = model_limits
+        self._loop = None
+        self._limiters: dict[str, _Limiter] = {}
+
+    def _reset(self) -> None:
+        self._limiters = {}
+        for provider, limits in self.provider_limits.items():
+            self._limiters[f"provider:{provider}"] = _Limiter(provider, limits)
+        for model, limits in self.model_limits.items():
+            self._limiters[f"model:{model}"] = _Limiter(model, limits)
+
+    def _limiters_for(self, model: str) -> list[_Limiter]:
+        # asyncio primitives belong to one event loop (benchmarks call asyncio.run repeatedly)
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._reset()
+        keys = (f"model:{model}", f"provider:{provider_of(model)}")
+        return [self._limiters[k] for k in keys if k in self._limiters]
+
+    async def acquire(self, model: str, tokens: int) -> dict:
+        """Wait for a slot (FIFO per limiter). Returns the ticket to pass to release()."""
+        start = time.monotonic()
+        held = []
+        try:
+            for limiter in self._limiters_for(model):
+                limiter.queued += 1
+                try:
+                    await limiter.acquire(tokens)
+                finally:
+                    limiter.queued -= 1
+                held.append(limiter)
+        except BaseException:
+            for limiter in held:
+                limiter.release()
+            raise
+
+        wait_ms = (time.monotonic() - start) * 1000
+        for limiter in held:
+            limiter.in_flight += 1
+            limiter.requests += 1
+            limiter.total_wait_ms += wait_ms
+            limiter.max_wait_ms = max(limiter.max_wait_ms, wait_ms)
+        tracker = _QUEUE_WAIT.get()
+        if tracker is not None:
+            tracker["wait_ms"] += wait_ms
+        return {"model": model, "tokens": tokens, "wait_ms": wait_ms, "held": held}
+
+    def release(self, ticket: dict, used_tokens: int | None = None) -> None:
+        """Free the slot; `used_tokens` (from the response usage) corrects the TPM reservation."""
+        for limiter in ticket["held"]:
+            limiter.in_flight -= 1
+            limiter.release()
+            if limiter.tpm and used_tokens is not None:
+                limiter.tpm.settle(used_tokens - ticket["tokens"])
+        ticket["held"] = []
+
+    def throttled(self, model: str) -> None:
+        """Called on a 429 so queued calls back off until the buckets refill."""
+        for limiter in self._limiters_for(model):
+            limiter.throttled += 1
+            if limiter.rpm:
+                limiter.rpm.drain()
+
+    def stats(self) -> dict:
+        return {key: limiter.stats() for key, limiter in self._limiters.items()}
+
+
+SCHEDULER = Scheduler(PROVIDER_LIMITS, MODEL_LIMITS)
+
+
+def estimate_tokens(messages: list[dict], max_tokens: int | None = None) -> int:
+    """Prompt tokens (~4 chars each) plus the expected completion, reserved against TPM."""
+    prompt = sum(len(m.get("content") or "") for m in messages) // 4
+    return prompt + (max_tokens or SCHEDULER_EST_OUTPUT_TOKENS)
+
+
+def track_queue_wait() -> dict:
+    """Start summing the scheduler queue wait of the LLM calls made from here on in the
+    current context (a graph node, plus any tasks it spawns). Returns {"wait_ms": float}."""
+    tracker = {"wait_ms": 0.0}
+    _QUEUE_WAIT.set(tracker)
+    return tracker
@@ -1,4 +1,4 @@
-from typing import TypedDict, List, Annotated, Dict, Any, Optional
+from typing import TypedDict, List, Annotated, Dict, Any, Optional, NotRequired
 from operator import add
 
 class TraceEntry(TypedDict):
@@ -6,6 +6,8 @@ class TraceEntry(TypedDict):
     action: str
     detail: Optional[str]
     timestamp: float
+    latency_ms: NotRequired[float]
+    queue_wait_ms: NotRequired[float]
 
 class NexusState(TypedDict):
     """NexusState TypedDict for LangGraph state management."""
@@ -27,6 +29,10 @@ class NexusState(TypedDict):
     # Routing
     subtasks: list[str]
     selected_models: list[str]
+    fast_path: bool
+    speculative_hit: bool
+    cache_hit: bool
+    knn_prefetch: Dict[str, Any]  # {"query", "model", "knn_scores"} scored before the classifier
 
     # Worker related
     worker_responses: Annotated[List[Dict[str, Any]], add]
@@ -36,17 +42,22 @@ class NexusState(TypedDict):
     # Judge
     judge_score: float
     judge_feedback: str
+    subtasks_judged: bool  # critical multi-part query judged per subtask in parallel_worker
 
     # Escalation
     escalation_model: str
     escalation_instruction: str
     escalation_count: int
+    escalation_prefetch: Optional[Dict[str, Any]]  # speculative escalation kept by the judge
 
     # Metrics & Trace
+    # Nodes return only their own entries / increments; the reducers accumulate them.
+    # Checkpointers store trace entries and response bodies once per thread (core/checkpointer.py).
     knn_scores: Dict[str, float]
+    subtask_knn_scores: List[Dict[str, float]]
     trace: Annotated[List[TraceEntry], add]
-    total_cost: float
-    total_latency: float
+    total_cost: Annotated[float, add]
+    total_latency: Annotated[float, add]
 
     # Error
     error: Optional[str]
@@ -0,0 +1,88 @@
+import argparse
+import time
+
+import numpy as np
+
+from core.config import KNN_K_VALUE
+from agents.knn_router import KNNScorer, IVFIndex
+
+
+def _clustered(rng: np.random.Generator, n: int, dim: int, centers: np.ndarray, noise: float) -> np.ndarray:
+    """Synthetic embeddings: points scattered around topic centers, like labelled production queries."""
+    picks = rng.integers(0, centers.shape[0], size=n)
+    return (centers[picks] + noise * rng.standard_normal((n, dim))).astype(np.float32)
+
+
+def _route_latencies_ms(scorer: KNNScorer, queries: np.ndarray) -> np.ndarray:
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        scorer.top_k(query)
+        samples.append((time.perf_counter() - start) * 1000)
+    return np.array(samples)
+
+
+def run_ann_benchmark(sizes: list[int], dim: int, n_queries: int, nprobes: list[int]) -> list[dict]:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    queries = _clustered(rng, n_queries, dim, centers, noise=0.6)
+    rows = []
+
+    for n in sizes:
+        scorer = KNNScorer(_clustered(rng, n, dim, centers, noise=0.6), ["m"] * n, k=KNN_K_VALUE)
+        exact_idx, _ = scorer.top_k(queries)
+        exact_ms = _route_latencies_ms(scorer, queries)
+        rows.append({
+            "vectors": n, "index": "exact", "nlist": "-", "nprobe": "-", "build_s": 0.0,
+            "recall_at_5": 1.0,
+            "p50_ms": round(float(np.percentile(exact_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(exact_ms, 99)), 3),
+        })
+
+        nlist = int(4 * np.sqrt(n))
+        start = time.perf_counter()
+        scorer.ann = IVFIndex.build(scorer.vectors, nlist=nlist, nprobe=nprobes[0])
+        build_s = time.perf_counter() - start
+
+        for nprobe in nprobes:
+            scorer.ann.nprobe = nprobe
+            ann_idx, _ = scorer.top_k(queries)
+            recall = np.mean([
+                len(set(a) & set(e)) / len(e) for a, e in zip(ann_idx.tolist(), exact_idx.tolist())
+            ])
+            ann_ms = _route_latencies_ms(scorer, queries)
+            rows.append({
+                "vectors": n, "index": "ivf", "nlist": nlist, "nprobe": nprobe, "build_s": round(build_s, 2),
+                "recall_at_5": round(float(recall), 4),
+                "p50_ms": round(float(np.percentile(ann_ms, 50)), 3),
+                "p99_ms": round(float(np.percentile(ann_ms, 99)), 3),
+            })
+        scorer.ann = None
+
+    return rows
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare IVF ANN recall@5 and route latency against the exact scan.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Prototype counts.")
+    parser.add_argument("--dim", type=int, default=384,
+                        help="Embedding dimension (use 1536 for text-embedding-3-small; needs ~600MB at 100k).")
+    parser.add_argument("--queries", type=int, default=500, help="Single-query routes timed per configuration.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32], help="nprobe values to sweep.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rows = run_ann_benchmark(args.sizes, args.dim, args.queries, args.nprobe)
+    print(f"\nANN BENCHMARK (dim={args.dim}, k={KNN_K_VALUE}, {args.queries} queries)")
+    print(f"  {'vectors':>8}  {'index':>5}  {'nlist':>5}  {'nprobe':>6}  {'build_s':>7}  {'recall@5':>8}  {'p50_ms':>7}  {'p99_ms':>7}")
+    for r in rows:
+        print(
+            f"  {r['vectors']:>8}  {r['index']:>5}  {r['nlist']:>5}  {r['nprobe']:>6}  {r['build_s']:>7}  "
+            f"{r['recall_at_5']:>8.4f}  {r['p50_ms']:>7.3f}  {r['p99_ms']:>7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
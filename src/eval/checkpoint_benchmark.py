@@ -0,0 +1,199 @@
+import os
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing
+
+from langgraph.graph import StateGraph, END
+from langgraph.types import Command
+
+from core.state import NexusState
+from core.checkpointer import new_checkpointer
+from agents.hitl import hitl_node
+
+# Graph shaped like a /chat request (classify -> [hitl] -> route -> worker -> final) whose nodes
+# return realistic state updates without calling any model, so the run is bound by LangGraph
+# and checkpoint I/O: the part that limits how far one host scales across worker processes.
+_RESPONSE = ("Quicksort picks a pivot, partitions the list around it and recurses on both halves. " * 40).strip()
+
+_GRAPH = None
+
+
+def _classifier(state: NexusState) -> dict:
+    return {
+        "can_self_answer": False,
+        "is_critical": False,
+        "is_ambiguous": state["query"].endswith("?"),
+        "subtasks": [],
+        "trace": [{"node": "classifier", "action": "classified", "detail": "synthetic", "timestamp": time.time()}],
+    }
+
+
+def _router(state: NexusState) -> dict:
+    return {
+        "selected_models": ["groq/llama-3.1-8b-instant"],
+        "knn_scores": {"groq/llama-3.1-8b-instant": 0.91, "cerebras/gpt-oss-120b": 0.42},
+        "trace": [{"node": "knn_router", "action": "routed", "detail": "synthetic", "timestamp": time.time()}],
+    }
+
+
+def _worker(state: NexusState) -> dict:
+    return {
+        "worker_responses": [{"model": "groq/llama-3.1-8b-instant", "response": _RESPONSE, "cost_usd": 1e-5,
+                              "latency_ms": 420.0, "ttft_ms": 90.0, "error": False, "finish_reason": "stop"}],
+        "trace": [{"node": "worker", "action": "completed", "detail": "synthetic", "timestamp": time.time()}],
+        "total_cost": 1e-5,
+        "total_latency": 0.42,
+    }
+
+
+def _final(state: NexusState) -> dict:
+    return {"final_response": state["worker_responses"][-1]["response"]}
+
+
+def build_graph(checkpointer):
+    workflow = StateGraph(NexusState)
+    workflow.add_node("classifier", _classifier)
+    workflow.add_node("hitl", hitl_node)
+    workflow.add_node("knn_router", _router)
+    workflow.add_node("worker", _worker)
+    workflow.add_node("set_final", _final)
+    workflow.set_entry_point("classifier")
+    workflow.add_conditional_edges("classifier", lambda s: "hitl" if s["is_ambiguous"] else "knn_router",
+                                   {"hitl": "hitl", "knn_router": "knn_router"})
+    workflow.add_edge("hitl", "knn_router")
+    workflow.add_edge("knn_router", "worker")
+    workflow.add_edge("worker", "set_final")
+    workflow.add_edge("set_final", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def _init(backend: str, path: str) -> None:
+    global _GRAPH
+    _GRAPH = build_graph(new_checkpointer(backend, path))
+
+
+async def _start(session_ids: list[str]) -> list[tuple[str, bool]]:
+    """Run each session's first request; returns (session_id, interrupted) pairs."""
+    out = []
+    for session_id in session_ids:
+        config = {"configurable": {"thread_id": session_id}}
+        # Every other session asks an ambiguous question and stops at the HITL interrupt
+        query = "which sort is best?" if int(session_id.rsplit("-", 1)[1]) % 2 else "write quicksort in python"
+        await _GRAPH.ainvoke({"query": query, "trace": [], "worker_responses": [], "total_cost": 0.0,
+                              "total_latency": 0.0}, config=config)
+        _GRAPH.checkpointer.flush()  # what state_to_sse does at the end of every request
+        out.append((session_id, bool(_GRAPH.get_state(config).next)))
+    return out
+
+
+async def _resume(session_ids: list[str]) -> int:
+    """Resume interrupted sessions (started in some other process); returns how many completed."""
+    done = 0
+    for session_id in session_ids:
+        config = {"configurable": {"thread_id": session_id}}
+        if _GRAPH.checkpointer.get_tuple(config) is None:
+            continue  # "Session not found"
+        await _GRAPH.ainvoke(Command(resume="for small lists"), config=config)
+        _GRAPH.checkpointer.flush()
+        done += bool(_GRAPH.get_state(config).values.get("final_response"))
+    return done
+
+
+def _ready(_: int) -> int:
+    time.sleep(0.2)  # hold the process so every pool worker gets one and finishes its initializer
+    return os.getpid()
+
+
+def _start_chunk(session_ids: list[str]) -> tuple[int, list[tuple[str, bool]]]:
+    return os.getpid(), asyncio.run(_start(session_ids))
+
+
+def _resume_chunk(session_ids: list[str]) -> tuple[int, int]:
+    return os.getpid(), asyncio.run(_resume(session_ids))
+
+
+def _chunks(items: list, n: int) -> list[list]:
+    return [items[i::n] for i in range(n) if items[i::n]]
+
+
+def run_checkpoint_benchmark(backend: str, workers: int, sessions: int, path: str) -> dict:
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    session_ids = [f"bench-{i}" for i in range(sessions)]
+
+    if workers == 1:
+        # In-process, like a single uvicorn worker (the only option for the memory backend)
+        _init(backend, path)
+        start = time.perf_counter()
+        started = [(os.getpid(), asyncio.run(_start(session_ids)))]
+        interrupted = [sid for _, pairs in started for sid, paused in pairs if paused]
+        resumed = [(os.getpid(), asyncio.run(_resume(interrupted)))]
+        owners = {sid: os.getpid() for sid in session_ids}
+    else:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(workers, initializer=_init, initargs=(backend, path)) as pool:
+            # Process spawn and imports are not request throughput
+            pool.map(_ready, range(workers), chunksize=1)
+            start = time.perf_counter()
+            started = pool.map(_start_chunk, _chunks(session_ids, workers * 4))
+            owners = {sid: pid for pid, pairs in started for sid, _ in pairs}
+            interrupted = [sid for _, pairs in started for sid, paused in pairs if paused]
+            # Rotate so resumes tend to land on a different process than the one that paused
+            resumed = pool.map(_resume_chunk, _chunks(interrupted[len(interrupted) // 2:] + interrupted[:len(interrupted) // 2],
+                                                      workers * 4))
+    elapsed = time.perf_counter() - start
+
+    requests = sessions + len(interrupted)
+    completed = sum(n for _, n in resumed)
+    file_bytes = sum(os.path.getsize(path + s) for s in ("", "-wal") if os.path.exists(path + s))
+    return {
+        "backend": backend,
+        "workers": workers,
+        "sessions": sessions,
+        "requests": requests,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(requests / elapsed, 1) if elapsed else 0.0,
+        "interrupted": len(interrupted),
+        "resumed_ok": completed,
+        "processes_used": len({pid for pid, _ in started}),
+        "sessions_per_owner_process": round(sessions / max(1, len(set(owners.values()))), 1),
+        "db_file_bytes": file_bytes if backend == "sqlite" else 0,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Checkpoint backend throughput: 1 vs N worker processes sharing one SQLite file.")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, min(4, os.cpu_count() or 1)],
+                        help="Worker process counts to compare (sqlite backend).")
+    parser.add_argument("--sessions", type=int, default=400, help="Sessions per run; every other one is resumed after a HITL interrupt.")
+    parser.add_argument("--path", default=os.path.join(tempfile.gettempdir(), "nexus_checkpoint_bench.sqlite"))
+    parser.add_argument("--no-memory-baseline", action="store_true", help="Skip the single-process in-memory run.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    runs = [] if args.no_memory_baseline else [("memory", 1)]
+    runs += [("sqlite", n) for n in dict.fromkeys(args.workers)]
+
+    summaries = []
+    for backend, workers in runs:
+        print(f"Running {args.sessions} sessions on '{backend}' with {workers} worker(s)...", flush=True)
+        summaries.append(run_checkpoint_benchmark(backend, workers, args.sessions, args.path))
+
+    print("\nCHECKPOINT BACKEND BENCHMARK")
+    single = next((s for s in summaries if s["backend"] == "sqlite" and s["workers"] == 1), None)
+    for summary in summaries:
+        if single and summary is not single and summary["backend"] == "sqlite":
+            summary["speedup_vs_1_worker"] = round(summary["requests_per_s"] / single["requests_per_s"], 2)
+        print(f"\n  [{summary['backend']} x{summary['workers']}]")
+        for k, v in summary.items():
+            if k not in ("backend", "workers"):
+                print(f"    {k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
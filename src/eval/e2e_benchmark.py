@@ -9,8 +9,15 @@ from datetime import datetime
 
 from langgraph.types import Command
 
-from core.config import GPT5_BASELINE_COST
-from core.graph import nexus_graph
+from core.config import GPT5_BASELINE_COST, GRAPH_MODE, WORKER_HEDGING, SPECULATIVE_ESCALATION
+from core.metrics import (
+    LATENCY, HEDGE_STATS, JUDGE_STATS, ROUTE_JUDGE_STATS, ESCALATION_STATS, SPECULATION_STATS,
+    hedge_stats, judge_stats, escalation_stats,
+)
+from core.circuit_breaker import BREAKERS
+from core.embed_cache import EmbeddingCache
+from agents.judge import ROUTE_LENGTHS
+from core.graph import GRAPH_MODES, create_graph
 from eval.benchmark import QUERIES
 import agents.knn_router as knn_mod
 from agents.knn_router import build_knn_index
@@ -26,6 +33,18 @@ def _extract_used_models(memory: dict) -> list[str]:
     return used
 
 
+def _node_latency_ms(memory: dict, node: str) -> float:
+    return sum(float(t.get("latency_ms", 0.0)) for t in memory.get("trace", []) or [] if t.get("node") == node)
+
+
+def _judge_tier(memory: dict) -> str:
+    """Judge tier that decided: "llm", "prescreen" (local pre-screen only), or "" if not judged."""
+    actions = [t.get("action", "") for t in memory.get("trace", []) or [] if t.get("node") == "judge"]
+    if any(not a.startswith("prescreen_") for a in actions):
+        return "llm"
+    return "prescreen" if actions else ""
+
+
 def _extract_flow(memory: dict) -> list[str]:
     flow = []
     for trace in memory.get("trace", []) or []:
@@ -35,7 +54,7 @@ def _extract_flow(memory: dict) -> list[str]:
     return flow
 
 
-async def _run_single_query(idx: int, query: str, expected: str, query_timeout_s: float) -> dict:
+async def _run_single_query(graph, idx: int, query: str, expected: str, query_timeout_s: float) -> dict:
     session_id = str(uuid.uuid4())
     config = {"configurable": {"thread_id": session_id}}
     initial_state = {
@@ -50,22 +69,24 @@ async def _run_single_query(idx: int, query: str, expected: str, query_timeout_s
     }
 
     start = time.time()
+    first_token_at = None
     error = ""
     try:
+        async def _consume(graph_input):
+            # Same event stream the /chat SSE endpoint uses, so token timing matches what users see
+            nonlocal first_token_at
+            async for event in graph.astream_events(graph_input, config=config, version="v2"):
+                if first_token_at is None and event.get("event") == "on_custom_event" and event.get("name") == "token":
+                    first_token_at = time.time()
+
         async def _execute_query():
-            async for _ in nexus_graph.astream(initial_state, config=config, stream_mode="values"):
-                pass
+            await _consume(initial_state)
 
-            state_snapshot = nexus_graph.get_state(config)
+            state_snapshot = graph.get_state(config)
             if state_snapshot.next and "hitl" in state_snapshot.next:
-                async for _ in nexus_graph.astream(
-                    Command(resume="please proceed with best guess"),
-                    config=config,
-                    stream_mode="values",
-                ):
-                    pass
+                await _consume(Command(resume="please proceed with best guess"))
 
-            return nexus_graph.get_state(config).values
+            return graph.get_state(config).values
 
         memory = await asyncio.wait_for(_execute_query(), timeout=query_timeout_s)
     except asyncio.TimeoutError:
@@ -76,12 +97,15 @@ async def _run_single_query(idx: int, query: str, expected: str, query_timeout_s
         error = str(exc)
 
     latency = time.time() - start
+    ttft = (first_token_at - start) if first_token_at else None
     routed_models = memory.get("selected_models", []) or []
     used_models = _extract_used_models(memory)
     routed_model = routed_models[0] if routed_models else "unknown"
     cost = float(memory.get("total_cost", 0.0) or 0.0)
     top_knn = max((memory.get("knn_scores", {}) or {}).values(), default=0.0)
 
+    cached = next((w for w in memory.get("worker_responses", []) or [] if w.get("cached")), None)
+
     flow_nodes = _extract_flow(memory)
     can_self_answer = bool(memory.get("can_self_answer", False))
 
@@ -106,12 +130,20 @@ async def _run_single_query(idx: int, query: str, expected: str, query_timeout_s
         "critical": bool(memory.get("is_critical", False)),
         "escalated": (memory.get("escalation_count", 0) or 0) > 0,
         "latency_s": round(latency, 3),
+        "ttft_s": round(ttft, 3) if ttft is not None else None,
         "graph_latency_s": round(float(memory.get("total_latency", 0.0) or 0.0), 3),
         "cost_usd": round(cost, 6),
         "saved_vs_gpt5_usd": round(GPT5_BASELINE_COST - cost, 6),
         "knn_top_score": round(float(top_knn), 4),
         "flow_nodes": flow_nodes,
         "can_self_answer": can_self_answer,
+        "fast_path": bool(memory.get("fast_path", False)),
+        "classifier_ms": round(_node_latency_ms(memory, "classifier"), 2),
+        "judge_tier": _judge_tier(memory),
+        "judge_ms": round(_node_latency_ms(memory, "judge"), 2),
+        "cache_hit": bool(memory.get("cache_hit", False)),
+        "cache_saved_cost_usd": round(cached["saved_cost_usd"], 6) if cached else 0.0,
+        "cache_saved_latency_s": round(cached["saved_latency_s"], 3) if cached else 0.0,
         "failure_type": failure_type,
         "error": error,
         "success": error == "",
@@ -119,17 +151,47 @@ async def _run_single_query(idx: int, query: str, expected: str, query_timeout_s
     return result
 
 
-async def run_e2e_benchmark(limit: int | None = None, query_timeout_s: float = 90.0) -> tuple[dict, list[dict], str, str]:
-    queries = QUERIES[:limit] if limit else QUERIES
-    print(f"Running end-to-end benchmark: {len(queries)} queries", flush=True)
-
-    if knn_mod.KNN_INDEX is None:
+async def _reset_process_state() -> None:
+    """Forget what an earlier run in this process warmed up or learned: embeddings, online-learned
+    KNN rows, latency percentiles (hedge delays, timeouts), circuit breakers and per-route judge
+    history and answer lengths. The persistent embedding tier is left out rather than cleared, since it is shared."""
+    cache = knn_mod.EMBED_CACHE
+    knn_mod.EMBED_CACHE = EmbeddingCache(cache.max_size, cache.ttl_s)
+    knn_mod.KNN_INDEX = await build_knn_index(learned=False)
+    LATENCY.clear()
+    BREAKERS.clear()
+    ROUTE_JUDGE_STATS.clear()
+    ROUTE_LENGTHS.clear()
+    for key in SPECULATION_STATS:
+        SPECULATION_STATS[key] = 0
+
+
+async def run_e2e_benchmark(
+    limit: int | None = None, query_timeout_s: float = 90.0, graph_mode: str = GRAPH_MODE, repeat: int = 1,
+    fresh: bool = False,
+) -> tuple[dict, list[dict], str, str]:
+    # repeat > 1 replays the suite, which is what exercises the response cache
+    queries = (QUERIES[:limit] if limit else QUERIES) * max(1, repeat)
+    graph = create_graph(graph_mode)
+    print(f"Running end-to-end benchmark: {len(queries)} queries (graph_mode={graph_mode})", flush=True)
+
+    if fresh:
+        # Baseline and candidate share this process; each starts cold
+        await _reset_process_state()
+    elif knn_mod.KNN_INDEX is None:
         print("Building KNN index...", flush=True)
         knn_mod.KNN_INDEX = await build_knn_index()
 
+    HEDGE_STATS.clear()
+    for key in JUDGE_STATS:
+        JUDGE_STATS[key] = 0
+    for key in ESCALATION_STATS:
+        ESCALATION_STATS[key] = 0
+    knn_mod.RESPONSE_CACHE.clear()
     results = []
     for idx, item in enumerate(queries, start=1):
         result = await _run_single_query(
+            graph=graph,
             idx=idx,
             query=item["q"],
             expected=item["expected"],
@@ -139,7 +201,7 @@ async def run_e2e_benchmark(limit: int | None = None, query_timeout_s: float = 9
         route_ok = "match" if result["correct_routing"] else "mismatch"
         print(
             f"[{idx}/{len(queries)}] {status} {route_ok} "
-            f"lat={result['latency_s']:.2f}s routed={result['routed_model']} used={','.join(result['used_models']) or 'n/a'}"
+            f"lat={result['latency_s']:.2f}s ttft={result['ttft_s'] if result['ttft_s'] is not None else 'n/a'}s routed={result['routed_model']} used={','.join(result['used_models']) or 'n/a'}"
             ,
             flush=True,
         )
@@ -155,13 +217,32 @@ async def run_e2e_benchmark(limit: int | None = None, query_timeout_s: float = 9
     total_latency = sum(r["latency_s"] for r in success_rows)
     avg_latency = (total_latency / success_count) if success_count else 0.0
     avg_cost = (total_cost / success_count) if success_count else 0.0
+    ttfts = sorted(r["ttft_s"] for r in success_rows if r["ttft_s"] is not None)
+    avg_ttft = (sum(ttfts) / len(ttfts)) if ttfts else 0.0
+    p50_ttft = ttfts[len(ttfts) // 2] if ttfts else 0.0
+    p95_ttft = ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.95))] if ttfts else 0.0
+    latencies = sorted(r["latency_s"] for r in success_rows)
+    p99_latency = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
     correct_routing = sum(1 for r in success_rows if r["correct_routing"])
     routing_accuracy = (correct_routing / success_count * 100.0) if success_count else 0.0
     baseline_total = GPT5_BASELINE_COST * success_count
     saved_total = baseline_total - total_cost
 
+    # Fast path: each hit skips one classifier round trip, valued at the mean measured classifier latency
+    fast_path_hits = sum(1 for r in success_rows if r["fast_path"])
+    classifier_samples = [r["classifier_ms"] for r in success_rows if r["classifier_ms"] > 0]
+    avg_classifier_ms = (sum(classifier_samples) / len(classifier_samples)) if classifier_samples else 0.0
+
+    cache_hits = sum(1 for r in success_rows if r["cache_hit"])
+
+    judged = [r for r in success_rows if r["judge_tier"]]
+    judge_llm = sum(1 for r in judged if r["judge_tier"] == "llm")
+    judge_stats_snapshot = judge_stats()
+    escalation_snapshot = escalation_stats()
+
     summary = {
         "generated_at": datetime.utcnow().isoformat() + "Z",
+        "graph_mode": graph_mode,
         "total_queries": len(results),
         "successful_queries": success_count,
         "failed_queries": failed_count,
@@ -170,11 +251,35 @@ async def run_e2e_benchmark(limit: int | None = None, query_timeout_s: float = 9
         "no_routing_output_cases": no_routing_count,
         "routing_accuracy_success_only_pct": round(routing_accuracy, 2),
         "avg_latency_s": round(avg_latency, 3),
+        "p99_latency_s": round(p99_latency, 3),
+        "avg_ttft_s": round(avg_ttft, 3),
+        "p50_ttft_s": round(p50_ttft, 3),
+        "p95_ttft_s": round(p95_ttft, 3),
         "avg_cost_usd": round(avg_cost, 6),
         "total_cost_usd": round(total_cost, 6),
         "gpt5_baseline_per_query_usd": GPT5_BASELINE_COST,
         "gpt5_baseline_total_usd_success_only": round(baseline_total, 6),
         "saved_vs_gpt5_total_usd_success_only": round(saved_total, 6),
+        "avg_classifier_ms": round(avg_classifier_ms, 2),
+        "fast_path_hits": fast_path_hits,
+        "fast_path_hit_rate_pct": round(fast_path_hits / success_count * 100.0, 2) if success_count else 0.0,
+        "fast_path_est_latency_saved_s": round(fast_path_hits * avg_classifier_ms / 1000, 3),
+        "cache_hits": cache_hits,
+        "cache_hit_rate_pct": round(cache_hits / success_count * 100.0, 2) if success_count else 0.0,
+        "cache_saved_cost_usd": round(sum(r["cache_saved_cost_usd"] for r in success_rows), 6),
+        "cache_saved_latency_s": round(sum(r["cache_saved_latency_s"] for r in success_rows), 3),
+        "judged_queries": len(judged),
+        "judge_llm_invocations": judge_llm,
+        "judge_llm_invocation_rate_pct": round(judge_llm / len(judged) * 100.0, 2) if judged else 0.0,
+        "judge_latency_saved_s": judge_stats_snapshot["latency_saved_s"],
+        "judge_tiers": judge_stats_snapshot,
+        "speculative_escalation": SPECULATIVE_ESCALATION,
+        "speculative_escalations": escalation_snapshot["launched"],
+        "speculative_escalations_used": escalation_snapshot["used"],
+        "speculative_escalation_wasted_cost_usd": escalation_snapshot["wasted_cost_usd"],
+        "speculative_escalation_latency_saved_s": escalation_snapshot["latency_saved_s"],
+        "worker_hedging": WORKER_HEDGING,
+        "hedging_by_model": hedge_stats(),
     }
 
     os.makedirs("eval", exist_ok=True)
@@ -201,12 +306,20 @@ async def run_e2e_benchmark(limit: int | None = None, query_timeout_s: float = 9
         "critical",
         "escalated",
         "latency_s",
+        "ttft_s",
         "graph_latency_s",
         "cost_usd",
         "saved_vs_gpt5_usd",
         "knn_top_score",
         "flow_nodes",
         "can_self_answer",
+        "fast_path",
+        "classifier_ms",
+        "judge_tier",
+        "judge_ms",
+        "cache_hit",
+        "cache_saved_cost_usd",
+        "cache_saved_latency_s",
         "failure_type",
         "success",
         "error",
@@ -236,6 +349,24 @@ async def run_e2e_benchmark(limit: int | None = None, query_timeout_s: float = 9
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Run end-to-end benchmark with latency/model-flow reporting.")
     parser.add_argument("--limit", type=int, default=0, help="Run only the first N queries (0 = all).")
+    parser.add_argument(
+        "--graph-mode",
+        choices=GRAPH_MODES,
+        default=GRAPH_MODE,
+        help="Graph variant to benchmark (see core.graph.create_graph).",
+    )
+    parser.add_argument(
+        "--baseline-mode",
+        choices=GRAPH_MODES,
+        default=None,
+        help="Also run this graph variant first and print a before/after comparison.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run the query list this many times (repeats hit the semantic response cache).",
+    )
     parser.add_argument(
         "--query-timeout-s",
         type=float,
@@ -245,12 +376,31 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def _print_comparison(before: dict, after: dict) -> None:
+    print(f"\nBEFORE/AFTER ({before['graph_mode']} -> {after['graph_mode']})")
+    for key in ("avg_latency_s", "p99_latency_s", "avg_ttft_s", "avg_cost_usd", "routing_accuracy_success_only_pct"):
+        delta = after[key] - before[key]
+        pct = (delta / before[key] * 100.0) if before[key] else 0.0
+        print(f"  {key}: {before[key]} -> {after[key]} ({delta:+.4f}, {pct:+.1f}%)")
+
+
 def main() -> None:
     args = parse_args()
     limit = args.limit if args.limit > 0 else None
+
+    baseline = None
+    if args.baseline_mode:
+        baseline, _, _, _ = asyncio.run(
+            run_e2e_benchmark(limit=limit, query_timeout_s=args.query_timeout_s, graph_mode=args.baseline_mode,
+                              repeat=args.repeat, fresh=True)
+        )
+
     summary, _, json_path, csv_path = asyncio.run(
-        run_e2e_benchmark(limit=limit, query_timeout_s=args.query_timeout_s)
+        run_e2e_benchmark(limit=limit, query_timeout_s=args.query_timeout_s, graph_mode=args.graph_mode,
+                          repeat=args.repeat, fresh=bool(args.baseline_mode))
     )
+    if baseline:
+        _print_comparison(baseline, summary)
     print("\nE2E BENCHMARK SUMMARY")
     for k, v in summary.items():
         print(f"  {k}: {v}")
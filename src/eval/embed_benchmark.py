@@ -0,0 +1,80 @@
+import asyncio
+import argparse
+import time
+
+import numpy as np
+
+from core.embeddings import EMBED_BACKENDS, get_embedder
+from eval.benchmark import QUERIES
+from agents.knn_router import build_knn_index
+
+
+async def _run_backend(backend: str) -> tuple[dict, list[str]]:
+    embedder = get_embedder(backend)
+
+    start = time.perf_counter()
+    index = await build_knn_index(embedder=embedder)
+    index_ms = (time.perf_counter() - start) * 1000
+
+    routed = []
+    latencies_ms = []
+    correct = 0
+    for item in QUERIES:
+        # Bypass the embedding cache: we want the backend's real per-query cost
+        start = time.perf_counter()
+        vectors = await embedder.embed([item["q"]])
+        best_model, _ = index.route(vectors)[0]
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        routed.append(best_model)
+        correct += best_model == item["expected"]
+
+    n = len(QUERIES)
+    summary = {
+        "backend": backend,
+        "embedder": embedder.name,
+        "index_source": index.source,
+        "index_ms": round(index_ms, 1),
+        "routing_accuracy_pct": round(correct / n * 100, 2) if n else 0.0,
+        "avg_route_ms": round(float(np.mean(latencies_ms)), 3),
+        "p50_route_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_route_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        "est_cost_usd": round(embedder.cost_per_text * n, 6),
+    }
+    return summary, routed
+
+
+async def run_embed_benchmark(backends: list[str]) -> list[dict]:
+    summaries = []
+    reference = None
+    for backend in backends:
+        print(f"Routing {len(QUERIES)} queries with '{backend}'...", flush=True)
+        summary, routed = await _run_backend(backend)
+        if reference is None:
+            reference = routed
+        else:
+            same = sum(1 for a, b in zip(reference, routed) if a == b)
+            summary[f"agreement_with_{backends[0]}_pct"] = round(same / len(routed) * 100, 2)
+        summaries.append(summary)
+    return summaries
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare KNN routing accuracy and latency across embedding backends.")
+    parser.add_argument("--backends", nargs="+", default=list(EMBED_BACKENDS), choices=list(EMBED_BACKENDS),
+                        help="Embedding backends to compare (first one is the agreement reference).")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    summaries = asyncio.run(run_embed_benchmark(args.backends))
+    print("\nEMBEDDING BACKEND BENCHMARK")
+    for summary in summaries:
+        print(f"\n  [{summary['backend']}]")
+        for k, v in summary.items():
+            if k != "backend":
+                print(f"    {k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from core.config import KNN_K_VALUE
+from agents.knn_router import KNNScorer
+
+
+def _legacy_route(query_vecs: np.ndarray, vectors: np.ndarray, labels: list[str], k: int) -> list[str]:
+    """The previous per-query path: sklearn cosine_similarity + full argsort, one query at a time."""
+    routed = []
+    for query_vec in query_vecs:
+        scores = cosine_similarity([query_vec], vectors)[0]
+        top_idx = scores.argsort()[-k:][::-1]
+        routed.append(labels[top_idx[0]])
+    return routed
+
+
+def _time_ms(fn, repeats: int) -> float:
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def run_knn_benchmark(sizes: list[int], dim: int, batch: int, repeats: int) -> list[dict]:
+    rng = np.random.default_rng(0)
+    rows = []
+    for n in sizes:
+        vectors = rng.standard_normal((n, dim)).astype(np.float32)
+        labels = [f"model-{i % 7}" for i in range(n)]
+        queries = rng.standard_normal((batch, dim)).astype(np.float32)
+        scorer = KNNScorer(vectors, labels, k=KNN_K_VALUE)
+
+        legacy_ms = _time_ms(lambda: _legacy_route(queries, vectors, labels, KNN_K_VALUE), repeats)
+        scorer_ms = _time_ms(lambda: scorer.route(queries), repeats)
+        rows.append({
+            "prototypes": n,
+            "batch": batch,
+            "legacy_ms": round(legacy_ms, 3),
+            "scorer_ms": round(scorer_ms, 3),
+            "speedup": round(legacy_ms / scorer_ms, 1) if scorer_ms > 0 else float("inf"),
+        })
+    return rows
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-benchmark KNNScorer against per-query sklearn scoring.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[70, 1_000, 10_000, 50_000],
+                        help="Prototype counts to benchmark.")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension (text-embedding-3-small = 1536).")
+    parser.add_argument("--batch", type=int, default=5, help="Queries routed per call (query + subtasks).")
+    parser.add_argument("--repeats", type=int, default=20, help="Timed repetitions per size (median reported).")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    rows = run_knn_benchmark(args.sizes, args.dim, args.batch, args.repeats)
+    print(f"\nKNN SCORING BENCHMARK (dim={args.dim}, batch={args.batch}, k={KNN_K_VALUE})")
+    print(f"  {'prototypes':>10}  {'legacy_ms':>10}  {'scorer_ms':>10}  {'speedup':>8}")
+    for row in rows:
+        print(f"  {row['prototypes']:>10}  {row['legacy_ms']:>10.3f}  {row['scorer_ms']:>10.3f}  {row['speedup']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
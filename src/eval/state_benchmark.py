@@ -0,0 +1,228 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+from typing import TypedDict
+
+from langgraph.graph import StateGraph, END
+from langgraph.checkpoint.memory import InMemorySaver
+
+from core.state import NexusState
+from core.checkpointer import BoundedMemorySaver, SQLiteSaver
+from core.config import CHECKPOINT_PAYLOAD_MIN_BYTES, CHECKPOINT_COMPRESS_MIN_BYTES
+
+# Bytes per checkpoint for the graph state as it was ("before": totals copied by every node,
+# set_final re-appending worker_responses, no payload references, InMemorySaver versions) and
+# as it is now ("after"). Nodes replay the updates the real ones return for three typical
+# paths, without calling any model, so the numbers are the state and checkpoint cost alone.
+
+# The old schema: plain float totals, overwritten by each node
+LegacyState = TypedDict("LegacyState", {**NexusState.__annotations__, "total_cost": float, "total_latency": float})
+
+
+class _LegacyMemorySaver(BoundedMemorySaver):
+    get_next_version = InMemorySaver.get_next_version
+
+
+class _LegacySQLiteSaver(SQLiteSaver):
+    get_next_version = InMemorySaver.get_next_version
+
+
+def _entry(node: str, action: str, detail: str) -> dict:
+    return {"node": node, "action": action, "detail": detail, "timestamp": time.time(), "latency_ms": 180.0}
+
+
+_WORDS = ("the a pivot list partition recursion each element smaller larger than sorted order worst case average "
+          "time memory stack call array index swap left right half merge treaty war economy inflation debt "
+          "reparations alliance empire trade industry labour price market policy cause effect result because "
+          "however therefore while which when after before during between under over into from with without").split()
+
+
+def _answer(model: str, chars: int, subtask: str | None = None) -> dict:
+    # Word salad rather than a repeated sentence, so zlib sees roughly prose-like entropy
+    rng = random.Random(f"{model}|{subtask}")
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(rng.choice(_WORDS))
+    response = {"model": model, "response": " ".join(words)[:chars], "cost_usd": 2e-4, "latency_ms": 1400.0, "ttft_ms": 210.0,
+                "queue_wait_ms": 0.0, "error": False, "finish_reason": "stop"}
+    if subtask:
+        response["subtask"] = subtask
+    return response
+
+
+SUBTASKS = ["explain the causes of WWI", "summarize its economic impact", "list the main treaties"]
+MODELS = ["groq/moonshotai/kimi-k2-instruct-0905", "cerebras/qwen-3-235b-a22b-instruct-2507", "groq/openai/gpt-oss-120b"]
+
+# node -> fn(state, chars) -> (update, cost_usd, latency_s)
+STEPS = {
+    "classifier": lambda state, chars: ({
+        "can_self_answer": False, "is_ambiguous": False, "is_critical": state["query"].startswith("critical"),
+        "clarifying_question": "", "original_query": state["query"],
+        "subtasks": SUBTASKS if state["query"].startswith("multi") else [],
+        "trace": [_entry("classifier", "classified", "self=False ambiguous=False critical=False subtasks=0")],
+    }, 1e-5, 0.35),
+    "planner": lambda state, chars: ({
+        "subtasks": state["subtasks"], "trace": [_entry("planner", "kept", "3 subtasks -> 3 calls (merged=0 dropped=0)")],
+    }, 0.0, 0.02),
+    "knn_router": lambda state, chars: ({
+        "cache_hit": False,
+        "selected_models": MODELS[:len(state["subtasks"])] if state["subtasks"] else MODELS[:1],
+        "knn_scores": {model: 0.8 - i / 10 for i, model in enumerate(MODELS)},
+        "subtask_knn_scores": [{model: 0.7 for model in MODELS} for _ in state["subtasks"]],
+        "trace": [_entry("knn_router", "routed", f"models=[{MODELS[0]}] top_score=0.812 embed=41ms texts=1 cached=0")],
+    }, 2e-7, 0.04),
+    "worker": lambda state, chars: ({
+        "worker_responses": [_answer(state["selected_models"][0], chars)],
+        "trace": [_entry("worker", "completed", f"Model {state['selected_models'][0]} responded.")],
+    }, 2e-4, 1.4),
+    "parallel_worker": lambda state, chars: ({
+        "worker_responses": [_answer(m, chars, s) for m, s in zip(state["selected_models"], state["subtasks"])],
+        "subtasks_judged": False,
+        "trace": [_entry("parallel_workers", "fan_out", "3 agents dispatched (streaming)")],
+    }, 6e-4, 1.6),
+    "aggregator": lambda state, chars: ({
+        "aggregated_response": "\n\n".join(w["response"] for w in state["worker_responses"]),
+        "trace": [_entry("aggregator", "merged", "Merged 3 responses using gemini/gemini-2.5-flash")],
+    }, 3e-4, 2.1),
+    "judge": lambda state, chars: ({
+        "judge_score": 4.0, "judge_feedback": "Misses the edge case of an empty list.",
+        "escalation_model": "openrouter/anthropic/claude-opus-4.6", "escalation_instruction": "Handle empty input.",
+        "escalation_prefetch": None,
+        "trace": [_entry("judge", "rejected", "Score 4.0. Reason: Misses the edge case of an empty list.")],
+    }, 1e-4, 0.9),
+    "escalation_worker": lambda state, chars: ({
+        "final_response": _answer("openrouter/anthropic/claude-opus-4.6", chars)["response"],
+        "escalation_count": state.get("escalation_count", 0) + 1,
+        "trace": [_entry("escalation_worker", "escalated_response", "Used openrouter/anthropic/claude-opus-4.6 after judge rejection.")],
+    }, 4e-3, 3.2),
+}
+
+PATHS = {
+    "single": ["classifier", "knn_router", "worker"],
+    "critical": ["classifier", "knn_router", "worker", "judge", "escalation_worker"],
+    "multi_part": ["classifier", "planner", "knn_router", "parallel_worker", "aggregator"],
+}
+QUERIES = {"single": "write quicksort in python", "critical": "critical: fix the payment race",
+           "multi_part": "multi: WWI causes, economics and treaties"}
+
+
+def _node(step, chars: int, legacy: bool):
+    def run(state):
+        update, cost, latency_s = step(state, chars)
+        if legacy:
+            update.update({"total_cost": state.get("total_cost", 0.0) + cost,
+                           "total_latency": state.get("total_latency", 0.0) + latency_s})
+        else:
+            update.update({"total_cost": cost, "total_latency": latency_s})
+        return update
+    return run
+
+
+def _final(legacy: bool):
+    def run(state):
+        workers = state.get("worker_responses", [])
+        if state.get("escalation_count", 0) and state.get("final_response"):
+            res = state["final_response"]
+        else:
+            res = state.get("aggregated_response") or workers[-1]["response"]
+        if not legacy:
+            return {"final_response": res}
+        # What set_final used to return
+        return {
+            "final_response": res,
+            "total_cost": state.get("total_cost", 0.0),
+            "total_latency": state.get("total_latency", 0.0),
+            "selected_models": state.get("selected_models", []),
+            "worker_responses": state.get("worker_responses", []),
+            "escalation_count": state.get("escalation_count", 0),
+            "escalation_model": state.get("escalation_model"),
+        }
+    return run
+
+
+def build_graph(path: str, legacy: bool, chars: int, checkpointer):
+    workflow = StateGraph(LegacyState if legacy else NexusState)
+    nodes = PATHS[path]
+    for name in nodes:
+        workflow.add_node(name, _node(STEPS[name], chars, legacy))
+    workflow.add_node("set_final", _final(legacy))
+    workflow.set_entry_point(nodes[0])
+    for a, b in zip(nodes, nodes[1:] + ["set_final"]):
+        workflow.add_edge(a, b)
+    workflow.add_edge("set_final", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def _saver(backend: str, legacy: bool, db_path: str):
+    bounds = {"ttl_s": 1e9, "max_checkpoints_per_thread": 1000}
+    payload_min_bytes = 0 if legacy else CHECKPOINT_PAYLOAD_MIN_BYTES
+    if backend == "memory":
+        cls = _LegacyMemorySaver if legacy else BoundedMemorySaver
+        return cls(max_bytes=1 << 40, payload_min_bytes=payload_min_bytes, **bounds)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    cls = _LegacySQLiteSaver if legacy else SQLiteSaver
+    return cls(db_path, batch_rows=256, compress_min_bytes=CHECKPOINT_COMPRESS_MIN_BYTES,
+               payload_min_bytes=payload_min_bytes, **bounds)
+
+
+def run_state_benchmark(path: str, backend: str, legacy: bool, sessions: int, chars: int, db_path: str) -> dict:
+    saver = _saver(backend, legacy, db_path)
+    graph = build_graph(path, legacy, chars, saver)
+    configs = [{"configurable": {"thread_id": f"{path}-{i}"}} for i in range(sessions)]
+
+    start = time.perf_counter()
+    for config in configs:
+        graph.invoke({"query": QUERIES[path], "trace": [], "worker_responses": [], "total_cost": 0.0,
+                      "total_latency": 0.0}, config=config)
+        saver.flush()
+    run_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    final = [graph.get_state(config).values for config in configs][-1]
+    load_s = time.perf_counter() - start
+
+    stats = saver.stats()
+    stored = stats["bytes"] if backend == "memory" else stats["serialized_bytes_written"]
+    if backend == "sqlite":
+        saver.close()
+    return {
+        "checkpoints_per_session": round(stats["checkpoints"] / sessions, 1),
+        "bytes_per_session": round(stored / sessions),
+        "bytes_per_checkpoint": round(stored / stats["checkpoints"]),
+        "run_ms_per_session": round(run_s / sessions * 1000, 3),
+        "get_state_ms": round(load_s / sessions * 1000, 3),
+        "worker_responses": len(final["worker_responses"]),
+        "total_cost": round(final["total_cost"], 6),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Checkpoint bytes per step, before vs after the compact graph state.")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--response-chars", type=int, default=2000, help="Length of each synthetic model answer.")
+    parser.add_argument("--backend", nargs="+", choices=["memory", "sqlite"], default=["memory", "sqlite"])
+    parser.add_argument("--path", default=os.path.join(tempfile.gettempdir(), "nexus_state_bench.sqlite"))
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    print("\nSTATE / CHECKPOINT SIZE BENCHMARK")
+    print(f"  {args.sessions} sessions per run, {args.response_chars}-char answers, "
+          f"payload refs >= {CHECKPOINT_PAYLOAD_MIN_BYTES} bytes")
+    for backend in args.backend:
+        for path in PATHS:
+            before = run_state_benchmark(path, backend, True, args.sessions, args.response_chars, args.path)
+            after = run_state_benchmark(path, backend, False, args.sessions, args.response_chars, args.path)
+            saved = 1 - after["bytes_per_checkpoint"] / before["bytes_per_checkpoint"]
+            print(f"\n  [{backend}] {path}  (bytes per checkpoint -{saved:.0%})")
+            for key in before:
+                print(f"    {key:<24} {before[key]:>12} -> {after[key]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -29,9 +29,12 @@ def init_state() -> None:
             st.session_state[key] = value
 
 
-def parse_sse_stream(response):
+def parse_sse_stream(response, placeholder=None):
+    """Consume the SSE stream. Token events are rendered progressively into `placeholder`."""
     final_payload = None
     interrupt_question = ""
+    streamed = ""
+    streaming_node = None
 
     for line in response.iter_lines():
         if not line:
@@ -42,10 +45,30 @@ def parse_sse_stream(response):
 
         data = json.loads(decoded[6:])
         event_type = data.get("type")
-        if event_type == "trace":
-            st.session_state.current_trace.append(data["entry"])
+        if event_type == "token":
+            # A new node streaming (e.g. escalation after a rejected answer) replaces the draft
+            if data.get("node") != streaming_node:
+                streaming_node = data.get("node")
+                streamed = ""
+            streamed += data.get("text", "")
+            if placeholder is not None:
+                placeholder.markdown(streamed + "▌")
+        elif event_type == "subtask":
+            if placeholder is not None and streaming_node is None:
+                placeholder.markdown(
+                    f"Subtasks: {data.get('completed')}/{data.get('total')} done "
+                    f"(latest: {data.get('subtask')} — {data.get('status')})"
+                )
+        elif event_type == "trace":
+            entry = data["entry"]
+            st.session_state.current_trace.append(entry)
             if data.get("knn_scores"):
                 st.session_state.knn_scores = data["knn_scores"]
+            if entry.get("node") == "speculation" and entry.get("action") == "cancelled":
+                # The speculative draft is discarded; the real worker will stream again
+                streaming_node, streamed = None, ""
+                if placeholder is not None:
+                    placeholder.markdown("Gathering agents...")
         elif event_type == "interrupt":
             st.session_state.waiting_for_clarification = True
             interrupt_question = data.get("question", "")
@@ -82,9 +105,13 @@ def render_final_message(final_payload: dict) -> str:
 init_state()
 
 NODE_ICONS = {
+    "fast_router": "[FAST]",
     "classifier": "[CLASSIFY]",
     "knn_router": "[ROUTE]",
+    "response_cache": "[CACHE]",
+    "speculation": "[SPECULATE]",
     "hitl": "[CLARIFY]",
+    "planner": "[PLAN]",
     "worker": "[GENERATE]",
     "parallel_workers": "[PARALLEL]",
     "aggregator": "[MERGE]",
@@ -156,8 +183,12 @@ with left_col:
                     payload = {"session_id": st.session_state.session_id, "answer": user_answer}
                     response = requests.post(f"{API_URL}/resume", json=payload, stream=True)
                     st.session_state.waiting_for_clarification = False
+                    if response.headers.get("content-type", "").startswith("application/json"):
+                        # "Session expired" / "Session not found"
+                        st.session_state.messages.append({"role": "assistant", "content": response.json()["error"]})
+                        st.rerun()
 
-                    final_payload, interrupt_question = parse_sse_stream(response)
+                    final_payload, interrupt_question = parse_sse_stream(response, st.empty())
                     if final_payload:
                         content = render_final_message(final_payload)
                         st.session_state.messages.append({"role": "assistant", "content": content})
@@ -184,7 +215,7 @@ with left_col:
                 try:
                     payload = {"query": query, "session_id": st.session_state.session_id}
                     response = requests.post(f"{API_URL}/chat", json=payload, stream=True)
-                    final_payload, interrupt_question = parse_sse_stream(response)
+                    final_payload, interrupt_question = parse_sse_stream(response, placeholder)
 
                     if final_payload:
                         content = render_final_message(final_payload)
@@ -0,0 +1,237 @@
+import time
+import asyncio
+
+import pytest
+from langgraph.graph import StateGraph, END
+from langgraph.types import Overwrite
+
+from core.state import NexusState
+from core.checkpointer import BoundedMemorySaver, SQLiteSaver, _REF, _next_version
+
+# A /chat-shaped graph (route -> worker -> set_final) driven turn after turn on one thread,
+# the way the UI reuses its session_id, against both checkpoint backends.
+CAP = 4
+
+
+def _body(query: str) -> str:
+    return f"Answer to {query}. " * 20
+
+
+def _router(state: NexusState) -> dict:
+    return {
+        "selected_models": ["groq/llama-3.1-8b-instant"],
+        "trace": [{"node": "knn_router", "action": "routed", "detail": f"routed {state['query']} " * 8, "timestamp": time.time()}],
+    }
+
+
+def _worker(state: NexusState) -> dict:
+    return {
+        "worker_responses": [{"model": "groq/llama-3.1-8b-instant", "response": _body(state["query"]), "cost_usd": 1e-5,
+                              "latency_ms": 420.0, "error": False}],
+        "trace": [{"node": "worker", "action": "completed", "detail": "synthetic", "timestamp": time.time()}],
+        "total_cost": 1e-5,
+        "total_latency": 0.42,
+    }
+
+
+def _final(state: NexusState) -> dict:
+    return {"final_response": state["worker_responses"][-1]["response"]}
+
+
+def build_graph(checkpointer):
+    workflow = StateGraph(NexusState)
+    workflow.add_node("knn_router", _router)
+    workflow.add_node("worker", _worker)
+    workflow.add_node("set_final", _final)
+    workflow.set_entry_point("knn_router")
+    workflow.add_edge("knn_router", "worker")
+    workflow.add_edge("worker", "set_final")
+    workflow.add_edge("set_final", END)
+    return workflow.compile(checkpointer=checkpointer)
+
+
+def run_turn(graph, thread_id: str, query: str) -> None:
+    # The same reset of the accumulating channels /chat sends
+    graph.invoke({"query": query, "trace": Overwrite([]), "worker_responses": Overwrite([]), "final_response": "",
+                  "total_cost": Overwrite(0.0), "total_latency": Overwrite(0.0)},
+                 config={"configurable": {"thread_id": thread_id}})
+    graph.checkpointer.flush()
+
+
+def counts(saver, thread_id: str) -> dict:
+    """Stored checkpoints, blobs and payloads of one thread."""
+    if isinstance(saver, BoundedMemorySaver):
+        return {
+            "checkpoints": sum(len(c) for c in saver.storage.get(thread_id, {}).values()),
+            "blobs": len(saver._thread_blobs.get(thread_id, ())),
+            "payloads": len(saver._thread_payloads.get(thread_id, ())),
+        }
+    saver.flush()
+    return {table: saver._db.execute(f"SELECT COUNT(*) FROM {table} WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+            for table in ("checkpoints", "blobs", "payloads")}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def make_saver(backend, tmp_path):
+    savers = []
+
+    def make(*, ttl_s=3600.0, max_checkpoints_per_thread=CAP, max_bytes=1 << 30, payload_min_bytes=64):
+        if backend == "memory":
+            saver = BoundedMemorySaver(ttl_s=ttl_s, max_checkpoints_per_thread=max_checkpoints_per_thread,
+                                       max_bytes=max_bytes, payload_min_bytes=payload_min_bytes)
+        else:
+            saver = SQLiteSaver(str(tmp_path / "checkpoints.sqlite"), ttl_s=ttl_s,
+                                max_checkpoints_per_thread=max_checkpoints_per_thread, batch_rows=64,
+                                compress_min_bytes=256, payload_min_bytes=payload_min_bytes)
+        savers.append(saver)
+        return saver
+
+    yield make
+    for saver in savers:
+        if isinstance(saver, SQLiteSaver):
+            saver.close()
+
+
+def test_long_thread_stays_bounded(make_saver):
+    saver = make_saver()
+    graph = build_graph(saver)
+    seen = {}
+    for turn in range(1, 41):
+        run_turn(graph, "session", f"question {turn}")
+        if turn in (10, 40):
+            seen[turn] = counts(saver, "session")
+
+    assert seen[40]["checkpoints"] == CAP
+    # Steady state: every turn stores as many blobs and payloads as trimming drops
+    assert seen[40] == seen[10]
+    assert saver.trimmed_checkpoints > 0
+
+
+def test_get_tuple_round_trips_values(make_saver, backend, tmp_path):
+    saver = make_saver()
+    graph = build_graph(saver)
+    for turn in range(1, 13):
+        run_turn(graph, "session", f"question {turn}")
+
+    values = graph.get_state({"configurable": {"thread_id": "session"}}).values
+    assert values["query"] == "question 12"
+    assert values["final_response"] == _body("question 12")
+    assert [w["response"] for w in values["worker_responses"]] == [_body("question 12")]
+    assert [e["node"] for e in values["trace"]] == ["knn_router", "worker"]
+    assert values["trace"][0]["detail"] == "routed question 12 " * 8
+    assert values["total_cost"] == pytest.approx(1e-5)
+
+    config = {"configurable": {"thread_id": "session", "checkpoint_ns": ""}}
+    tup = saver.get_tuple(config)
+    assert tup.checkpoint["channel_values"]["final_response"] == _body("question 12")
+    if backend == "sqlite":
+        # Another process opening the same file sees the same state
+        other = SQLiteSaver(str(tmp_path / "checkpoints.sqlite"), ttl_s=3600.0, max_checkpoints_per_thread=CAP,
+                            batch_rows=64, compress_min_bytes=256, payload_min_bytes=64)
+        assert other.get_tuple(config).checkpoint["channel_values"] == tup.checkpoint["channel_values"]
+        other.close()
+
+
+def test_async_api_round_trips(make_saver):
+    saver = make_saver()
+    graph = build_graph(saver)
+    config = {"configurable": {"thread_id": "session"}}
+
+    async def run() -> dict:
+        for turn in range(1, 7):
+            await graph.ainvoke({"query": f"question {turn}", "trace": Overwrite([]), "worker_responses": Overwrite([])},
+                                config=config)
+        return (await graph.aget_state(config)).values
+
+    values = asyncio.run(run())
+    assert values["final_response"] == _body("question 6")
+    assert counts(saver, "session")["checkpoints"] == CAP
+
+
+def test_values_that_look_like_references_round_trip(make_saver):
+    saver = make_saver()
+    graph = build_graph(saver)
+    query = _REF + "0123456789abcdef01234567"  # shorter than payload_min_bytes, still escaped
+    run_turn(graph, "session", query)
+
+    values = graph.get_state({"configurable": {"thread_id": "session"}}).values
+    assert values["query"] == query
+    assert values["final_response"] == _body(query)
+
+
+def test_ttl_sweep_removes_idle_threads(make_saver):
+    saver = make_saver(ttl_s=0.05)
+    graph = build_graph(saver)
+    run_turn(graph, "idle", "question")
+    time.sleep(0.1)
+
+    assert asyncio.run(saver.asweep()) == 1  # what the API's periodic sweeper awaits
+    assert counts(saver, "idle") == {"checkpoints": 0, "blobs": 0, "payloads": 0}
+    assert asyncio.run(saver.astats())["threads"] == 0
+    assert saver.get_tuple({"configurable": {"thread_id": "idle", "checkpoint_ns": ""}}) is None
+
+
+def test_evicted_threads_are_told_apart_from_unknown_ones(make_saver):
+    saver = make_saver(ttl_s=0.2)
+    graph = build_graph(saver)
+    run_turn(graph, "idle", "question")
+    run_turn(graph, "deleted", "question")
+    saver.delete_thread("deleted")
+    time.sleep(0.25)
+    saver.sweep()
+
+    # What /resume checks to answer "Session expired" rather than "Session not found"
+    assert asyncio.run(saver.aevicted("idle"))
+    assert not saver.evicted("deleted")
+    assert not saver.evicted("never-seen")
+    time.sleep(0.25)
+    saver.sweep()
+    assert not saver.evicted("idle")  # remembered for ttl_s only
+
+
+def test_lru_budget_evicts_least_recent_thread(make_saver, backend):
+    if backend != "memory":
+        pytest.skip("the byte budget applies to the in-memory backend")
+    probe = make_saver()
+    run_turn(build_graph(probe), "probe", "question 0")
+    per_thread = probe.total_bytes
+
+    saver = make_saver(max_bytes=int(per_thread * 1.5))
+    graph = build_graph(saver)
+    run_turn(graph, "old", "question 1")
+    run_turn(graph, "new", "question 2")
+
+    assert saver.lru_evictions == 1
+    assert saver.evicted("old")
+    assert counts(saver, "old") == {"checkpoints": 0, "blobs": 0, "payloads": 0}
+    assert counts(saver, "new")["checkpoints"] > 0
+    assert saver.total_bytes <= saver.max_bytes
+
+
+def test_trim_keeps_only_versions_of_kept_checkpoints(make_saver, backend):
+    saver = make_saver(max_checkpoints_per_thread=1)
+    graph = build_graph(saver)
+    for turn in range(5):
+        run_turn(graph, "session", f"question {turn}")
+
+    tup = saver.get_tuple({"configurable": {"thread_id": "session", "checkpoint_ns": ""}})
+    versions = tup.checkpoint["channel_versions"]
+    if backend == "memory":
+        stored = {(channel, version) for _, _, channel, version in saver._thread_blobs["session"]}
+    else:
+        stored = set(saver._db.execute("SELECT channel, version FROM blobs WHERE thread_id = ?", ("session",)))
+    assert stored == set(versions.items())
+
+
+def test_versions_sort_lexically():
+    versions = [None]
+    for _ in range(300):
+        versions.append(_next_version(None, versions[-1]))
+    versions = versions[1:]
+    assert sorted(versions) == versions
+    assert {len(v) for v in versions} == {17}
@@ -0,0 +1,25 @@
+import asyncio
+
+import numpy as np
+
+from core.embed_cache import EmbeddingCache, cache_key
+
+
+def test_persistent_tier_creates_its_directory_and_batches_writes(tmp_path):
+    path = tmp_path / "data" / "embeddings.sqlite"  # parent does not exist yet
+    cache = EmbeddingCache(max_size=10, ttl_s=3600, path=str(path))
+    keys = [cache_key(f"query {i}", "test-embedder") for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, np.full(4, i, dtype=np.float32))
+
+    # Buffered until flush; the memory tier serves them meanwhile
+    assert cache.pending == 3
+    assert cache._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 0
+    assert cache.get(keys[1])[0] == 1.0
+
+    asyncio.run(asyncio.to_thread(cache.flush))  # how embed_texts commits them
+    assert cache.pending == 0
+
+    reopened = EmbeddingCache(max_size=10, ttl_s=3600, path=str(path))
+    assert reopened.get(keys[2])[0] == 2.0
+    assert reopened.persistent_hits == 1